@@ -0,0 +1,42 @@
+"""Times hashing kit passwords with different numbers of worker processes"""
+from __future__ import division
+from collections import OrderedDict
+from multiprocessing import cpu_count
+
+from knimin.lib.hashing import hash_passwords
+from knimin.lib.util import make_passwd
+from knimin.benchmarks.runner import _time
+
+
+def default_workers():
+    """Numbers of workers benchmarked by default: 1, 4 and one per CPU"""
+    return sorted({1, 4, cpu_count()})
+
+
+def benchmark_hashing(num_kits, workers=None, repeat=1):
+    """Times hashing the passwords of a run of kits
+
+    Parameters
+    ----------
+    num_kits : int
+        Number of kit passwords to hash
+    workers : list of int, optional
+        Numbers of worker processes to time. Default default_workers()
+    repeat : int, optional
+        Number of times each is timed. Default 1
+
+    Returns
+    -------
+    OrderedDict
+        The timings keyed by number of workers, as returned by _time with
+        'kits_per_second' added for the best run
+    """
+    if workers is None:
+        workers = default_workers()
+    passwords = [make_passwd() for _ in range(num_kits)]
+    results = OrderedDict()
+    for n in workers:
+        timing = _time(lambda: list(hash_passwords(passwords, n)), repeat)
+        timing['kits_per_second'] = num_kits / timing['best']
+        results[n] = timing
+    return results
@@ -0,0 +1,91 @@
+"""Times building barcode label sheets, against the old Ghostscript path"""
+from __future__ import division
+from collections import OrderedDict
+from distutils.spawn import find_executable
+from os.path import join
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+
+from knimin.lib.squash_barcodes import build_barcodes_pdf, get_pages
+from knimin.lib.zpl import build_barcodes_zpl
+from knimin.benchmarks.runner import _time
+
+SIZES = (36, 360, 3600, 36000)
+
+
+def ghostscript_barcodes_pdf(barcodes):
+    """Builds the sheets the way build_barcodes_pdf used to
+
+    Each page is saved as a PDF by PIL and the pages are merged by
+    Ghostscript, which has to be installed.
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes to print
+
+    Returns
+    -------
+    str
+        The PDF
+    """
+    tmpdir = mkdtemp()
+    try:
+        pages = []
+        for i, page in enumerate(get_pages(barcodes)):
+            pages.append(join(tmpdir, "squash_barcode_page_%d.pdf" % i))
+            page.convert('RGB').save(pages[-1], quality=100)
+        cmd = ['gs', '-r150', '-q', '-sPAPERSIZE=a4', '-dNOPAUSE', '-dBATCH',
+               '-sDEVICE=pdfwrite', '-sOutputFile=-'] + pages
+        output, _ = Popen(cmd, stdout=PIPE).communicate()
+    finally:
+        rmtree(tmpdir)
+    return output
+
+
+def benchmark_printouts(sizes=SIZES, repeat=1, ghostscript=None,
+                        workers=None):
+    """Times building the label sheets for different numbers of barcodes
+
+    Parameters
+    ----------
+    sizes : list of int, optional
+        Numbers of barcodes to print. Default SIZES
+    repeat : int, optional
+        Number of times each is timed. Default 1
+    ghostscript : bool, optional
+        Whether to time the Ghostscript path too. Default whether gs is
+        installed
+    workers : int, optional
+        Number of processes rendering pages in process. Default one per CPU
+
+    Returns
+    -------
+    OrderedDict
+        {size: {'in_process': timing, 'vector': timing, 'zpl': timing,
+        'ghostscript': timing}}, with the timings as returned by _time plus
+        'labels_per_second' and 'bytes'
+    """
+    if ghostscript is None:
+        ghostscript = find_executable('gs') is not None
+    builders = [('in_process',
+                 lambda barcodes: build_barcodes_pdf(barcodes, workers)),
+                ('vector',
+                 lambda barcodes: build_barcodes_pdf(barcodes, vector=True)),
+                ('zpl', build_barcodes_zpl)]
+    if ghostscript:
+        builders.append(('ghostscript', ghostscript_barcodes_pdf))
+
+    results = OrderedDict()
+    for size in sizes:
+        barcodes = ['%09d' % i for i in range(1, size + 1)]
+        results[size] = OrderedDict()
+        for name, builder in builders:
+            pdf = []
+            timing = _time(lambda: pdf.append(len(builder(barcodes))),
+                           repeat)
+            timing['labels_per_second'] = size / timing['best']
+            timing['bytes'] = pdf[-1]
+            results[size][name] = timing
+    return results
@@ -0,0 +1,189 @@
+"""Times the pulldown functions and keeps the results between commits"""
+from __future__ import division
+from collections import OrderedDict
+from datetime import datetime
+from json import dump, load
+from os.path import dirname, abspath, exists
+from subprocess import check_output, CalledProcessError
+from time import time
+
+from knimin.benchmarks.synthetic import EXTERNAL_SURVEY
+
+BENCHMARKS = ('get_surveys', 'format_survey_data', 'format_environmental',
+              'pulldown', 'check_consent')
+
+
+def _time(func, repeat, setup=None):
+    """Times a function
+
+    Parameters
+    ----------
+    func : function
+        The function to time
+    repeat : int
+        Number of times to run the function
+    setup : function, optional
+        Called before each run, outside the timing. Its return value is
+        passed to func as the arguments. Default no arguments
+
+    Returns
+    -------
+    dict
+        {'best': seconds, 'mean': seconds, 'runs': [seconds, ...]}
+    """
+    runs = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time()
+        func(*args)
+        runs.append(time() - start)
+    return {'best': min(runs), 'mean': sum(runs) / len(runs), 'runs': runs}
+
+
+def run_benchmarks(db, barcodes, environmental, repeat=3):
+    """Times each of the pulldown functions on the given samples
+
+    Parameters
+    ----------
+    db : KniminAccess
+        Access to the database holding the samples
+    barcodes : list of str
+        Human and animal sample barcodes
+    environmental : list of (str, str)
+        Barcode and environment sampled of the environmental samples
+    repeat : int, optional
+        Number of times each function is run. Default 3
+
+    Returns
+    -------
+    OrderedDict
+        The timings of each function, keyed by name, as returned by _time
+    """
+    all_barcodes = list(barcodes) + [b for b, _ in environmental]
+    results = OrderedDict()
+    results['get_surveys'] = _time(lambda: db.get_surveys(barcodes), repeat)
+    # formatting changes the survey data in place, so it is fetched anew
+    results['format_survey_data'] = _time(
+        lambda md: db.format_survey_data(md, [EXTERNAL_SURVEY]), repeat,
+        setup=lambda: (db.get_surveys(barcodes),))
+    results['format_environmental'] = _time(
+        lambda: db.format_environmental(environmental), repeat)
+    # pulldown adds to the list of barcodes given, so each run gets a copy
+    results['pulldown'] = _time(
+        lambda bcs: db.pulldown(bcs, external=[EXTERNAL_SURVEY]), repeat,
+        setup=lambda: (list(all_barcodes),))
+    results['check_consent'] = _time(
+        lambda: db.check_consent(all_barcodes), repeat)
+    return results
+
+
+def current_commit():
+    """Gets the commit the code is running from
+
+    Returns
+    -------
+    str
+        Abbreviated commit hash, ending in -dirty if there are uncommitted
+        changes, or 'unknown' if not running from a git checkout
+    """
+    try:
+        return check_output(['git', 'describe', '--always', '--dirty'],
+                            cwd=dirname(abspath(__file__))).strip()
+    except (OSError, CalledProcessError):
+        return 'unknown'
+
+
+def load_results(fp):
+    """Loads stored benchmark results
+
+    Parameters
+    ----------
+    fp : str
+        Path to the results file
+
+    Returns
+    -------
+    dict
+        Stored results in the form
+        {commit: {'date': str, 'results': {size: {benchmark: timing}}}},
+        empty if the file does not exist
+    """
+    if not exists(fp):
+        return {}
+    with open(fp) as f:
+        return load(f)
+
+
+def save_results(fp, commit, results):
+    """Stores benchmark results for a commit, replacing any already stored
+
+    Parameters
+    ----------
+    fp : str
+        Path to the results file
+    commit : str
+        Commit the results are for
+    results : dict
+        Timings in the form {size: {benchmark: timing}}
+    """
+    stored = load_results(fp)
+    stored[commit] = {'date': datetime.now().isoformat(),
+                      'results': {str(k): v for k, v in results.items()}}
+    with open(fp, 'w') as f:
+        dump(stored, f, indent=4, sort_keys=True)
+
+
+def previous_results(stored, commit):
+    """Gets the most recently stored results for a different commit
+
+    Parameters
+    ----------
+    stored : dict
+        Stored results, as returned by load_results
+    commit : str
+        Commit to find the predecessor of
+
+    Returns
+    -------
+    tuple of (str, dict) or None
+        The commit and its results, or None if there are no others
+    """
+    others = [(v['date'], c) for c, v in stored.items() if c != commit]
+    if not others:
+        return None
+    _, previous = max(others)
+    return previous, stored[previous]['results']
+
+
+def compare_results(previous, current, tolerance=0.2):
+    """Compares the best times of two benchmark runs
+
+    Parameters
+    ----------
+    previous : dict
+        Earlier timings in the form {size: {benchmark: timing}}
+    current : dict
+        Current timings in the same form
+    tolerance : float, optional
+        Fraction a best time can grow by before it is a regression.
+        Default 0.2
+
+    Returns
+    -------
+    list of tuple
+        (size, benchmark, previous best, current best, change, regressed)
+        for each benchmark run at the same size in both, where change is
+        the fractional change in the best time
+    """
+    compared = []
+    for size, timings in sorted(current.items(), key=lambda x: int(x[0])):
+        before = previous.get(str(size), {})
+        for name in BENCHMARKS:
+            if name not in timings or name not in before:
+                continue
+            old = before[name]['best']
+            new = timings[name]['best']
+            change = (new - old) / old if old else 0.0
+            compared.append((size, name, old, new, change,
+                             change > tolerance))
+    return compared
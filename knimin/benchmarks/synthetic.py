@@ -0,0 +1,371 @@
+"""Generates American Gut shaped data for benchmarking
+
+All generated rows are tagged so they can be removed again: logins use the
+EMAIL_DOMAIN email domain, barcodes start with BARCODE_PREFIX, kit IDs with
+KIT_PREFIX and zipcodes with ZIP_PREFIX.
+"""
+from __future__ import division
+from io import BytesIO
+from json import dumps
+from random import Random
+from uuid import UUID
+
+from knimin.lib.constants import env_lookup
+from knimin.lib.data_access import KniminAccess
+
+EMAIL_DOMAIN = 'synthetic.invalid'
+BARCODE_PREFIX = '9'
+KIT_PREFIX = 'bnch_'
+ZIP_PREFIX = 'BN'
+EXTERNAL_SURVEY = 'Benchmark FFQ'
+
+# Fraction of samples of each kind, the rest are human samples
+ANIMAL_FRACTION = 0.1
+ENVIRONMENTAL_FRACTION = 0.1
+# Fraction of participants with answers to the external survey
+EXTERNAL_FRACTION = 0.3
+SAMPLES_PER_KIT = 3
+
+_WORDS = ['gut', 'microbe', 'diet', 'vegetables', 'coffee', 'yogurt',
+          'running', 'sleep', 'travel', 'probiotic', 'fiber', 'dog',
+          'garden', 'kimchi', 'cheese', 'swimming']
+
+_ENVIRONMENTS = sorted(env_lookup)
+
+# Columns written for each table, in the order the rows are generated
+_COLUMNS = {
+    'barcodes.barcode': ('barcode', 'status', 'scan_date', 'obsolete',
+                         'assigned_on'),
+    'barcodes.project_barcode': ('project_id', 'barcode'),
+    'ag.zipcodes': ('zipcode', 'country', 'latitude', 'longitude',
+                    'elevation', 'state'),
+    'ag.ag_login': ('ag_login_id', 'email', 'name', 'address', 'city',
+                    'state', 'zip', 'country'),
+    'ag.ag_kit': ('ag_kit_id', 'ag_login_id', 'supplied_kit_id',
+                  'kit_password', 'swabs_per_kit', 'kit_verification_code'),
+    'ag.ag_consent': ('ag_login_id', 'participant_name'),
+    'ag.ag_login_surveys': ('ag_login_id', 'survey_id', 'participant_name'),
+    'ag.ag_kit_barcodes': ('ag_kit_id', 'barcode', 'site_sampled',
+                           'environment_sampled', 'sample_date',
+                           'sample_time', 'survey_id'),
+    'ag.survey_answers': ('survey_id', 'survey_question_id', 'response'),
+    'ag.survey_answers_other': ('survey_id', 'survey_question_id',
+                                'response'),
+    'ag.external_survey_answers': ('survey_id', 'external_survey_id',
+                                   'pulldown_date', 'answers')}
+
+# Tables in the order they must be filled
+_TABLE_ORDER = ('barcodes.barcode', 'barcodes.project_barcode',
+                'ag.ag_login', 'ag.ag_kit', 'ag.ag_consent',
+                'ag.ag_login_surveys', 'ag.ag_kit_barcodes',
+                'ag.survey_answers', 'ag.survey_answers_other',
+                'ag.external_survey_answers')
+
+
+def _copy_value(value):
+    """Formats a value for the text format of COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_data(rows):
+    """Formats rows as the text format of COPY
+
+    Parameters
+    ----------
+    rows : iterable of tuple
+        The rows to format
+
+    Returns
+    -------
+    str
+        The rows, tab delimited, one per line
+    """
+    return ''.join('\t'.join(_copy_value(v) for v in row) + '\n'
+                   for row in rows)
+
+
+class SyntheticAG(object):
+    """Fills a database with generated American Gut logins, kits and samples
+
+    Parameters
+    ----------
+    db : KniminAccess
+        Access to the database to fill. It must already hold the American
+        Gut schema, surveys and questions
+    seed : int, optional
+        Seed for the random generator, so the same data is generated each
+        time. Default 0
+
+    Notes
+    -----
+    Human samples answer every question of survey 1 and animal samples every
+    question of survey 2, with SINGLE and MULTIPLE answers picked from the
+    allowed responses. Every zipcode used is added to the zipcodes table, so
+    pulling the samples down never calls the geocoder.
+    """
+    def __init__(self, db, seed=0):
+        self._db = db
+        self._seed = seed
+        self._rng = Random(seed)
+
+    def _load_questions(self):
+        """Gets the questions of each survey and their allowed responses"""
+        sql = """SELECT S.survey_id, survey_question_id, question_shortname,
+                     survey_response_type
+                 FROM ag.surveys S
+                 JOIN ag.group_questions USING (survey_group)
+                 JOIN ag.survey_question USING (survey_question_id)
+                 JOIN ag.survey_question_response_type
+                    USING (survey_question_id)
+                 ORDER BY S.survey_id, survey_question_id"""
+        questions = {}
+        for survey, qid, shortname, qtype in self._db._con.execute_fetchall(
+                sql):
+            questions.setdefault(survey, []).append((qid, shortname, qtype))
+
+        sql = """SELECT survey_question_id, response
+                 FROM ag.survey_question_response
+                 ORDER BY survey_question_id, display_index"""
+        responses = {}
+        for qid, response in self._db._con.execute_fetchall(sql):
+            responses.setdefault(qid, []).append(response)
+        return questions, responses
+
+    def _other_answer(self, shortname, qtype, zipcode):
+        """Makes the JSON encoded answer to a STRING or TEXT question"""
+        rng = self._rng
+        if shortname == 'ZIP_CODE':
+            value = zipcode
+        elif shortname == 'HEIGHT_CM':
+            value = str(rng.randint(50, 210))
+        elif shortname == 'WEIGHT_KG':
+            value = str(rng.randint(3, 150))
+        elif qtype == 'TEXT':
+            # free text keeps whatever whitespace the participant typed
+            value = ' '.join(rng.choice(_WORDS)
+                             for _ in range(rng.randint(5, 30)))
+            value = value.replace(' ', rng.choice([' ', '  ', '\t', '\n']),
+                                  1)
+        else:
+            value = rng.choice(_WORDS)
+        return dumps([value])
+
+    def _answers(self, survey_id, questions, responses, zipcode):
+        """Makes the answers of one participant to every survey question"""
+        rng = self._rng
+        answers = []
+        others = []
+        for qid, shortname, qtype in questions:
+            if qtype == 'SINGLE' and responses.get(qid):
+                answers.append((survey_id, qid, rng.choice(responses[qid])))
+            elif qtype == 'MULTIPLE' and responses.get(qid):
+                choices = responses[qid]
+                for response in rng.sample(
+                        choices, rng.randint(0, min(3, len(choices)))):
+                    answers.append((survey_id, qid, response))
+            elif qtype in ('STRING', 'TEXT'):
+                others.append((survey_id, qid,
+                               self._other_answer(shortname, qtype, zipcode)))
+        return answers, others
+
+    def _uuid(self):
+        return str(UUID(int=self._rng.getrandbits(128), version=4))
+
+    def generate(self, n_samples, questions, responses, zipcodes, project_id,
+                 external_survey_id, chunk_size=5000):
+        """Generates the rows for the given number of samples
+
+        Parameters
+        ----------
+        n_samples : int
+            Number of samples to generate
+        questions : dict of list of tuple
+            Questions for each survey, {survey: [(id, shortname, type)]}
+        responses : dict of list of str
+            Allowed responses for each question, {question_id: [response]}
+        zipcodes : list of (str, str)
+            (zipcode, country) pairs the logins live in
+        project_id : int
+            ID of the American Gut project
+        external_survey_id : int
+            ID of the external survey to answer
+        chunk_size : int, optional
+            Most samples generated before the rows are yielded. Default 5000
+
+        Yields
+        ------
+        dict of list of tuple
+            Rows to insert, keyed by table. The columns of each table are
+            given in _COLUMNS
+        """
+        rng = self._rng
+        rows = {t: [] for t in _TABLE_ORDER}
+        made = 0
+        login = 0
+        while made < n_samples:
+            login_id = self._uuid()
+            kit_id = self._uuid()
+            zipcode, country = rng.choice(zipcodes)
+            name = 'Participant %d' % login
+            rows['ag.ag_login'].append((
+                login_id, 'bench%07d@%s' % (login, EMAIL_DOMAIN), name,
+                '%d Synthetic St' % login, 'Benchmark', 'CA', zipcode,
+                country))
+            n_kit = min(SAMPLES_PER_KIT, n_samples - made)
+            rows['ag.ag_kit'].append((
+                kit_id, login_id, '%s%07d' % (KIT_PREFIX, login), 'unused',
+                n_kit, '%05d' % rng.randint(0, 99999)))
+
+            participants = {}
+            for i in range(n_kit):
+                barcode = '%s%08d' % (BARCODE_PREFIX, made)
+                made += 1
+                rows['barcodes.barcode'].append(
+                    (barcode, 'Received', '2016-01-01', 'N', '2016-01-01'))
+                rows['barcodes.project_barcode'].append((project_id, barcode))
+
+                draw = rng.random()
+                site = env = survey_id = None
+                if draw < ENVIRONMENTAL_FRACTION:
+                    env = rng.choice(_ENVIRONMENTS)
+                else:
+                    survey = 2 if draw < (ENVIRONMENTAL_FRACTION +
+                                          ANIMAL_FRACTION) else 1
+                    site = rng.choice(KniminAccess.human_sites if survey == 1
+                                      else KniminAccess.animal_sites)
+                    if survey not in participants:
+                        participants[survey] = '%016x' % rng.getrandbits(64)
+                        pname = '%s %d' % (name, survey)
+                        survey_id = participants[survey]
+                        rows['ag.ag_consent'].append((login_id, pname))
+                        rows['ag.ag_login_surveys'].append(
+                            (login_id, survey_id, pname))
+                        answers, others = self._answers(
+                            survey_id, questions.get(survey, []), responses,
+                            zipcode)
+                        rows['ag.survey_answers'].extend(answers)
+                        rows['ag.survey_answers_other'].extend(others)
+                        if rng.random() < EXTERNAL_FRACTION:
+                            rows['ag.external_survey_answers'].append((
+                                survey_id, external_survey_id, '2016-01-01',
+                                dumps({'Calories': rng.randint(800, 4000),
+                                       'FiberGrams': rng.randint(5, 60),
+                                       'Vegetarian': rng.choice(
+                                           ['Yes', 'No'])})))
+                    survey_id = participants[survey]
+                rows['ag.ag_kit_barcodes'].append((
+                    kit_id, barcode, site, env,
+                    '2015-%02d-%02d' % (rng.randint(1, 12),
+                                        rng.randint(1, 28)),
+                    '%02d:%02d' % (rng.randint(0, 23), rng.randint(0, 59)),
+                    survey_id))
+            login += 1
+
+            if len(rows['ag.ag_kit_barcodes']) >= chunk_size:
+                yield rows
+                rows = {t: [] for t in _TABLE_ORDER}
+        if rows['ag.ag_kit_barcodes']:
+            yield rows
+
+    def _copy(self, table, rows):
+        """Bulk loads rows into a table with COPY"""
+        sql = 'COPY %s (%s) FROM STDIN' % (table, ', '.join(_COLUMNS[table]))
+        self._db._con.copy_expert(sql, BytesIO(copy_data(rows)))
+
+    def populate(self, n_samples, chunk_size=5000):
+        """Adds the given number of synthetic samples to the database
+
+        Parameters
+        ----------
+        n_samples : int
+            Number of samples to add
+        chunk_size : int, optional
+            Most samples held in memory before they are written. Default 5000
+        """
+        con = self._db._con
+        self._rng = Random(self._seed)
+        questions, responses = self._load_questions()
+        countries = [c[0] for c in con.execute_fetchall(
+            "SELECT country FROM ag.iso_country_lookup ORDER BY country")]
+        project_id = con.execute_fetchone(
+            "SELECT project_id FROM barcodes.project WHERE project = %s",
+            ['American Gut Project'])[0]
+        external_survey_id = con.execute_fetchone(
+            """INSERT INTO ag.external_survey_sources
+               (external_survey, external_survey_description,
+                external_survey_url)
+               VALUES (%s, 'Synthetic benchmark data', 'http://invalid')
+               RETURNING external_survey_id""", [EXTERNAL_SURVEY])[0]
+
+        # roughly ten samples share each zipcode
+        zipcodes = [('%s%05d' % (ZIP_PREFIX, i), self._rng.choice(countries))
+                    for i in range(max(1, n_samples // 10))]
+        self._copy('ag.zipcodes', [
+            (z, c, round(self._rng.uniform(-60, 70), 6),
+             round(self._rng.uniform(-180, 180), 6),
+             round(self._rng.uniform(0, 3000), 1), 'ST')
+            for z, c in zipcodes])
+
+        for rows in self.generate(n_samples, questions, responses, zipcodes,
+                                  project_id, external_survey_id,
+                                  chunk_size):
+            for table in _TABLE_ORDER:
+                if rows[table]:
+                    self._copy(table, rows[table])
+
+    def clear(self):
+        """Removes all synthetic data from the database"""
+        con = self._db._con
+        pattern = ['%@' + EMAIL_DOMAIN]
+        logins = [r[0] for r in con.execute_fetchall(
+            "SELECT ag_login_id::text FROM ag.ag_login WHERE email LIKE %s",
+            pattern)]
+        surveys = [r[0] for r in con.execute_fetchall(
+            """SELECT survey_id FROM ag.ag_login_surveys
+               WHERE ag_login_id::text = ANY(%s)""", [logins])]
+        barcodes = [r[0] for r in con.execute_fetchall(
+            """SELECT barcode FROM ag.ag_kit_barcodes
+               JOIN ag.ag_kit USING (ag_kit_id)
+               WHERE supplied_kit_id LIKE %s""", ['%s%%' % KIT_PREFIX])]
+
+        for table in ('ag.external_survey_answers', 'ag.survey_answers_other',
+                      'ag.survey_answers'):
+            con.execute('DELETE FROM %s WHERE survey_id = ANY(%%s)' % table,
+                        [surveys])
+        con.execute("""DELETE FROM ag.external_survey_sources
+                       WHERE external_survey = %s""", [EXTERNAL_SURVEY])
+        con.execute("""DELETE FROM ag.ag_kit_barcodes
+                       WHERE barcode = ANY(%s)""", [barcodes])
+        for table in ('ag.ag_login_surveys', 'ag.ag_consent', 'ag.ag_kit',
+                      'ag.ag_login'):
+            con.execute('DELETE FROM %s WHERE ag_login_id::text = ANY(%%s)'
+                        % table, [logins])
+        for table in ('barcodes.project_barcode', 'barcodes.barcode'):
+            con.execute('DELETE FROM %s WHERE barcode = ANY(%%s)' % table,
+                        [barcodes])
+        con.execute("DELETE FROM ag.zipcodes WHERE zipcode LIKE %s",
+                    ['%s%%' % ZIP_PREFIX])
+
+    def samples(self):
+        """Gets the synthetic samples currently in the database
+
+        Returns
+        -------
+        barcodes : list of str
+            Barcodes of the human and animal samples
+        environmental : list of (str, str)
+            Barcode and environment sampled of the environmental samples
+        """
+        sql = """SELECT barcode, environment_sampled
+                 FROM ag.ag_kit_barcodes
+                 JOIN ag.ag_kit USING (ag_kit_id)
+                 WHERE supplied_kit_id LIKE %s
+                 ORDER BY barcode"""
+        rows = self._db._con.execute_fetchall(sql, ['%s%%' % KIT_PREFIX])
+        return ([r[0] for r in rows if r[1] is None],
+                [(r[0], r[1]) for r in rows if r[1] is not None])
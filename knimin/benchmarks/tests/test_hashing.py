@@ -0,0 +1,23 @@
+from unittest import TestCase, main
+
+from knimin.benchmarks.hashing import benchmark_hashing, default_workers
+
+
+class TestHashing(TestCase):
+    def test_default_workers(self):
+        obs = default_workers()
+        self.assertEqual(obs[0], 1)
+        self.assertIn(4, obs)
+        self.assertEqual(obs, sorted(set(obs)))
+
+    def test_benchmark_hashing(self):
+        obs = benchmark_hashing(4, [1, 2])
+        self.assertEqual(list(obs), [1, 2])
+        for timing in obs.values():
+            self.assertEqual(len(timing['runs']), 1)
+            self.assertAlmostEqual(timing['kits_per_second'],
+                                   4 / timing['best'])
+
+
+if __name__ == '__main__':
+    main()
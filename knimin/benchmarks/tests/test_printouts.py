@@ -0,0 +1,26 @@
+from unittest import TestCase, main
+
+from knimin.benchmarks.printouts import benchmark_printouts
+
+
+class TestPrintouts(TestCase):
+    def test_benchmark_printouts(self):
+        obs = benchmark_printouts([36, 40], ghostscript=False)
+        self.assertEqual(list(obs), [36, 40])
+        for size, timings in obs.items():
+            self.assertEqual(list(timings), ['in_process', 'vector', 'zpl'])
+            for timing in timings.values():
+                self.assertEqual(len(timing['runs']), 1)
+                self.assertAlmostEqual(timing['labels_per_second'],
+                                       size / timing['best'])
+                self.assertGreater(timing['bytes'], 0)
+
+    def test_benchmark_printouts_workers(self):
+        serial = benchmark_printouts([72], ghostscript=False, workers=1)
+        obs = benchmark_printouts([72], ghostscript=False, workers=2)
+        self.assertEqual(obs[72]['in_process']['bytes'],
+                         serial[72]['in_process']['bytes'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from unittest import TestCase, main
+from os import close, remove
+from os.path import exists
+from tempfile import mkstemp
+
+from knimin.benchmarks.runner import (_time, load_results, save_results,
+                                      previous_results, compare_results)
+
+
+class TestRunner(TestCase):
+    def setUp(self):
+        fd, self.results_fp = mkstemp(suffix='.json')
+        close(fd)
+        remove(self.results_fp)
+
+    def tearDown(self):
+        if exists(self.results_fp):
+            remove(self.results_fp)
+
+    def test_time(self):
+        calls = []
+        obs = _time(lambda x: calls.append(x), 3, setup=lambda: ('a',))
+        self.assertEqual(calls, ['a', 'a', 'a'])
+        self.assertEqual(len(obs['runs']), 3)
+        self.assertEqual(obs['best'], min(obs['runs']))
+
+    def test_load_results_missing(self):
+        self.assertEqual(load_results(self.results_fp), {})
+
+    def test_save_and_previous_results(self):
+        first = {1000: {'pulldown': {'best': 1.0}}}
+        second = {1000: {'pulldown': {'best': 2.0}}}
+        save_results(self.results_fp, 'abc123', first)
+        save_results(self.results_fp, 'def456', second)
+        stored = load_results(self.results_fp)
+        self.assertEqual(sorted(stored), ['abc123', 'def456'])
+        self.assertEqual(stored['def456']['results'],
+                         {'1000': {'pulldown': {'best': 2.0}}})
+
+        self.assertEqual(previous_results(stored, 'ghi789'),
+                         ('def456', stored['def456']['results']))
+        self.assertEqual(previous_results(stored, 'def456'),
+                         ('abc123', stored['abc123']['results']))
+        self.assertIsNone(previous_results({'abc123': {}}, 'abc123'))
+
+    def test_compare_results(self):
+        previous = {'1000': {'pulldown': {'best': 1.0},
+                             'get_surveys': {'best': 2.0}},
+                    '10000': {'pulldown': {'best': 10.0}}}
+        current = {1000: {'pulldown': {'best': 1.5},
+                          'get_surveys': {'best': 2.1},
+                          'check_consent': {'best': 0.1}}}
+        obs = compare_results(previous, current)
+        self.assertEqual([o[:2] for o in obs],
+                         [(1000, 'get_surveys'), (1000, 'pulldown')])
+        self.assertAlmostEqual(obs[0][4], 0.05)
+        self.assertFalse(obs[0][5])
+        self.assertAlmostEqual(obs[1][4], 0.5)
+        self.assertTrue(obs[1][5])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+from unittest import TestCase, main
+from json import loads
+
+from knimin.benchmarks.synthetic import (SyntheticAG, copy_data,
+                                         BARCODE_PREFIX, EMAIL_DOMAIN)
+
+
+class TestSynthetic(TestCase):
+    questions = {1: [(1, 'HEIGHT_CM', 'STRING'), (2, 'GENDER', 'SINGLE'),
+                     (3, 'ALLERGIC_TO', 'MULTIPLE'),
+                     (4, 'ABOUT_YOURSELF_TEXT', 'TEXT'),
+                     (5, 'ZIP_CODE', 'STRING')],
+                 2: [(6, 'ANIMAL_TYPE', 'SINGLE')]}
+    responses = {2: ['Male', 'Female'], 3: ['Peanuts', 'Shellfish'],
+                 6: ['Dog', 'Cat']}
+    zipcodes = [('BN00000', 'United States'), ('BN00001', 'Canada')]
+
+    def _generate(self, n, chunk_size=5000, seed=0):
+        return list(SyntheticAG(None, seed).generate(
+            n, self.questions, self.responses, self.zipcodes, 1, 7,
+            chunk_size))
+
+    def test_copy_data(self):
+        obs = copy_data([('a', None, 1), (u'caf\xe9', 'tab\there\\', 'x\ny')])
+        self.assertEqual(obs, 'a\t\\N\t1\ncaf\xc3\xa9\ttab\\there\\\\\t'
+                              'x\\ny\n')
+
+    def test_generate(self):
+        chunks = self._generate(100)
+        self.assertEqual(len(chunks), 1)
+        rows = chunks[0]
+        barcodes = [r[0] for r in rows['barcodes.barcode']]
+        self.assertEqual(len(barcodes), 100)
+        self.assertEqual(len(set(barcodes)), 100)
+        self.assertTrue(all(b.startswith(BARCODE_PREFIX) and len(b) == 9
+                            for b in barcodes))
+        # barcodes in a project are marked as assigned
+        self.assertTrue(all(r[4] for r in rows['barcodes.barcode']))
+        self.assertTrue(all(r[1].endswith('@' + EMAIL_DOMAIN)
+                            for r in rows['ag.ag_login']))
+        self.assertEqual(len(rows['ag.ag_kit_barcodes']), 100)
+
+        # every sample is either environmental or belongs to a survey
+        for kit_barcode in rows['ag.ag_kit_barcodes']:
+            self.assertTrue((kit_barcode[3] is None) !=
+                            (kit_barcode[6] is None))
+
+        # answers are only ever allowed responses
+        for survey_id, qid, response in rows['ag.survey_answers']:
+            self.assertIn(response, self.responses[qid])
+        for survey_id, qid, response in rows['ag.survey_answers_other']:
+            self.assertEqual(len(loads(response)), 1)
+        self.assertTrue(rows['ag.external_survey_answers'])
+
+    def test_generate_chunks(self):
+        chunks = self._generate(100, chunk_size=30)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(sum(len(c['ag.ag_kit_barcodes']) for c in chunks),
+                         100)
+
+    def test_generate_deterministic(self):
+        self.assertEqual(self._generate(50), self._generate(50))
+        self.assertNotEqual(self._generate(50), self._generate(50, seed=1))
+
+
+if __name__ == '__main__':
+    main()
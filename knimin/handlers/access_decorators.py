@@ -33,22 +33,23 @@ def set_access(access_levels=['Admin']):
                                             ', '.join(self._access_levels)))
 
             # Decorate the get post, put, and delete methods to restrict
-            # access automatically using decorator
+            # access automatically using decorator. What they return is
+            # passed on, so Tornado waits for the futures of coroutines
             def get(self):
                 self._has_access()
-                super(DecoratedClass, self).get()
+                return super(DecoratedClass, self).get()
 
             def post(self):
                 self._has_access()
-                super(DecoratedClass, self).post()
+                return super(DecoratedClass, self).post()
 
             def put(self):
                 self._has_access()
-                super(DecoratedClass, self).put()
+                return super(DecoratedClass, self).put()
 
             def delete(self):
                 self._has_access()
-                super(DecoratedClass, self).delete()
+                return super(DecoratedClass, self).delete()
 
         return DecoratedClass
     return class_modifier
@@ -3,6 +3,7 @@ from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 
 from knimin import db
+from knimin.lib.util import parse_kit_counts
 
 
 @set_access(['AG kits'])
@@ -10,16 +11,26 @@ class AGAddBarcodeKitHandler(BaseHandler):
     @authenticated
     def get(self):
         self.render("ag_add_barcode_kit.html", currentuser=self.current_user,
-                    kit_ids=db.get_used_kit_ids(), skid='', barcodes='')
+                    msg='', added=[])
 
     @authenticated
     def post(self):
-        supplied_kit_id = self.get_argument('kit_id')
-        num_barcodes = int(self.get_argument('num_barcodes'))
-
-        ag_kit_id = db.getAGKitDetails(supplied_kit_id)['ag_kit_id']
-        barcodes = db.add_barcodes_to_kit(ag_kit_id, num_barcodes)
+        msg = ''
+        added = []
+        try:
+            if 'kits_file' in self.request.files:
+                # kit ID and number of barcodes per line
+                lines = self.request.files['kits_file'][0]['body']
+                kit_counts = parse_kit_counts(lines.splitlines())
+            elif self.get_argument('kits', ''):
+                kit_counts = parse_kit_counts(
+                    self.get_argument('kits').splitlines())
+            else:
+                kit_counts = [(self.get_argument('kit_id').strip(),
+                               int(self.get_argument('num_barcodes')))]
+            added = db.add_barcodes_to_kits(kit_counts)
+        except ValueError as e:
+            msg = "ERROR! %s" % str(e)
 
         self.render("ag_add_barcode_kit.html", currentuser=self.current_user,
-                    kit_ids=db.get_used_kit_ids(), skid=supplied_kit_id,
-                    barcodes=', '.join(barcodes))
+                    msg=msg, added=added)
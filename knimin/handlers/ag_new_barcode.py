@@ -1,18 +1,25 @@
 #!/usr/bin/env python
+from tornado import gen
 from tornado.web import authenticated, HTTPError
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 
+from knimin.lib.background import run_in_thread
 from knimin.lib.squash_barcodes import build_barcodes_pdf
+from knimin.lib.zpl import iter_barcodes_zpl
 from knimin import db
 
 
 @set_access(['Barcodes'])
 class AGBarcodePrintoutHandler(BaseHandler):
     @authenticated
+    @gen.coroutine
     def post(self):
         barcodes = self.get_argument('barcodes').split(",")
-        pdf = build_barcodes_pdf(barcodes)
+        vector = bool(self.get_argument('vector', ''))
+        # pages are rendered in worker processes, waited on off the IOLoop
+        pdf = yield run_in_thread(build_barcodes_pdf, barcodes,
+                                  vector=vector)
         self.add_header('Content-type',  'application/pdf')
         self.add_header('Content-Transfer-Encoding', 'binary')
         self.add_header('Accept-Ranges', 'bytes')
@@ -24,6 +31,25 @@ class AGBarcodePrintoutHandler(BaseHandler):
         self.finish()
 
 
+@set_access(['Barcodes'])
+class AGBarcodeZPLHandler(BaseHandler):
+    @authenticated
+    @gen.coroutine
+    def post(self):
+        barcodes = self.get_argument('barcodes').split(",")
+        self.add_header('Content-type',  'application/octet-stream')
+        self.add_header('Content-Transfer-Encoding', 'binary')
+        self.add_header('Accept-Ranges', 'bytes')
+        self.add_header('Content-Encoding', 'none')
+        self.add_header('Content-Disposition',
+                        'attachment; filename=barcodes.zpl')
+        # sent a chunk of labels at a time, so the download starts at once
+        for chunk in iter_barcodes_zpl(barcodes):
+            self.write(chunk)
+            yield gen.Task(self.flush)
+        self.finish()
+
+
 class AGBarcodeAssignedHandler(BaseHandler):
     @authenticated
     def post(self):
@@ -46,10 +72,11 @@ class AGNewBarcodeHandler(BaseHandler):
     @authenticated
     def get(self):
         project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        remaining = db.count_unassigned_barcodes()
         self.render("ag_new_barcode.html", currentuser=self.current_user,
                     projects=project_names, barcodes=[], remaining=remaining,
-                    msg="", newbc=[],  assignedbc=[], assign_projects="")
+                    msg="", newbc=[],  assignedbc=[], assign_projects="",
+                    labels="pdf")
 
     @authenticated
     def post(self):
@@ -85,8 +112,9 @@ class AGNewBarcodeHandler(BaseHandler):
             raise HTTPError(400, 'Unknown action: %s' % action)
 
         project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        remaining = db.count_unassigned_barcodes()
         self.render("ag_new_barcode.html", currentuser=self.current_user,
                     projects=project_names, remaining=remaining, msg=msg,
                     newbc=newbc, assignedbc=assignedbc,
-                    assign_projects=", ".join(projects))
+                    assign_projects=", ".join(projects),
+                    labels=self.get_argument('labels', 'pdf'))
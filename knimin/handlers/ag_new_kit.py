@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 from json import loads
+from tornado import gen
 from tornado.web import authenticated, HTTPError
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 from knimin import db
+from knimin.lib.background import run_in_thread
 from knimin.lib.mem_zip import InMemoryZip
 from knimin.lib.util import get_printout_data
 
@@ -36,12 +38,13 @@ class AGNewKitHandler(BaseHandler):
     @authenticated
     def get(self):
         project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        remaining = db.count_unassigned_barcodes()
         self.render("ag_new_kit.html", projects=project_names,
                     currentuser=self.current_user, msg="", kitinfo=[],
                     fields="", remaining=remaining)
 
     @authenticated
+    @gen.coroutine
     def post(self):
         tag = self.get_argument("tag")
         if not tag:
@@ -52,7 +55,10 @@ class AGNewKitHandler(BaseHandler):
         kits = []
         fields = ""
         try:
-            kits = db.create_ag_kits(zip(num_swabs, num_kits), tag, projects)
+            # hashing the kit passwords takes minutes for big runs, so it
+            # is kept off the IOLoop
+            kits = yield run_in_thread(db.create_ag_kits,
+                                       zip(num_swabs, num_kits), tag, projects)
             fields = ','.join(kits[0]._fields)
         except Exception as e:
             raise HTTPError(500, "ERROR: %s" % str(e))
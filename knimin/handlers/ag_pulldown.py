@@ -4,6 +4,7 @@ from future.utils import viewitems
 from knimin.handlers.base import BaseHandler
 from knimin import db
 from knimin.lib.mem_zip import InMemoryZip
+from knimin.lib.timing import StageTimer
 from knimin.handlers.access_decorators import set_access
 
 
@@ -20,7 +21,7 @@ class AGPulldownHandler(BaseHandler):
         # Do nothing if no file given
         if 'barcodes' not in self.request.files:
             self.render("ag_pulldown.html", currentuser=self.current_user,
-                        barcodes='', blanks='', external='')
+                        barcodes='', blanks='', external='', timing='')
             return
         # Get file information, ignoring commented out lines
         fileinfo = self.request.files['barcodes'][0]['body']
@@ -35,10 +36,11 @@ class AGPulldownHandler(BaseHandler):
             external = ','.join(hold)
         else:
             external = ''
+        timing = self.get_argument('timing', '')
         surveys = db.list_external_surveys()
         self.render("ag_pulldown.html", currentuser=self.current_user,
                     barcodes=",".join(barcodes), blanks=",".join(blanks),
-                    surveys=surveys, external=external)
+                    surveys=surveys, external=external, timing=timing)
 
 
 @set_access(['Metadata Pulldown'])
@@ -54,16 +56,21 @@ class AGPulldownDLHandler(BaseHandler):
             external = self.get_argument('external').split(',')
         else:
             external = []
+        timer = StageTimer()
         # Get metadata and create zip file
-        metadata, failures = db.pulldown(barcodes, blanks, external)
+        metadata, failures = db.pulldown(barcodes, blanks, external,
+                                         timer=timer)
 
         meta_zip = InMemoryZip()
-        failed = '\n'.join(['\t'.join(bc) for bc in viewitems(failures)])
-        failtext = ("The following barcodes were not retrieved "
-                    "for any survey:\n%s" % failed)
-        meta_zip.append("failures.txt", failtext)
-        for survey, meta in viewitems(metadata):
-            meta_zip.append('survey_%s_md.txt' % survey, meta)
+        with timer.stage('compress'):
+            failed = '\n'.join(['\t'.join(bc) for bc in viewitems(failures)])
+            failtext = ("The following barcodes were not retrieved "
+                        "for any survey:\n%s" % failed)
+            meta_zip.append("failures.txt", failtext)
+            for survey, meta in viewitems(metadata):
+                meta_zip.append('survey_%s_md.txt' % survey, meta)
+        if self.get_argument('timing', ''):
+            meta_zip.append('timing.json', timer.to_json())
 
         # write out zip file
         self.add_header('Content-type',  'application/octet-stream')
@@ -1,16 +1,24 @@
 #!/usr/bin/env python
+from datetime import datetime
+
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 from tornado.web import authenticated
 
-from knimin import db
+from knimin import db, config
+from knimin.lib.snapshot import Snapshot
+
+stats_snapshot = Snapshot(db.getAGStats, config.stats_max_age)
 
 
 @set_access(['Base'])
 class AGStatsHandler(BaseHandler):
     @authenticated
     def get(self):
-        stats = db.getAGStats()
+        refresh = self.get_argument('refresh', '') == '1'
+        stats, taken = stats_snapshot.get(refresh)
         for item, stat in stats:
             stat = '' if stat is None else stat
-        self.render("ag_stats.html", stats=stats, loginerror='')
+        age = int((datetime.now() - taken).total_seconds() // 60)
+        self.render("ag_stats.html", stats=stats, taken=taken, age=age,
+                    loginerror='')
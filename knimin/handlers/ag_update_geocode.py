@@ -1,24 +1,40 @@
 #!/usr/bin/env python
+from datetime import datetime
+
 from tornado.web import authenticated
 from knimin.handlers.base import BaseHandler
 
-from knimin import db
+from knimin import db, config
+from knimin.lib.background import run_in_thread
+from knimin.lib.geocode_worker import get_worker
+from knimin.lib.snapshot import Snapshot
+
+geocode_stats_snapshot = Snapshot(db.getGeocodeStats, config.stats_max_age)
 
 
 class AGUpdateGeocodeHandler(BaseHandler):
     @authenticated
     def get(self):
-        stats = db.getGeocodeStats()
-        self.render("ag_update_geocode.html", stats=stats,
-                    currentuser=self.current_user)
+        self._render(refresh=self.get_argument('refresh', '') == '1')
 
     @authenticated
     def post(self):
         retry = int(self.get_argument("retry", 0))
         limit = int(self.get_argument('limit', -1))
         limit = None if limit == -1 else limit
-        db.addGeocodingInfo(limit, retry)
-        stats = db.getGeocodeStats()
+        # geocoding can take hours, so it runs in the background and the
+        # page shows its progress
+        worker = get_worker()
+        if worker.start(limit, bool(retry)):
+            run_in_thread(worker.run)
+            msg = "Geocoding started"
+        else:
+            msg = "Geocoding is already running"
+        self._render(msg)
 
-        self.render("ag_update_geocode.html", stats=stats,
+    def _render(self, msg="", refresh=False):
+        stats, taken = geocode_stats_snapshot.get(refresh)
+        age = int((datetime.now() - taken).total_seconds() // 60)
+        self.render("ag_update_geocode.html", stats=stats, taken=taken,
+                    age=age, progress=get_worker().status(), msg=msg,
                     currentuser=self.current_user)
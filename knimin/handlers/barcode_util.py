@@ -5,6 +5,7 @@ from datetime import datetime
 
 from knimin import db
 from knimin.lib.constants import survey_type
+from knimin.lib.checkin import build_checkin_email, parse_checkins
 from knimin.lib.mail import send_email
 from knimin.handlers.access_decorators import set_access
 
@@ -101,80 +102,8 @@ class BarcodeUtilHelper(object):
 
     def _build_email(self, login_user, barcode, email_type,
                      sample_date, sample_time):
-        subject = body_message = u""
-
-        if email_type == '0':
-            subject = u'ACTION REQUIRED - Assign your samples in American Gut'
-            body_message = u"""
-Dear {name},
-
-We have recently received your sample barcode: {barcode}, but we cannot process
-your sample until the following steps have been completed online. Please ensure
-that you have completed both steps outlined below:
-
-1. Submit your consent form and survey
-
-Consent and survey depend on sample type. For human samples, the consent form
-is mandatory. Even if you elect not to answer the questions on the survey,
-please click through and submit the survey in order to ensure we receive your
-completed consent form.
-For pet samples, we ask that you fill out a short survey. No consent form is
-necessary.
-For environmental samples, the consent form and survey are not necessary.
-
-To begin the consent/survey process:
-  * Click on the "Add Source Survey" tab on the main page.
-  * Select the appropriate category (human, animal, or environmental) for your
-   sample.
-
-2. Associate your sample(s) with your survey(s)
-
-This step is important as it connects your consent form to your sample. We
-cannot legally work with your sample until this step has been completed. For
-human and pet samples, the survey must be completed before doing this step.
-
-To associate your sample with your survey:
-  * Log into your account and click the "Associate/Log Sample" button at the
-   bottom of the left-hand navigation menu. This will bring you to a screen
-   with the heading "Choose your sample source".
-  * Click on the name of the participant that the sample belongs to.
-  * Fill out the required fields and submit.
-
-The American Gut participant website is located at
-https://microbio.me/americangut
-The British Gut participant website is located at
-https://microbio.me/britishgut
-If you have any questions, please contact us at info@americangut.org.
-
-Thank you,
-American Gut Team
-"""
-
-            body_message = body_message.format(name=login_user,
-                                               barcode=barcode)
-        elif email_type == '1':
-            subject = (u'American Gut Sample with Barcode %s is Received.'
-                       % barcode)
-            body_message = u"""
-Dear {name},
-
-We have recently received your sample with barcode {barcode} dated
-{sample_date} {sample_time} and we have begun processing it.  Please see our
-FAQ section for when you can expect results.
-(https://microbio.me/AmericanGut/faq/#faq4)
-
-Thank you for your participation!
-
---American Gut Team--
-"""
-            body_message = body_message.format(name=login_user,
-                                               barcode=barcode,
-                                               sample_date=sample_date,
-                                               sample_time=sample_time)
-        else:
-            raise RuntimeError("Unknown email type passed: %s" % email_type)
-
-        return subject, body_message
+        return build_checkin_email(login_user, barcode, email_type,
+                                   sample_date, sample_time)
 
 
 @set_access(['Scan Barcodes'])
@@ -305,3 +234,35 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
                     msgs=(gen_update_msg, email_msg, ag_update_msg,
                           project_msg),
                     currentuser=self.current_user)
+
+
+@set_access(['Scan Barcodes'])
+class BarcodeCheckinHandler(BaseHandler):
+    @authenticated
+    def get(self):
+        self.render("barcode_checkin.html", currentuser=self.current_user,
+                    project_names=db.getProjectNames(), msg='',
+                    checked_in=[], emailed=[],
+                    queued=db.count_queued_emails())
+
+    @authenticated
+    def post(self):
+        projects = self.get_arguments('project')
+        send_mail = self.get_argument('send_mail', None) is not None
+        msg = ''
+        checked_in = emailed = []
+        try:
+            if 'scans_file' in self.request.files:
+                lines = self.request.files['scans_file'][0]['body']
+            else:
+                lines = self.get_argument('scans', '')
+            checkins = parse_checkins(lines.splitlines())
+            checked_in, emailed = db.check_in_barcodes(checkins, projects,
+                                                       send_mail)
+        except ValueError as e:
+            msg = "ERROR! %s" % str(e)
+
+        self.render("barcode_checkin.html", currentuser=self.current_user,
+                    project_names=db.getProjectNames(), msg=msg,
+                    checked_in=checked_in, emailed=emailed,
+                    queued=db.count_queued_emails())
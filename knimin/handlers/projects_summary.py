@@ -1,14 +1,21 @@
 #!/usr/bin/env python
+from datetime import datetime
+
 from tornado.web import authenticated
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import db, config
+from knimin.lib.snapshot import Snapshot
+
+summary_snapshot = Snapshot(db.get_project_summary, config.stats_max_age)
 
 
 @set_access(['Base'])
 class ProjectsSummaryHandler(BaseHandler):
     @authenticated
     def get(self):
-        projects = db.getProjectNames()
-        info = [(p, len(db.get_barcodes_for_projects([p]))) for p in projects]
-        self.render('projects_summary.html', proj_counts=info)
+        refresh = self.get_argument('refresh', '') == '1'
+        summary, taken = summary_snapshot.get(refresh)
+        age = int((datetime.now() - taken).total_seconds() // 60)
+        self.render('projects_summary.html', summary=summary, taken=taken,
+                    age=age)
@@ -0,0 +1,133 @@
+"""Runs blocking work without holding up the Tornado IOLoop"""
+from multiprocessing import Pool, cpu_count
+from sys import exc_info
+from threading import Thread
+
+from tornado.concurrent import TracebackFuture
+from tornado.ioloop import IOLoop
+
+
+def run_in_thread(func, *args, **kwargs):
+    """Runs a function in a background thread
+
+    Parameters
+    ----------
+    func : function
+        The function to run
+    args, kwargs
+        Passed on to func
+
+    Returns
+    -------
+    tornado.concurrent.Future
+        Resolved on the current IOLoop with the return value of func, or
+        the exception it raised, so it can be yielded from a coroutine
+
+    Notes
+    -----
+    The thread is a daemon thread, so it does not keep the process running
+    on shutdown.
+    """
+    future = TracebackFuture()
+    io_loop = IOLoop.current()
+
+    def _run():
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            io_loop.add_callback(future.set_exc_info, exc_info())
+        else:
+            io_loop.add_callback(future.set_result, result)
+
+    thread = Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+_process_pool = None
+
+
+def start_process_pool(workers=None):
+    """Starts the worker processes shared by all calls to imap_processes
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes. Default one per CPU
+
+    Returns
+    -------
+    multiprocessing.Pool
+        The shared pool
+
+    Notes
+    -----
+    Call it before any threads are started, such as at webserver startup.
+    The workers are forked from this process, and a fork taken while other
+    threads run can leave locks held by those threads locked forever in
+    the worker.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = Pool(workers or cpu_count())
+    return _process_pool
+
+
+def stop_process_pool():
+    """Stops the shared worker processes, if they were started"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.terminate()
+        _process_pool.join()
+        _process_pool = None
+
+
+def imap_processes(func, items, workers=None):
+    """Maps a function over items in worker processes
+
+    Parameters
+    ----------
+    func : function
+        The function, which must be defined at the top level of a module so
+        it can be sent to the workers
+    items : list
+        The arguments func is called with
+    workers : int, optional
+        Number of worker processes. Default one per CPU
+
+    Returns
+    -------
+    iterator
+        The results, in the order of items, yielded as soon as they are
+        ready
+
+    Notes
+    -----
+    For CPU bound work that holds the GIL, which threads do not speed up.
+    Items are handed out one at a time, so the work should take far longer
+    than sending it. With one worker, or a single item, func is run in this
+    process instead. Otherwise the shared pool of start_process_pool is
+    used if it was started, whatever its size. If not, a pool is started
+    for the call, which is only safe where no other threads are running.
+    """
+    if workers is None:
+        workers = cpu_count()
+    workers = min(workers, len(items))
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if _process_pool is not None:
+        for result in _process_pool.imap(func, items):
+            yield result
+        return
+
+    pool = Pool(workers)
+    try:
+        for result in pool.imap(func, items):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
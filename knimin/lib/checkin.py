@@ -0,0 +1,176 @@
+"""Checks in returned samples in bulk, and the emails sent to their owners
+"""
+from collections import namedtuple
+from datetime import date, datetime
+
+# sample issues, as the names of their ag_kit_barcodes flags
+ISSUES = ('moldy', 'overloaded', 'other')
+# date formats a scanned list may use
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+Checkin = namedtuple('Checkin', ['barcode', 'scan_date', 'postmark_date',
+                                 'moldy', 'overloaded', 'other', 'other_text'])
+
+ACTION_REQUIRED_SUBJECT = (
+    u'ACTION REQUIRED - Assign your samples in American Gut')
+ACTION_REQUIRED_BODY = u"""
+Dear {name},
+
+We have recently received your sample barcode: {barcode}, but we cannot process
+your sample until the following steps have been completed online. Please ensure
+that you have completed both steps outlined below:
+
+1. Submit your consent form and survey
+
+Consent and survey depend on sample type. For human samples, the consent form
+is mandatory. Even if you elect not to answer the questions on the survey,
+please click through and submit the survey in order to ensure we receive your
+completed consent form.
+For pet samples, we ask that you fill out a short survey. No consent form is
+necessary.
+For environmental samples, the consent form and survey are not necessary.
+
+To begin the consent/survey process:
+  * Click on the "Add Source Survey" tab on the main page.
+  * Select the appropriate category (human, animal, or environmental) for your
+   sample.
+
+2. Associate your sample(s) with your survey(s)
+
+This step is important as it connects your consent form to your sample. We
+cannot legally work with your sample until this step has been completed. For
+human and pet samples, the survey must be completed before doing this step.
+
+To associate your sample with your survey:
+  * Log into your account and click the "Associate/Log Sample" button at the
+   bottom of the left-hand navigation menu. This will bring you to a screen
+   with the heading "Choose your sample source".
+  * Click on the name of the participant that the sample belongs to.
+  * Fill out the required fields and submit.
+
+The American Gut participant website is located at
+https://microbio.me/americangut
+The British Gut participant website is located at
+https://microbio.me/britishgut
+If you have any questions, please contact us at info@americangut.org.
+
+Thank you,
+American Gut Team
+"""
+
+RECEIVED_SUBJECT = u'American Gut Sample with Barcode %s is Received.'
+RECEIVED_BODY = u"""
+Dear {name},
+
+We have recently received your sample with barcode {barcode} dated
+{sample_date} {sample_time} and we have begun processing it.  Please see our
+FAQ section for when you can expect results.
+(https://microbio.me/AmericanGut/faq/#faq4)
+
+Thank you for your participation!
+
+--American Gut Team--
+"""
+
+
+def build_checkin_email(name, barcode, email_type, sample_date=None,
+                        sample_time=None):
+    """Makes the email telling a participant their sample was received
+
+    Parameters
+    ----------
+    name : str
+        Name of the participant
+    barcode : str
+        Barcode of the sample
+    email_type : str
+        '0' if the sample still has to be logged or consented, which the
+        email asks them to do, '1' if it is ready to process
+    sample_date : str, optional
+        Date the sample was taken, for email_type '1'
+    sample_time : str, optional
+        Time the sample was taken, for email_type '1'
+
+    Returns
+    -------
+    tuple of (unicode, unicode)
+        The subject and body of the email
+
+    Raises
+    ------
+    RuntimeError
+        Unknown email_type
+    """
+    if email_type == '0':
+        return (ACTION_REQUIRED_SUBJECT,
+                ACTION_REQUIRED_BODY.format(name=name, barcode=barcode))
+    elif email_type == '1':
+        return (RECEIVED_SUBJECT % barcode,
+                RECEIVED_BODY.format(name=name, barcode=barcode,
+                                     sample_date=sample_date,
+                                     sample_time=sample_time))
+    raise RuntimeError("Unknown email type passed: %s" % email_type)
+
+
+def _parse_date(value, num):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError("Line %d: dates must look like 2016-01-31 or "
+                     "01/31/2016, got '%s'" % (num, value))
+
+
+def parse_checkins(lines, scan_date=None):
+    """Reads a list of scanned barcodes, with their dates and issues
+
+    Parameters
+    ----------
+    lines : iterable of str
+        One barcode per line, optionally followed by the scan date, the
+        postmark date, the sample issues and a note about them, separated
+        by tabs. Issues are any of moldy, overloaded and other, separated
+        by commas or spaces. Blank lines and lines starting with # are
+        skipped
+    scan_date : datetime.date, optional
+        Scan date of barcodes without one. Default today
+
+    Returns
+    -------
+    list of Checkin
+        The check-ins, in the order given. Fields not given are None, and
+        issue flags are 'Y' or 'N'
+
+    Raises
+    ------
+    ValueError
+        A line has too many fields, a date that cannot be read, or an
+        unknown issue
+    """
+    if scan_date is None:
+        scan_date = date.today()
+    checkins = []
+    for num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.split('\t')]
+        if len(fields) > 5:
+            raise ValueError("Line %d: expected at most a barcode, scan date, "
+                             "postmark date, issues and note, got '%s'"
+                             % (num, line))
+        fields += [''] * (5 - len(fields))
+        barcode, scanned, postmark, issues, note = fields
+        issues = set(issues.replace(',', ' ').lower().split())
+        unknown = issues.difference(ISSUES)
+        if unknown:
+            raise ValueError("Line %d: unknown sample issues: %s"
+                             % (num, ', '.join(sorted(unknown))))
+        flags = ['Y' if i in issues else 'N' for i in ISSUES]
+        checkins.append(Checkin(
+            str(barcode),
+            _parse_date(scanned, num) if scanned else scan_date,
+            _parse_date(postmark, num) if postmark else None,
+            *(flags + [note or None])))
+    return checkins
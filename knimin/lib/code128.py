@@ -185,15 +185,121 @@ def code128_format(data):
     return codes
 
 
+# Pixel values of bars and spaces in rows built for mode L images
+_BAR = b'\x00'
+_SPACE = b'\xff'
+
+# Caches of the bar patterns of each symbol, by (code, thickness), and of
+# loaded fonts, by (path, size)
+_patterns = {}
+_fonts = {}
+
+
+def _symbol_pattern(code, thickness):
+    """One row of pixels of a symbol's bars and spaces, starting with a bar
+    """
+    key = (code, thickness)
+    if key not in _patterns:
+        _patterns[key] = b''.join(
+            (_SPACE if i % 2 else _BAR) * (int(weight) * thickness)
+            for i, weight in enumerate(WEIGHTS[code]))
+    return _patterns[key]
+
+
+def code128_bars(text, thickness=3):
+    """Measures the bars of a Code 128 barcode
+
+    Parameters
+    ----------
+    text : str
+        What the barcode encodes
+    thickness : int, optional
+        Width of the narrowest bar. Default 3
+
+    Returns
+    -------
+    list of tuple of (int, int)
+        Offset from the start of the barcode and width of each bar
+    int
+        Width of the barcode, without a quiet zone
+    """
+    bars = []
+    x = 0
+    for code in code128_format(text):
+        for i, weight in enumerate(WEIGHTS[code]):
+            width = int(weight) * thickness
+            if i % 2 == 0:
+                bars.append((x, width))
+            x += width
+    return bars, x
+
+
+def get_font(font=None, size=20):
+    """Loads a font, once for each font and size
+
+    Parameters
+    ----------
+    font : str, optional
+        Path to a TrueType font. Default PIL's built in bitmap font
+    size : int, optional
+        Size of the TrueType font. Default 20
+
+    Returns
+    -------
+    PIL.ImageFont.ImageFont
+        The font
+    """
+    key = (font, size)
+    if key not in _fonts:
+        if font is None:
+            _fonts[key] = ImageFont.load_default()
+        else:
+            _fonts[key] = ImageFont.truetype(font, size)
+    return _fonts[key]
+
+
 def code128_image(text, height=100, width=None, thickness=3, quiet_zone=True,
                   font=None, show_text=False):
+    """Draws a Code 128 barcode
+
+    Parameters
+    ----------
+    text : str
+        What the barcode encodes
+    height : int, optional
+        Height of the image in pixels. Default 100
+    width : int, optional
+        Width of the image in pixels, the barcode is centered in it.
+        Default the width of the barcode
+    thickness : int, optional
+        Width of the narrowest bar in pixels. Default 3
+    quiet_zone : bool, optional
+        Whether to leave space either side of the barcode. Default True
+    font : str, optional
+        Path to the TrueType font the text is written in. Default PIL's
+        built in font
+    show_text : bool, optional
+        Whether to write the text under the barcode. Default False
+
+    Returns
+    -------
+    PIL.Image.Image
+        Monochrome image of the barcode
+
+    Raises
+    ------
+    ValueError
+        The barcode is wider than width
+
+    Notes
+    -----
+    Each row of bars is the same, so one row is built from the cached
+    patterns of the symbols and repeated, rather than drawing each bar.
+    """
     data = code128_format(text)
     barcode_height = height - 25 if show_text else height
-    barcode_widths = []
-    for code in data:
-        for weight in WEIGHTS[code]:
-            barcode_widths.append(int(weight) * thickness)
-    barcode_width = sum(barcode_widths)
+    bars = b''.join(_symbol_pattern(code, thickness) for code in data)
+    barcode_width = len(bars)
     x = 0
 
     if quiet_zone:
@@ -206,23 +312,22 @@ def code128_image(text, height=100, width=None, thickness=3, quiet_zone=True,
             raise ValueError(tmp % (barcode_width, width))
         else:
             x = (width - barcode_width)/2
+    else:
+        width = barcode_width
 
+    # bars are drawn from the top down to barcode_height inclusive
+    row = (_SPACE * x + bars + _SPACE * width)[:width]
+    bar_rows = min(barcode_height + 1, height)
+    pixels = row * bar_rows + _SPACE * (width * (height - bar_rows))
     # Monochrome Image
-    img = Image.new('1', (width, height), 1)
-    draw = ImageDraw.Draw(img)
-    draw_bar = True
-    for w in barcode_widths:
-        if draw_bar:
-            draw.rectangle(((x, 0), (x + w - 1, barcode_height)), fill=0)
-        draw_bar = not draw_bar
-        x += w
+    img = Image.frombytes('L', (width, height), pixels).convert(
+        '1', dither=Image.NONE)
+    x += len(bars)
 
     if show_text:
         # Add barcode text beneith the barcode
-        if font is None:
-            font = ImageFont.load_default()
-        else:
-            font = ImageFont.truetype(font, 20)
+        draw = ImageDraw.Draw(img)
+        font = get_font(font)
         text_width = font.getsize(text)[0]
         draw.text((x/2-(text_width/2), height-25), text, font=font)
 
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import os
-from os.path import join, dirname, abspath
+from os.path import join, dirname, abspath, expanduser
 from future import standard_library
 with standard_library.hooks():
     from configparser import ConfigParser
@@ -24,6 +24,9 @@ class KniminConfig(object):
         If in debug state
     base_log_dir : str
         Path to the base directory where the log file will be written
+    state_dir : str
+        Path to the directory files kept between runs are stored in by
+        default. Default ~/.labadmin
     user : str
         The postgres user
     password : str
@@ -34,6 +37,40 @@ class KniminConfig(object):
         The host where the database lives
     port : int
         The port used to connect to the postgres database in the previous host
+    stats_max_age : float
+        Seconds the statistics pages are cached for
+    email_queue_interval : float
+        Seconds between sends of queued emails by the webserver, 0 to not
+        send them
+    email_queue_batch_size : int
+        Most queued emails sent at a time
+    geocode_cache_fp : str
+        Path to the SQLite file geocoding answers are cached in, or an empty
+        string to not cache them. Default geocode_cache.db in state_dir
+    geocode_cache_ttl : float
+        Seconds a found geocoding answer is cached for
+    geocode_negative_ttl : float
+        Seconds an address that could not be geocoded is cached for
+    geocode_requests_per_second : float
+        Most requests per second sent to the geocoding API
+    geocode_workers : int
+        Most addresses geocoded at once
+    geocoder_backend : {'google', 'gazetteer'}
+        Where postal codes are geocoded. 'gazetteer' looks them up offline
+        first, using the Google API only for ones it does not hold
+    gazetteer_fp : str
+        Path to the SQLite file of the offline gazetteer. Default
+        gazetteer.db in state_dir
+    geocode_daily_quota : int
+        Most unique addresses the background worker geocodes a day
+    geocode_batch_size : int
+        Unique addresses the background worker geocodes at a time
+    geocode_worker_interval : float
+        Seconds between the webserver's checks for geocoding runs to pick
+        back up, 0 to not check
+    geocode_checkpoint_fp : str
+        Path to the JSON file the background worker keeps its progress in.
+        Default geocode_worker.json in state_dir
 
     Notes
     -----
@@ -62,6 +99,7 @@ class KniminConfig(object):
         self._get_postgres(config)
         self._get_tornado(config)
         self._get_email(config)
+        self._get_geocoder(config)
 
     def _get_main(self, config):
         """Get the configuration of the main section"""
@@ -69,6 +107,11 @@ class KniminConfig(object):
         self.help_email = config.get('main', 'help_email')
         self.base_data_dir = config.get('main', 'base_data_dir')
         self.base_log_dir = config.get('main', 'BASE_LOG_DIR')
+        # optional, where the geocoder cache and the like are kept
+        if config.has_option('main', 'STATE_DIR'):
+            self.state_dir = config.get('main', 'STATE_DIR')
+        else:
+            self.state_dir = expanduser(join('~', '.labadmin'))
 
     def _get_postgres(self, config):
         """Get the configuration of the postgres section"""
@@ -81,6 +124,12 @@ class KniminConfig(object):
     def _get_tornado(self, config):
         """Get tornado config bits"""
         self.http_port = config.getint('tornado', 'port')
+        # optional, minutes the statistics pages are cached for
+        if config.has_option('tornado', 'stats_max_age_minutes'):
+            self.stats_max_age = config.getfloat(
+                'tornado', 'stats_max_age_minutes') * 60
+        else:
+            self.stats_max_age = 3600
 
     def _get_email(self, config):
         self.smtp_host = config.get('email', 'HOST')
@@ -88,5 +137,45 @@ class KniminConfig(object):
         self.smtp_port = config.getint('email', 'PORT')
         self.smtp_user = config.get('email', 'USERNAME')
         self.smtp_password = config.get('email', 'PASSWORD')
+        # optional, how often and how many queued emails are sent
+        if config.has_option('email', 'QUEUE_INTERVAL_MINUTES'):
+            self.email_queue_interval = config.getfloat(
+                'email', 'QUEUE_INTERVAL_MINUTES') * 60
+        else:
+            self.email_queue_interval = 60
+        if config.has_option('email', 'QUEUE_BATCH_SIZE'):
+            self.email_queue_batch_size = config.getint('email',
+                                                        'QUEUE_BATCH_SIZE')
+        else:
+            self.email_queue_batch_size = 100
+
+    def _get_geocoder(self, config):
+        """Get the optional configuration of the geocoder section"""
+        def _get(option, default):
+            if config.has_option('geocoder', option):
+                return config.get('geocoder', option)
+            return default
+
+        self.geocode_cache_fp = _get(
+            'cache_fp', join(self.state_dir, 'geocode_cache.db'))
+        day = 60 * 60 * 24
+        self.geocode_cache_ttl = float(_get('cache_ttl_days', 180)) * day
+        self.geocode_negative_ttl = float(
+            _get('negative_ttl_days', 30)) * day
+        self.geocode_requests_per_second = float(
+            _get('requests_per_second', 10))
+        self.geocode_workers = int(_get('workers', 4))
+        self.geocoder_backend = _get('backend', 'google').lower()
+        if self.geocoder_backend not in ('google', 'gazetteer'):
+            raise ValueError('Unknown geocoder backend: %s' %
+                             self.geocoder_backend)
+        self.gazetteer_fp = _get(
+            'gazetteer_fp', join(self.state_dir, 'gazetteer.db'))
+        self.geocode_daily_quota = int(_get('daily_quota', 2500))
+        self.geocode_batch_size = int(_get('batch_size', 100))
+        self.geocode_worker_interval = float(
+            _get('worker_interval_minutes', 10)) * 60
+        self.geocode_checkpoint_fp = _get(
+            'checkpoint_fp', join(self.state_dir, 'geocode_worker.json'))
 
 config = KniminConfig()
@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 from contextlib import contextmanager
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
 from os import walk
 from os.path import join, splitext, isdir, abspath
 from copy import copy
@@ -10,21 +10,32 @@ from datetime import datetime, time, timedelta
 import json
 import re
 
-from bcrypt import hashpw, gensalt
+from bcrypt import hashpw
 from future.utils import viewitems
 
+from multiprocessing.pool import ThreadPool
+from threading import RLock
+
 from psycopg2 import connect, Error as PostgresError
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 
 from mail import send_email
-from util import (make_valid_kit_ids, make_verification_code, make_passwd,
-                  categorize_age, categorize_etoh, categorize_bmi, correct_age,
-                  fetch_url, correct_bmi)
+from checkin import build_checkin_email
+from util import (make_kit_ids, kit_id_format, kit_id_keyspace,
+                  make_verification_code, make_passwd, categorize_age,
+                  categorize_etoh, categorize_bmi, correct_age, fetch_url,
+                  correct_bmi)
 from constants import (md_lookup, month_int_lookup, month_str_lookup,
                        regions_by_state, blanks_values, season_lookup,
                        ebi_remove, env_lookup)
-from geocoder import geocode, Location, GoogleAPILimitExceeded
+from hashing import hash_password, hash_passwords
+from geocoder import (geocode_postcode, geocode_postcodes, geocode_many,
+                      GeocodeCache, Location, GoogleAPILimitExceeded,
+                      ElevationNotFound)
 from string_converter import converter
+from timing import StageTimer
+from metadata_writer import MetadataWriter
 
 
 class IncorrectEmailError(Exception):
@@ -35,6 +46,34 @@ class IncorrectPasswordError(Exception):
     pass
 
 
+def _create_missing(schema, name, sql):
+    """Builds SQL running sql only if the relation schema.name is missing
+
+    Parameters
+    ----------
+    schema : str
+        Schema the relation is in
+    name : str
+        Name of the table, index or sequence created by sql
+    sql : str
+        PL/pgSQL statements creating the relation
+
+    Returns
+    -------
+    str
+        The SQL, which can be run any number of times
+    """
+    return """DO $$
+              BEGIN
+                  IF NOT EXISTS (SELECT 1 FROM pg_class
+                                 JOIN pg_namespace n
+                                   ON n.oid = pg_class.relnamespace
+                                 WHERE relname = '%s' AND nspname = '%s') THEN
+                      %s
+                  END IF;
+              END $$""" % (name, schema, sql)
+
+
 class SQLHandler(object):
     """Encapsulates the DB connection with the Postgres DB
 
@@ -46,10 +85,40 @@ class SQLHandler(object):
                                    database=config.db_database,
                                    host=config.db_host,
                                    port=config.db_port)
+        # the connection is shared by threads, which must not run queries
+        # in the middle of each other's transactions
+        self._lock = RLock()
+        self._in_transaction = False
 
     def __del__(self):
         self._connection.close()
 
+    @contextmanager
+    def transaction(self):
+        """Runs the queries made inside it as a single transaction
+
+        Notes
+        -----
+        The transaction is committed when the block finishes and rolled back
+        if it raises, including when any query in it fails. Transactions
+        started inside a transaction are part of the outer one. Other
+        threads using this handler wait for the transaction to finish.
+        """
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+            self._in_transaction = True
+            try:
+                yield
+            except Exception:
+                self._connection.rollback()
+                raise
+            else:
+                self._connection.commit()
+            finally:
+                self._in_transaction = False
+
     @contextmanager
     def cursor(self):
         """ Returns a Postgres cursor
@@ -106,14 +175,15 @@ class SQLHandler(object):
             self._check_sql_args(sql_args)
 
         # Execute the query
-        with self.cursor() as cur:
+        with self._lock, self.cursor() as cur:
             try:
                 if many:
                     cur.executemany(sql, sql_args)
                 else:
                     cur.execute(sql, sql_args)
                 yield cur
-                self._connection.commit()
+                if not self._in_transaction:
+                    self._connection.commit()
             except PostgresError as e:
                 self._connection.rollback()
                 try:
@@ -238,6 +308,31 @@ class SQLHandler(object):
         with self._sql_executor(sql, sql_args_list, True):
             pass
 
+    def copy_expert(self, sql, fp):
+        """Runs a COPY query, reading from or writing to a file
+
+        Parameters
+        ----------
+        sql: str
+            The COPY query, using STDIN or STDOUT
+        fp: file-like object
+            The file the data is read from or written to
+
+        Raises
+        ------
+        ValueError
+            If there is some error executing the COPY query
+        """
+        with self._lock, self.cursor() as cur:
+            try:
+                cur.copy_expert(sql, fp)
+                if not self._in_transaction:
+                    self._connection.commit()
+            except PostgresError as e:
+                self._connection.rollback()
+                raise ValueError(("\nError running SQL query: %s"
+                                  "\nError: %s" % (sql, e)))
+
     def execute_proc_return_cursor(self, procname, proc_args):
         """Executes a stored procedure and returns a cursor
 
@@ -255,6 +350,98 @@ class SQLHandler(object):
         return self._connection.cursor('cur2')
 
 
+class SQLConnectionPool(object):
+    """Pool of DB connections for running independent queries concurrently
+
+    Parameters
+    ----------
+    config : KniminConfig
+        Configuration with the DB connection information
+    size : int, optional
+        Most connections, and worker threads, used at once. Default 8
+
+    Notes
+    -----
+    All the connections are opened when the pool is created and kept open
+    between queries. They share the search path set on the KniminAccess
+    connection. Each query commits on its own connection,
+    so queries run together are not guaranteed to see the same snapshot of
+    the database. Only use the pool for read only queries.
+    """
+    def __init__(self, config, size=8):
+        # psycopg2 closes returned connections once the pool holds minconn
+        # idle ones, so keep them all
+        self._pool = ThreadedConnectionPool(
+            size, size, user=config.db_user, password=config.db_password,
+            database=config.db_database, host=config.db_host,
+            port=config.db_port,
+            options='-c search_path=ag,barcodes,public')
+        self._workers = ThreadPool(size)
+
+    def __del__(self):
+        self._workers.terminate()
+        self._pool.closeall()
+
+    def execute_fetchall(self, sql, sql_args=None):
+        """Executes a fetchall SQL query on a pooled connection
+
+        Parameters
+        ----------
+        sql: str
+            The SQL query
+        sql_args: tuple or list, optional
+            The arguments for the SQL query
+
+        Returns
+        -------
+        list of tuples
+            The results of the fetchall query
+
+        Raises
+        ------
+        ValueError
+            If there is some error executing the SQL query
+        """
+        conn = self._pool.getconn()
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                try:
+                    cur.execute(sql, sql_args)
+                    result = cur.fetchall()
+                    conn.commit()
+                except PostgresError as e:
+                    conn.rollback()
+                    raise ValueError(("\nError running SQL query: %s"
+                                      "\nError: %s" % (
+                                          cur.mogrify(sql, sql_args), e)))
+        finally:
+            self._pool.putconn(conn)
+        return result
+
+    def fetch_concurrently(self, queries):
+        """Runs independent fetchall queries at the same time
+
+        Parameters
+        ----------
+        queries : dict
+            The queries to run, in the form {name: (sql, sql_args), ...}
+
+        Returns
+        -------
+        dict of list of tuples
+            The results of each query, in the form {name: results, ...}
+
+        Raises
+        ------
+        ValueError
+            If there is some error executing any of the SQL queries
+        """
+        names = list(queries)
+        results = self._workers.map(
+            lambda name: self.execute_fetchall(*queries[name]), names)
+        return dict(zip(names, results))
+
+
 class KniminAccess(object):
     # arbitrary, unique ID and value
     human_sites = ['Stool',
@@ -291,10 +478,103 @@ class KniminAccess(object):
                      'Sole of shoe',
                      'Water']
 
+    _barcode_details_sql = """SELECT DISTINCT barcode, *
+                              FROM ag_kit_barcodes
+                              JOIN ag_kit USING (ag_kit_id)
+                              FULL OUTER JOIN ag_login_surveys USING
+                                 (survey_id, ag_login_id)
+                              JOIN ag_login USING (ag_login_id)
+                              WHERE barcode in %s"""
+
+    # Changes on top of the american-gut-web schema that this code relies
+    # on, as (name, sql), applied in order by migrate
+    _migrations = [
+        # barcode numbers are handed out by a sequence, started after the
+        # newest barcode when it is first created
+        ('barcode_seq', _create_missing('barcodes', 'barcode_seq', """
+            CREATE SEQUENCE barcodes.barcode_seq;
+            PERFORM setval('barcodes.barcode_seq',
+                           coalesce(max(barcode::bigint), 0) + 1, false)
+            FROM barcodes.barcode;""")),
+        # finding the projects of a barcode, which the primary key only
+        # covers for a given project
+        ('project_barcode_barcode_idx', _create_missing(
+            'barcodes', 'project_barcode_barcode_idx', """
+            CREATE INDEX project_barcode_barcode_idx
+            ON barcodes.project_barcode (barcode);""")),
+        # barcodes never assigned to a project, see get_unassigned_barcodes
+        ('barcode_unassigned_idx', _create_missing(
+            'barcodes', 'barcode_unassigned_idx', """
+            CREATE INDEX barcode_unassigned_idx
+            ON barcodes.barcode (barcode) WHERE assigned_on IS NULL;""")),
+        # barcodes taken out of all their projects before setBarcodeProjects
+        # cleared the assign date, which would never be unassigned again
+        ('unassign_stale_barcodes', """
+            UPDATE barcodes.barcode b
+            SET assigned_on = NULL
+            WHERE assigned_on IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM barcodes.project_barcode pb
+                WHERE pb.barcode = b.barcode)"""),
+        # emails to participants, sent in the background by
+        # send_queued_emails instead of while a page waits
+        ('email_queue', _create_missing('ag', 'email_queue', """
+            CREATE TABLE ag.email_queue (
+                email_id serial PRIMARY KEY,
+                recipient varchar NOT NULL,
+                subject varchar NOT NULL,
+                body text NOT NULL,
+                barcode varchar,
+                queued_on timestamp NOT NULL DEFAULT NOW(),
+                claimed_on timestamp,
+                sent_on timestamp,
+                attempts integer NOT NULL DEFAULT 0,
+                last_error varchar);
+            CREATE INDEX email_queue_unsent_idx
+            ON ag.email_queue (email_id) WHERE sent_on IS NULL;"""))]
+
     def __init__(self, config):
         self._con = SQLHandler(config)
         self._con.execute('set search_path to ag, barcodes, public')
         self.config = config
+        self._pool = None
+
+    def migrate(self):
+        """Applies the schema changes this code relies on not yet applied
+
+        Returns
+        -------
+        list of str
+            Names of the migrations applied, in the order they were applied
+
+        Notes
+        -----
+        Applied migrations are recorded in ag.labadmin_migration, so each is
+        only applied once. Each is applied in its own transaction.
+        """
+        self._con.execute(_create_missing('ag', 'labadmin_migration', """
+            CREATE TABLE ag.labadmin_migration (
+                name varchar PRIMARY KEY,
+                applied_on timestamp NOT NULL DEFAULT NOW());"""))
+        applied = {row[0] for row in self._con.execute_fetchall(
+            "SELECT name FROM ag.labadmin_migration")}
+        migrated = []
+        for name, sql in self._migrations:
+            if name in applied:
+                continue
+            with self._con.transaction():
+                self._con.execute(sql)
+                self._con.execute("""INSERT INTO ag.labadmin_migration (name)
+                                     VALUES (%s)""", [name])
+            migrated.append(name)
+        return migrated
+
+    @property
+    def pool(self):
+        """Connection pool for independent read only queries, opened lazily
+        """
+        if self._pool is None:
+            self._pool = SQLConnectionPool(self.config)
+        return self._pool
 
     def _get_col_names_from_cursor(self, cur):
         if cur.description:
@@ -439,23 +719,20 @@ class KniminAccess(object):
         dict of dict
             {barcode: {column: value}, ...}
         """
-        sql = """SELECT DISTINCT barcode, *
-                 FROM ag_kit_barcodes
-                 JOIN ag_kit USING (ag_kit_id)
-                 FULL OUTER JOIN ag_login_surveys USING
-                    (survey_id, ag_login_id)
-                 JOIN ag_login USING (ag_login_id)
-                 WHERE barcode in %s"""
-        res = self._con.execute_fetchall(sql, [tuple(b[:9] for b in barcodes)])
+        res = self._con.execute_fetchall(self._barcode_details_sql,
+                                         [tuple(b[:9] for b in barcodes)])
         return {row[0]: dict(row) for row in res}
 
-    def get_surveys(self, barcodes):  # noqa
+    def get_surveys(self, barcodes, timer=None):  # noqa
         """Retrieve surveys for specific barcodes
 
         Parameters
         ----------
         barcodes : iterable of str
             The list of barcodes for which metadata will be retrieved
+        timer : StageTimer, optional
+            If given, the number of answer rows fetched is counted as
+            'rows_fetched'. Default None
 
         Returns
         -------
@@ -522,6 +799,8 @@ class KniminAccess(object):
                    AND barcode IN %s"""
 
         # Get third party surveys, if there is one and one is requested
+        if timer is None:
+            timer = StageTimer()
 
         # Formats a question and response for a MULTIPLE question into a header
         def _translate_multiple_response_to_header(question, response):
@@ -533,22 +812,29 @@ class KniminAccess(object):
         # For each MULTIPLE question, build a dict of the possible responses
         # and what the header should be for the column representing the
         # response
-        multiples_headers = defaultdict(dict)
-        for question, response in self._con.execute_fetchall(
-                multiple_responses_sql):
-            multiples_headers[question][response] = \
-                _translate_multiple_response_to_header(question, response)
-
         # find special case barcodes with appended info and store them
         special_bc = sorted(b for b in barcodes if len(b) > 9)
         # Strip off any appending from barcodes before getting data
         bc = tuple(set(b[:9] for b in barcodes))
+
+        # The queries are independent, so run them all at once
+        results = self.pool.fetch_concurrently({
+            'multiple_responses': (multiple_responses_sql, None),
+            'single': (single_sql, [bc]),
+            'others': (others_sql, [bc]),
+            'multiple': (multiple_sql, [bc])})
+
+        multiples_headers = defaultdict(dict)
+        for question, response in results['multiple_responses']:
+            multiples_headers[question][response] = \
+                _translate_multiple_response_to_header(question, response)
+
         # this function reduces code duplication by generalizing as much
         # as possible how questions and responses are fetched from the db
-
-        def _format_responses_as_dict(sql, json=False, multiple=False):
+        def _format_responses_as_dict(rows, json=False, multiple=False):
             ret_dict = defaultdict(lambda: defaultdict(dict))
-            for survey, barcode, q, a in self._con.execute_fetchall(sql, [bc]):
+            timer.count('rows_fetched', len(rows))
+            for survey, barcode, q, a in rows:
                 # Get special barcodes that match, if applicable
                 match = [x for x in special_bc if barcode in x]
                 if not match:
@@ -569,9 +855,10 @@ class KniminAccess(object):
                         ret_dict[survey][bcs][q] = a
             return ret_dict
 
-        single_results = _format_responses_as_dict(single_sql)
-        others_results = _format_responses_as_dict(others_sql, json=True)
-        multiple_results = _format_responses_as_dict(multiple_sql,
+        single_results = _format_responses_as_dict(results['single'])
+        others_results = _format_responses_as_dict(results['others'],
+                                                   json=True)
+        multiple_results = _format_responses_as_dict(results['multiple'],
                                                      multiple=True)
 
         # combine the results for each barcode
@@ -612,7 +899,8 @@ class KniminAccess(object):
         # Calculate the number of 12-month periods between the years
         return (d2.year - d1.year) * 12 + (d2.month - d1.month)
 
-    def _geocode(self, barcode, zipcode, country, zip_lookup, country_lookup):
+    def _geocode(self, barcode, zipcode, country, zip_lookup, country_lookup,
+                 timer=None):
         """Adds geocoding information to the barcoe for pulldown"""
         try:
             barcode['LATITUDE'] = zip_lookup[zipcode][country][0]
@@ -625,7 +913,12 @@ class KniminAccess(object):
         except KeyError:
             # geocode unknown zip/country combo and add to
             # zipcode table & lookup dict
-            info = self.get_geocode_zipcode(zipcode, country)
+            if timer is None:
+                timer = StageTimer()
+            if zipcode and country:
+                timer.count('geocoder_calls')
+            with timer.stage('geocode'):
+                info = self.get_geocode_zipcode(zipcode, country)
             if info.lat is not None:
                 barcode['LATITUDE'] = "%.1f" % info.lat
                 barcode['LONGITUDE'] = "%.1f" % info.long
@@ -651,7 +944,43 @@ class KniminAccess(object):
                     'Unspecified')
         return barcode
 
-    def format_survey_data(self, md, external_surveys=None, full=False):  # noqa
+    def _geocode_missing(self, pairs, zip_lookup, timer):
+        """Geocodes at once all zip/country pairs missing from the lookup
+
+        Parameters
+        ----------
+        pairs : iterable of (str, str)
+            The (zipcode, country) pairs about to be looked up by _geocode
+        zip_lookup : dict of dict
+            The zipcode lookup table, updated in place with the pairs found
+        timer : StageTimer
+            Timer to record the 'geocode' stage and 'geocoder_calls' count in
+
+        Notes
+        -----
+        Pairs that could not be geocoded here are left out of the lookup, so
+        _geocode tries them again one by one and reports the error.
+        """
+        missing = {(zipcode, country) for zipcode, country in pairs
+                   if zipcode and country and
+                   country not in zip_lookup.get(zipcode, {})}
+        if not missing:
+            return
+        timer.count('geocoder_calls', len(missing))
+        with timer.stage('geocode'):
+            found = self.get_geocode_zipcodes(missing)
+        for (zipcode, country), info in viewitems(found):
+            if info.lat is not None:
+                zip_lookup[zipcode][country] = (
+                    round(info.lat, 1), round(info.long, 1),
+                    round(info.elev, 1), info.state)
+            else:
+                zip_lookup[zipcode][country] = (
+                    'Unspecified', 'Unspecified', 'Unspecified',
+                    'Unspecified')
+
+    def format_survey_data(self, md, external_surveys=None, full=False,  # noqa
+                           timer=None):
         """Modifies barcode metadata to include all columns and correct units
 
         Specifically, this function:
@@ -669,6 +998,10 @@ class KniminAccess(object):
             External surveys to add, default None
         full : bool
             Whether to pull full or filtered answers. Default filtered (False)
+        timer : StageTimer, optional
+            If given, records the 'lookup_tables', 'format' and 'geocode'
+            stages and the 'barcodes_formatted' and 'geocoder_calls' counts.
+            Default None
 
         Returns
         -------
@@ -679,10 +1012,43 @@ class KniminAccess(object):
         """
         if external_surveys is None:
             external_surveys = []
-        errors = {}
-        # get barcode information
+        if timer is None:
+            timer = StageTimer()
+        with timer.stage('lookup_tables'):
+            lookups = self._survey_lookups(md, external_surveys, full)
+        barcode_info = lookups['barcode_info']
+        pairs = []
+        for barcode in md[2]:
+            info = barcode_info.get(barcode[:9], {})
+            pairs.append(((info.get('zip') or '').upper(),
+                          info.get('country')))
+        for barcode, responses in viewitems(md[1]):
+            info = barcode_info.get(barcode[:9], {})
+            pairs.append(((responses.get('ZIP_CODE') or '').upper(),
+                          info.get('country')))
+        self._geocode_missing(pairs, lookups['zip_lookup'], timer)
+        with timer.stage('format'):
+            errors = self._format_survey_data(md, lookups, full, timer)
+        return md, errors
+
+    def _survey_lookups(self, md, external_surveys, full):
+        """Loads the lookup tables used to format survey data
+
+        Parameters
+        ----------
+        md : dict of dict of dict
+            {survey: {barcode: {shortname: response, ...}, ...}, ...}
+        external_surveys : list of str
+            External surveys to add
+        full : bool
+            Whether to pull full or filtered answers
+
+        Returns
+        -------
+        dict
+            The lookup tables, keyed by name
+        """
         all_barcodes = set().union(*[set(md[s]) for s in md])
-        barcode_info = self.get_ag_barcode_details(all_barcodes)
 
         # tuples are latitude, longitude, elevation, state
         if full:
@@ -697,25 +1063,12 @@ class KniminAccess(object):
                                  round(longitude::numeric,1),
                                  round(elevation::numeric, 1), state
                              FROM zipcodes"""
-        zip_lookup = defaultdict(dict)
-        for row in self._con.execute_fetchall(zipcode_sql):
-            zip_lookup[row[0]][row[1]] = map(
-                lambda x: x if x is not None else 'Unspecified', row[2:])
-
         country_sql = "SELECT country, EBI from ag.iso_country_lookup"
-        country_lookup = dict(self._con.execute_fetchall(country_sql))
-        # Add for scrubbed testing database
-        country_lookup['REMOVED'] = 'REMOVED'
-
         survey_sql = "SELECT barcode, survey_id FROM ag.ag_kit_barcodes"
-        survey_lookup = dict(self._con.execute_fetchall(survey_sql))
-
         dupes_sql = """SELECT duplicate_survey_id, participant_name
                        FROM ag.duplicate_consents dc
                        JOIN ag.ag_login_surveys als USING (ag_login_id)
                        WHERE  dc.main_survey_id = als.survey_id"""
-        dupes_lookup = dict(self._con.execute_fetchall(dupes_sql))
-
         # Get external survey answers and normalize column names
         external_sql = """SELECT survey_id, external_survey, answers
                           FROM ag.external_survey_answers
@@ -723,11 +1076,38 @@ class KniminAccess(object):
                           JOIN ag.external_survey_sources
                             USING (external_survey_id)
                           WHERE external_survey = %s AND barcode IN %s"""
+
+        # The lookups are independent, so fetch them all at once
+        queries = {
+            'barcode_info': (self._barcode_details_sql,
+                             [tuple(b[:9] for b in all_barcodes)]),
+            'zipcodes': (zipcode_sql, None),
+            'countries': (country_sql, None),
+            'surveys': (survey_sql, None),
+            'dupes': (dupes_sql, None)}
+        for i, e in enumerate(external_surveys):
+            queries[('external', i)] = (external_sql, [e, tuple(all_barcodes)])
+        results = self.pool.fetch_concurrently(queries)
+
+        # get barcode information
+        barcode_info = {row[0]: dict(row) for row in results['barcode_info']}
+
+        zip_lookup = defaultdict(dict)
+        for row in results['zipcodes']:
+            zip_lookup[row[0]][row[1]] = map(
+                lambda x: x if x is not None else 'Unspecified', row[2:])
+
+        country_lookup = dict(results['countries'])
+        # Add for scrubbed testing database
+        country_lookup['REMOVED'] = 'REMOVED'
+
+        survey_lookup = dict(results['surveys'])
+        dupes_lookup = dict(results['dupes'])
+
         external = defaultdict(dict)
         unknown_external = {}
-        for e in external_surveys:
-            for survey_id, survey, answers in self._con.execute_fetchall(
-                    external_sql, [e, tuple(all_barcodes)]):
+        for i, e in enumerate(external_surveys):
+            for survey_id, survey, answers in results[('external', i)]:
                 external[survey_id].update({
                     converter.camel_to_snake(
                         '_'.join([survey.replace(' ', '_'), key])).upper(): val
@@ -736,8 +1116,42 @@ class KniminAccess(object):
             unknown_external = {k: 'Unspecified'
                                 for k in external[external.keys()[0]].keys()}
 
+        return {'barcode_info': barcode_info, 'zip_lookup': zip_lookup,
+                'country_lookup': country_lookup,
+                'survey_lookup': survey_lookup, 'dupes_lookup': dupes_lookup,
+                'external': external, 'unknown_external': unknown_external}
+
+    def _format_survey_data(self, md, lookups, full, timer):  # noqa
+        """Formats survey metadata in place using the given lookup tables
+
+        Parameters
+        ----------
+        md : dict of dict of dict
+            {survey: {barcode: {shortname: response, ...}, ...}, ...}
+        lookups : dict
+            The lookup tables, as returned by _survey_lookups
+        full : bool
+            Whether to pull full or filtered answers
+        timer : StageTimer
+            Timer to record geocoding and formatted barcode counts in
+
+        Returns
+        -------
+        dict
+            Barcodes that failed formatting, in the form {barcode: reason}
+        """
+        errors = {}
+        barcode_info = lookups['barcode_info']
+        zip_lookup = lookups['zip_lookup']
+        country_lookup = lookups['country_lookup']
+        survey_lookup = lookups['survey_lookup']
+        dupes_lookup = lookups['dupes_lookup']
+        external = lookups['external']
+        unknown_external = lookups['unknown_external']
+
         # Pet survey (id 2)
         for barcode, responses in md[2].items():
+            timer.count('barcodes_formatted')
             # Invariant information
             md[2][barcode]['ANONYMIZED_NAME'] = barcode
             md[2][barcode]['HOST_SUBJECT_ID'] = barcode
@@ -758,10 +1172,11 @@ class KniminAccess(object):
             zipcode = specific_info['zip'].upper()
             country = specific_info['country']
             md[1][barcode] = self._geocode(md[1][barcode], zipcode, country,
-                                           zip_lookup, country_lookup)
+                                           zip_lookup, country_lookup, timer)
 
         # Human survey (id 1)
         for barcode, responses in md[1].items():
+            timer.count('barcodes_formatted')
             bc_info = barcode_info[barcode[:9]]
             try:
                 # convert numeric fields
@@ -837,7 +1252,7 @@ class KniminAccess(object):
                 country = bc_info['country']
                 md[1][barcode] = self._geocode(
                     md[1][barcode], zipcode, country, zip_lookup,
-                    country_lookup)
+                    country_lookup, timer)
 
                 md[1][barcode]['SURVEY_ID'] = survey_lookup[barcode[:9]]
                 md[1][barcode].update(md_lookup[site])
@@ -950,42 +1365,60 @@ class KniminAccess(object):
                 # Add barcode to error and remove from metadata info
                 errors[barcode] = str(e)
                 del md[1][barcode]
-        return md, errors
+        return errors
 
-    def format_environmental(self, barcodes):
+    def format_environmental(self, barcodes, timer=None):
         """Format the environemntal data pulldown metadata
 
         Parameters
         ----------
         barcodes : list of (barcode, env sampled)
             List of tuples of barcode and the environment sampled
+        timer : StageTimer, optional
+            If given, records the 'geocode' stage and the
+            'barcodes_formatted' and 'geocoder_calls' counts. Default None
 
         Returns
         -------
         str
             Formatted tsv metadata for the environmental samples
         """
+        if timer is None:
+            timer = StageTimer()
         md = {}
         errors = {}
-        barcode_info = self.get_ag_barcode_details(
-            [b[0][:9] for b in barcodes])
         # tuples are latitude, longitude, elevation, state
         zipcode_sql = """SELECT UPPER(zipcode), country,
                              round(latitude::numeric, 1),
                              round(longitude::numeric,1),
                              round(elevation::numeric, 1), state
                          FROM zipcodes"""
+        country_sql = "SELECT country, EBI from ag.iso_country_lookup"
+        results = self.pool.fetch_concurrently({
+            'barcode_info': (self._barcode_details_sql,
+                             [tuple(b[0][:9] for b in barcodes)]),
+            'zipcodes': (zipcode_sql, None),
+            'countries': (country_sql, None)})
+
+        barcode_info = {row[0]: dict(row) for row in results['barcode_info']}
         zip_lookup = defaultdict(dict)
-        for row in self._con.execute_fetchall(zipcode_sql):
+        for row in results['zipcodes']:
             zip_lookup[row[0]][row[1]] = map(
                 lambda x: x if x is not None else 'Unspecified', row[2:])
 
-        country_sql = "SELECT country, EBI from ag.iso_country_lookup"
-        country_lookup = dict(self._con.execute_fetchall(country_sql))
+        country_lookup = dict(results['countries'])
         # Add for scrubbed testing database
         country_lookup['REMOVED'] = 'REMOVED'
 
+        pairs = []
+        for barcode, _ in barcodes:
+            info = barcode_info.get(barcode[:9], {})
+            pairs.append(((info.get('zip') or '').upper(),
+                          info.get('country')))
+        self._geocode_missing(pairs, zip_lookup, timer)
+
         for barcode, env in barcodes:
+            timer.count('barcodes_formatted')
             # Not using defaultdict so we don't ever allow accidental insertion
             # of unknown barcodes
             md[barcode] = {}
@@ -1009,7 +1442,7 @@ class KniminAccess(object):
                 zipcode = specific_info['zip'].upper()
                 country = specific_info['country']
                 md[barcode] = self._geocode(md[barcode], zipcode, country,
-                                            zip_lookup, country_lookup)
+                                            zip_lookup, country_lookup, timer)
 
                 md[barcode]['COLLECTION_DATE'] = \
                     specific_info['sample_date'].strftime('%m/%d/%Y')
@@ -1045,7 +1478,8 @@ class KniminAccess(object):
                  WHERE participant_name IS NOT NULL"""
         return self._con.execute_fetchall(sql)
 
-    def pulldown(self, barcodes, blanks=None, external=None, full=False):
+    def pulldown(self, barcodes, blanks=None, external=None, full=False,
+                 timer=None):
         """Pulls down AG metadata for given barcodes
 
         Parameters
@@ -1060,6 +1494,10 @@ class KniminAccess(object):
         full : bool, optional
             If True do a full pulldown, otherwise do an EBI-cleaned pulldown.
             Default False.
+        timer : StageTimer, optional
+            If given, the time spent in each stage of the pulldown and the
+            rows fetched, barcodes formatted, geocoder calls and bytes
+            written are recorded in it. Default None
 
         Returns
         -------
@@ -1070,12 +1508,15 @@ class KniminAccess(object):
             Barcodes unable to pull metadata down, in the form
             {barcode: reason, ...}
         """
+        if timer is None:
+            timer = StageTimer()
         all_results = {}
         errors = {}
-        all_survey_info = self.get_surveys(barcodes)
+        with timer.stage('get_surveys'):
+            all_survey_info = self.get_surveys(barcodes, timer)
         if len(all_survey_info) > 0:
-            all_results, errors = self.format_survey_data(all_survey_info,
-                                                          external, full)
+            all_results, errors = self.format_survey_data(
+                all_survey_info, external, full, timer)
 
         # Do the pulldown for the environmental samples
         sql = """SELECT barcode, environment_sampled
@@ -1083,57 +1524,83 @@ class KniminAccess(object):
                  WHERE environment_sampled IS NOT NULL
                      AND environment_sampled != ''
                      AND barcode IN %s"""
-        env_barcodes = self._con.execute_fetchall(sql, [tuple(barcodes)])
-        barcodes.extend([b[0] for b in env_barcodes])
-        if len(env_barcodes) > 0:
-            all_results['env'], err = self.format_environmental(env_barcodes)
-            errors.update(err)
+        with timer.stage('format_environmental'):
+            env_barcodes = self._con.execute_fetchall(sql, [tuple(barcodes)])
+            barcodes.extend([b[0] for b in env_barcodes])
+            if len(env_barcodes) > 0:
+                all_results['env'], err = self.format_environmental(
+                    env_barcodes, timer)
+                errors.update(err)
+
+        with timer.stage('serialize'):
+            metadata, barcodes_seen = self._serialize_pulldown(all_results,
+                                                               blanks)
+        timer.count('bytes_written', sum(len(m) for m in metadata.values()))
+
+        with timer.stage('explain_failures'):
+            failures = set(barcodes) - barcodes_seen
+            failures = self._explain_pulldown_failures(failures)
+        failures.update(errors)
+        return metadata, failures
 
+    def _serialize_pulldown(self, all_results, blanks):
+        """Serializes formatted pulldown metadata to qiita sample templates
+
+        Parameters
+        ----------
+        all_results : dict of dict of dict
+            Formatted metadata, {survey: {barcode: {header: value}}}
+        blanks : list of str
+            Names for the blanks to add to survey 1
+
+        Returns
+        -------
+        metadata : dict of str
+            Tab delimited qiita sample template, keyed to survey ID it came
+            from
+        barcodes_seen : set of str
+            Barcodes written to any of the sample templates
+        """
         # keep track of which barcodes were seen so we know which weren't
         barcodes_seen = set()
+        free_text = self._get_free_text_shortnames()
 
         metadata = {}
         for survey, bc_responses in all_results.items():
             if not bc_responses:
                 continue
-            headers = sorted(bc_responses.values()[0])
-            survey_md = [''.join(['sample_name\t', '\t'.join(headers)])]
+            writer = MetadataWriter(sorted(bc_responses.values()[0]),
+                                    free_text)
+            survey_md = [writer.header()]
             for barcode, shortnames_answers in sorted(bc_responses.items()):
                 barcodes_seen.add(barcode)
-                oa_hold = [barcode]
-                for h in headers:
-                    # Take care of retired questions not having an answer
-                    answer = shortnames_answers.get(h, 'Unspecified')
-                    # Convert everything to utf-8 unicode for standardization
-                    converted = self._unicode_convert(answer)
-                    oa_hold.append(converted)
-                survey_md.append('\t'.join(oa_hold))
+                # Retired questions without an answer are written as
+                # Unspecified, and everything is converted to unicode
+                survey_md.append(writer.row(barcode, shortnames_answers))
             if survey == 1 and blanks:
                 # only add blanks to human survey sample data
                 for blank in blanks:
                     blanks_copy = copy(blanks_values)
                     blanks_copy['ANONYMIZED_NAME'] = blank
                     blanks_copy['HOST_SUBJECT_ID'] = blank
-                    survey_md.append(
-                        '\t'.join([blank] + [blanks_copy[h]
-                                             for h in headers]))
+                    survey_md.append(writer.raw_row(blank, blanks_copy))
             metadata[survey] = '\n'.join(survey_md).encode('utf-8')
+        return metadata, barcodes_seen
 
-        failures = set(barcodes) - barcodes_seen
-        failures = self._explain_pulldown_failures(failures)
-        failures.update(errors)
-        return metadata, failures
+    def _get_free_text_shortnames(self):
+        """Gets the shortnames of all free text survey questions
 
-    def _unicode_convert(self, value):
-        """Convert given value to unicode string"""
-        if isinstance(value, unicode):
-            converted = value
-        elif isinstance(value, str):
-            converted = unicode(value, 'utf-8')
-        else:
-            converted = unicode(str(value), 'utf-8')
-        converted = re.sub(r"\t|\r|\n|\s+", " ", converted)
-        return converted
+        Returns
+        -------
+        set of str
+            Shortnames of the STRING and TEXT survey questions
+        """
+        sql = """SELECT question_shortname
+                 FROM ag.survey_question
+                 JOIN ag.survey_question_response_type
+                    USING (survey_question_id)
+                 WHERE survey_response_type IN ('STRING', 'TEXT')"""
+        return {row[0] for row in self._con.execute_fetchall(sql)}
 
     def check_consent(self, barcodes):
         """Gets barcodes with consent, and failure reasons for ones without
@@ -1251,37 +1718,8 @@ class KniminAccess(object):
         return fail_reason
 
     def _hash_password(self, password, hashedpw=None):
-        """Hashes password
-
-        Parameters
-        ----------
-        password: str
-            Plaintext password
-        hashedpw: str, optional
-            Previously hashed password for bcrypt to pull salt from. If not
-            given, salt generated before hash
-
-        Returns
-        -------
-        str
-            Hashed password
-
-        Notes
-        -----
-        Relies on bcrypt library to hash passwords, which stores the salt as
-        part of the hashed password. Don't need to actually store the salt
-        because of this.
-        """
-        # all the encode/decode as a python 3 workaround for bcrypt
-        if hashedpw is None:
-            hashedpw = gensalt()
-        else:
-            hashedpw = hashedpw.encode('utf-8')
-        password = password.encode('utf-8')
-        output = hashpw(password, hashedpw)
-        if isinstance(output, bytes):
-            output = output.decode("utf-8")
-        return output
+        """Hashes password, see knimin.lib.hashing.hash_password"""
+        return hash_password(password, hashedpw)
 
     def authenticate_user(self, email, password):
         # see if user exists
@@ -1352,30 +1790,84 @@ class KniminAccess(object):
         barcodes : list of str
             Barcodes attached to the kit
         """
-        barcodes = self.get_unassigned_barcodes(num_barcodes)
-        # assign barcodes to projects for the kit
-        sql = """SELECT DISTINCT project_id FROM barcodes.project_barcode
-                 JOIN ag.ag_kit_barcodes USING (barcode)
-                 WHERE ag_kit_id = %s"""
-        proj_ids = [x[0] for x in self._con.execute_fetchall(sql, [ag_kit_id])]
-        barcode_project_insert = """INSERT INTO project_barcode
-                                    (barcode, project_id)
-                                    VALUES (%s, %s)"""
-        project_inserts = []
-        for barcode in barcodes:
-            for project in proj_ids:
-                project_inserts.append((barcode, project))
-        self._con.executemany(barcode_project_insert, project_inserts)
-
-        # Add barcodes to the kit
-        sql = """INSERT  INTO ag_kit_barcodes
-                (ag_kit_id, barcode, sample_barcode_file)
-                VALUES (%s, %s, %s || '.jpg')"""
-        barcode_info = [[ag_kit_id, b, b] for b in barcodes]
-        self._con.executemany(sql, barcode_info)
+        with self._con.transaction():
+            barcodes = self.reserve_barcodes(num_barcodes)
+            self._attach_to_kits([ag_kit_id] * len(barcodes), barcodes)
         return barcodes
 
-    def create_ag_kits(self, swabs_kits, tag=None, projects=None):
+    def add_barcodes_to_kits(self, kit_counts):
+        """Attaches barcodes to many existing american gut kits at once
+
+        Parameters
+        ----------
+        kit_counts : list of tuple of (str, int)
+            Supplied kit IDs and the number of barcodes to attach to each
+
+        Returns
+        -------
+        list of tuple of (str, list of str)
+            The supplied kit IDs and the barcodes attached to each, in the
+            order of kit_counts
+
+        Raises
+        ------
+        ValueError
+            A kit ID does not exist, a number of barcodes is below 1, or
+            there are not enough unassigned barcodes
+
+        Notes
+        -----
+        The barcodes for all the kits are claimed and attached in a single
+        transaction, a statement for each table, so either every kit gets
+        its barcodes or none do.
+        """
+        if not kit_counts:
+            return []
+        bad = [k for k, n in kit_counts if n < 1]
+        if bad:
+            raise ValueError("Number of barcodes must be at least 1 for "
+                             "kit IDs: %s" % ', '.join(bad))
+        kit_ids = [k for k, _ in kit_counts]
+        sql = """SELECT supplied_kit_id, cast(ag_kit_id AS varchar(100))
+                 FROM ag.ag_kit
+                 WHERE supplied_kit_id = ANY(%s)"""
+        ag_kit_ids = dict(self._con.execute_fetchall(sql, [kit_ids]))
+        missing = sorted(set(kit_ids) - set(ag_kit_ids))
+        if missing:
+            raise ValueError("Kit IDs do not exist: %s" % ', '.join(missing))
+
+        with self._con.transaction():
+            barcodes = self.reserve_barcodes(sum(n for _, n in kit_counts))
+            self._attach_to_kits([ag_kit_ids[k] for k, n in kit_counts
+                                  for _ in range(n)], barcodes)
+
+        attached = []
+        start = 0
+        for kit_id, n in kit_counts:
+            attached.append((kit_id, barcodes[start:start + n]))
+            start += n
+        return attached
+
+    def _attach_to_kits(self, ag_kit_ids, barcodes):
+        """Adds each barcode to the kit at the same position in ag_kit_ids,
+        and to the projects the kit's barcodes are in"""
+        sql = """INSERT INTO barcodes.project_barcode (project_id, barcode)
+                 SELECT DISTINCT pb.project_id, new.barcode
+                 FROM unnest(%s::uuid[], %s::varchar[])
+                     AS new(ag_kit_id, barcode)
+                 JOIN ag.ag_kit_barcodes akb USING (ag_kit_id)
+                 JOIN barcodes.project_barcode pb
+                     ON pb.barcode = akb.barcode"""
+        self._con.execute(sql, [list(ag_kit_ids), list(barcodes)])
+        sql = """INSERT INTO ag.ag_kit_barcodes
+                     (ag_kit_id, barcode, sample_barcode_file)
+                 SELECT ag_kit_id, barcode, barcode || '.jpg'
+                 FROM unnest(%s::uuid[], %s::varchar[])
+                     AS new(ag_kit_id, barcode)"""
+        self._con.execute(sql, [list(ag_kit_ids), list(barcodes)])
+
+    def create_ag_kits(self, swabs_kits, tag=None, projects=None,
+                       hash_workers=None):
         """ Creates american gut handout kits on the database
 
         Parameters
@@ -1387,16 +1879,27 @@ class KniminAccess(object):
             Tag to add to kit IDs. Default None
         projects : list of str, optional
             Subprojects to attach to, if given. Default None.
+        hash_workers : int, optional
+            Number of processes hashing the kit passwords. Default one per
+            CPU
 
         Returns
         -------
         list of namedtuples
             The new kit information, in the form
             [(kit_id, password, verification_code, (barcode, barcode,...)),...]
+
+        Notes
+        -----
+        The kits and their barcodes are created in a single transaction, so
+        either all of them are created or none are.
         """
-        # make sure we have enough barcodes
+        # fail early rather than after hashing all the passwords
         total_swabs = sum(s * k for s, k in swabs_kits)
-        barcodes = self.get_unassigned_barcodes(total_swabs)
+        remaining = self.count_unassigned_barcodes()
+        if remaining < total_swabs:
+            raise ValueError("Not enough barcodes! %d asked for, %d remaining"
+                             % (total_swabs, remaining))
 
         # Assign barcodes to AG and any other subprojects
         if projects is None:
@@ -1404,29 +1907,22 @@ class KniminAccess(object):
         else:
             if "American Gut Project" not in projects:
                 projects.append("American Gut Project")
-        self.assign_barcodes(total_swabs, projects)
 
-        kits = []
-        kit_barcode_inserts = []
-        kit_inserts = []
-        start = 0
-        KitTuple = namedtuple('AGKit', ['kit_id', 'password',
-                              'verification_code', 'barcodes'])
-        # build the kits information and the sql insert information
+        # build the kits information before claiming the barcodes, so they
+        # are only held for the inserts
+        kit_info = []
+        kit_ids = iter(self.allocate_kit_ids(sum(k for _, k in swabs_kits),
+                                             tag=tag))
         for num_swabs, num_kits in swabs_kits:
-            kit_ids = make_valid_kit_ids(num_kits, self.get_used_kit_ids(),
-                                         tag=tag)
             for i in range(num_kits):
                 ver_code = make_verification_code()
                 password = make_passwd()
-                kit_bcs = tuple(barcodes[start:start + num_swabs])
-                start += num_swabs
-                kits.append(KitTuple(kit_ids[i], password, ver_code, kit_bcs))
-                kit_inserts.append((kit_ids[i],
-                                    self._hash_password(password),
-                                    ver_code, num_swabs))
-                for barcode in kit_bcs:
-                    kit_barcode_inserts.append((kit_ids[i], barcode, barcode))
+                kit_info.append((next(kit_ids), password, ver_code,
+                                 num_swabs))
+        # hashing is the slow part, so it is spread over worker processes
+        hashed = hash_passwords([k[1] for k in kit_info], hash_workers)
+        kit_inserts = [(info[0], pw_hash, info[2], info[3])
+                       for pw_hash, info in zip(hashed, kit_info)]
 
         # Insert kits, followed by barcodes attached to the kits
         kit_sql = """INSERT INTO ag_handout_kits
@@ -1436,8 +1932,22 @@ class KniminAccess(object):
                              (kit_id, barcode, sample_barcode_file)
                              VALUES(%s, %s, %s || '.jpg')"""
 
-        self._con.executemany(kit_sql, kit_inserts)
-        self._con.executemany(kit_barcode_sql, kit_barcode_inserts)
+        kits = []
+        kit_barcode_inserts = []
+        start = 0
+        KitTuple = namedtuple('AGKit', ['kit_id', 'password',
+                              'verification_code', 'barcodes'])
+        with self._con.transaction():
+            barcodes = self.assign_barcodes(total_swabs, projects)
+            for kit_id, password, ver_code, num_swabs in kit_info:
+                kit_bcs = tuple(barcodes[start:start + num_swabs])
+                start += num_swabs
+                kits.append(KitTuple(kit_id, password, ver_code, kit_bcs))
+                for barcode in kit_bcs:
+                    kit_barcode_inserts.append((kit_id, barcode, barcode))
+
+            self._con.executemany(kit_sql, kit_inserts)
+            self._con.executemany(kit_barcode_sql, kit_barcode_inserts)
 
         return kits
 
@@ -1450,6 +1960,94 @@ class KniminAccess(object):
 
         return set(i[0] for i in self._con.execute_fetchall(sql))
 
+    def allocate_kit_ids(self, num_ids, tag=None, kit_id_length=5,
+                         max_rounds=10):
+        """Generates kit IDs not used by any kit
+
+        Parameters
+        ----------
+        num_ids : int
+            Number of kit IDs to create
+        tag : str, optional
+            Tag to prepend to the kit IDs. Default None
+        kit_id_length : int, optional
+            Number of random characters in the kit IDs. Default 5
+        max_rounds : int, optional
+            Most rounds of candidates checked. Default 10
+
+        Returns
+        -------
+        list of str
+            The new kit IDs
+
+        Raises
+        ------
+        ValueError
+            Free kit IDs could not be found in max_rounds rounds, which
+            happens when the keyspace of the tag is nearly used up
+
+        Notes
+        -----
+        Each round generates candidates for the IDs still needed and checks
+        them all against the database in one query, so only the collisions
+        are generated again. Rounds after the first generate twice as many
+        candidates as the one before, to get through a crowded keyspace in
+        few rounds. The IDs are not reserved; the kit tables' primary keys
+        reject any taken by someone else meanwhile.
+        """
+        sql = """SELECT c.kit_id FROM unnest(%s::varchar[]) AS c(kit_id)
+                 WHERE NOT EXISTS (SELECT 1 FROM ag.ag_kit k
+                                   WHERE k.supplied_kit_id = c.kit_id)
+                     AND NOT EXISTS (SELECT 1 FROM ag.ag_handout_kits h
+                                     WHERE h.kit_id = c.kit_id)"""
+        keyspace = kit_id_keyspace(kit_id_length, tag)
+        kit_ids = set()
+        for attempt in range(max_rounds):
+            needed = num_ids - len(kit_ids)
+            if not needed:
+                break
+            candidates = set(make_kit_ids(min(needed << attempt, keyspace),
+                                          kit_id_length, tag))
+            candidates -= kit_ids
+            free = self._con.execute_fetchall(sql, [list(candidates)])
+            kit_ids.update(x[0] for x in free[:needed])
+        if len(kit_ids) < num_ids:
+            keyspace = self.get_kit_id_keyspace(tag, kit_id_length)
+            raise ValueError("Could not find %d free kit IDs for tag %s, %d "
+                             "of %d left" % (num_ids, tag, keyspace['free'],
+                                             keyspace['total']))
+        return list(kit_ids)
+
+    def get_kit_id_keyspace(self, tag=None, kit_id_length=5):
+        """Reports how many kit IDs are left for a tag
+
+        Parameters
+        ----------
+        tag : str, optional
+            Tag of the kit IDs. Default None, for untagged kit IDs
+        kit_id_length : int, optional
+            Number of random characters in the kit IDs. Default 5
+
+        Returns
+        -------
+        dict
+            {'prefix': str, 'total': int, 'used': int, 'free': int,
+             'fraction_used': float}, where prefix is what the kit IDs
+            start with and total the number of possible kit IDs
+        """
+        prefix, length = kit_id_format(kit_id_length, tag)
+        sql = """SELECT count(*) FROM (
+                     SELECT supplied_kit_id AS kit_id FROM ag.ag_kit
+                     UNION
+                     SELECT kit_id FROM ag.ag_handout_kits) AS used
+                 WHERE left(kit_id, %s) = %s AND length(kit_id) = %s"""
+        used = self._con.execute_fetchone(
+            sql, [len(prefix), prefix, len(prefix) + length])[0]
+        total = kit_id_keyspace(kit_id_length, tag)
+        return {'prefix': prefix, 'total': total, 'used': used,
+                'free': total - used,
+                'fraction_used': float(used) / total}
+
     def create_project(self, name):
         if name.strip() == '':
             raise ValueError("Project name can not be blank!")
@@ -1462,6 +2060,26 @@ class KniminAccess(object):
                  SELECT max(project_id)+1, %s FROM project"""
         self._con.execute(sql, [name])
 
+    # Barcodes not in any project. Barcodes are marked assigned_on when put
+    # in a project, so the partial index on unassigned barcodes holds these
+    # plus any assigned before that was done everywhere.
+    _unassigned_sql = """FROM barcodes.barcode b
+                         WHERE b.assigned_on IS NULL
+                             AND NOT EXISTS (
+                                 SELECT 1 FROM barcodes.project_barcode pb
+                                 WHERE pb.barcode = b.barcode)"""
+
+    def count_unassigned_barcodes(self):
+        """Counts the barcodes not assigned to any project
+
+        Returns
+        -------
+        int
+            Number of unassigned barcodes
+        """
+        sql = "SELECT count(*) " + self._unassigned_sql
+        return self._con.execute_fetchone(sql)[0]
+
     def get_unassigned_barcodes(self, n=None):
         """Returns unassigned barcodes
 
@@ -1482,13 +2100,12 @@ class KniminAccess(object):
 
         Notes
         -----
-        Barcodes are returned in ascending order
+        Barcodes are returned in ascending order. Use
+        count_unassigned_barcodes to find how many there are.
         """
         sql_args = None
-        sql = """SELECT DISTINCT barcode FROM barcodes.barcode
-                 LEFT JOIN barcodes.project_barcode pb USING (barcode)
-                 WHERE pb.barcode IS NULL
-                 ORDER BY barcode ASC"""
+        sql = ("SELECT b.barcode " + self._unassigned_sql +
+               " ORDER BY b.barcode ASC")
         if n is not None:
             sql += " LIMIT %s"
             sql_args = [n]
@@ -1498,6 +2115,68 @@ class KniminAccess(object):
                              % (n, len(barcodes)))
         return barcodes
 
+    def _mark_assigned(self, barcodes):
+        """Sets the assign date of barcodes put in a project"""
+        sql = """UPDATE barcodes.barcode
+                 SET assigned_on = NOW()
+                 WHERE barcode IN %s AND assigned_on IS NULL"""
+        self._con.execute(sql, [tuple(barcodes)])
+
+    def reserve_barcodes(self, num_barcodes):
+        """Claims unassigned barcodes so no one else can assign them
+
+        Parameters
+        ----------
+        num_barcodes : int
+            Number of barcodes to claim
+
+        Returns
+        -------
+        list of str
+            Barcodes claimed, in ascending order
+
+        Raises
+        ------
+        ValueError
+            Not enough unassigned barcodes for num_barcodes
+
+        Notes
+        -----
+        Barcodes are claimed by setting their assign date, skipping
+        barcodes other transactions are claiming, so concurrent callers get
+        different barcodes without waiting for each other. Call it inside a
+        transaction that puts the barcodes in projects, or they stay
+        claimed without being in any project.
+        """
+        sql = """UPDATE barcodes.barcode
+                 SET assigned_on = NOW()
+                 WHERE barcode IN (
+                     SELECT b.barcode {0}
+                     ORDER BY b.barcode ASC
+                     LIMIT %s
+                     FOR UPDATE OF b SKIP LOCKED)
+                 RETURNING barcode""".format(self._unassigned_sql)
+        with self._con.transaction():
+            barcodes = sorted(x[0] for x in
+                              self._con.execute_fetchall(sql, [num_barcodes]))
+            if len(barcodes) < num_barcodes:
+                raise ValueError(
+                    "Not enough barcodes! %d asked for, %d remaining"
+                    % (num_barcodes, len(barcodes)))
+        return barcodes
+
+    def _add_to_projects(self, barcodes, project_ids):
+        """Puts barcodes in each of the projects they are not already in"""
+        sql = """INSERT INTO barcodes.project_barcode (project_id, barcode)
+                 SELECT p.project_id, b.barcode
+                 FROM unnest(%s::integer[]) AS p(project_id)
+                 CROSS JOIN unnest(%s::varchar[]) AS b(barcode)
+                 WHERE NOT EXISTS (
+                     SELECT 1 FROM barcodes.project_barcode pb
+                     WHERE pb.project_id = p.project_id
+                         AND pb.barcode = b.barcode)"""
+        self._con.execute(sql, [list(project_ids), list(barcodes)])
+
     def assign_barcodes(self, num_barcodes, projects):
         """Assign a given number of barcodes to projects
 
@@ -1517,6 +2196,7 @@ class KniminAccess(object):
         ------
         ValueError
             One or more projects given don't exist in the database
+            Not enough unassigned barcodes for num_barcodes
         """
         # Verify projects given exist
         sql = "SELECT project FROM project"
@@ -1526,26 +2206,14 @@ class KniminAccess(object):
             raise ValueError("Project(s) given don't exist in database: %s"
                              % ', '.join(not_exist))
 
-        # Get unassigned barcode list and make sure we have enough barcodes
-        barcodes = self.get_unassigned_barcodes(num_barcodes)
-
-        # Assign barcodes to the project(s)
         sql = "SELECT project_id from project WHERE project in %s"
         proj_ids = [x[0] for x in
                     self._con.execute_fetchall(sql, [tuple(projects)])]
 
-        barcode_project_insert = """INSERT INTO project_barcode
-                                    (barcode, project_id)
-                                    VALUES (%s, %s)"""
-        project_inserts = []
-        for barcode in barcodes:
-            for project in proj_ids:
-                project_inserts.append((barcode, project))
-        self._con.executemany(barcode_project_insert, project_inserts)
-        # Set assign date for the barcodes
-        sql = """UPDATE barcodes.barcode
-                 SET assigned_on = NOW() WHERE barcode IN %s"""
-        self._con.execute(sql, [tuple(barcodes)])
+        # Claim barcodes and assign them to the project(s)
+        with self._con.transaction():
+            barcodes = self.reserve_barcodes(num_barcodes)
+            self._add_to_projects(barcodes, proj_ids)
         return barcodes
 
     def create_barcodes(self, num_barcodes):
@@ -1559,20 +2227,37 @@ class KniminAccess(object):
         Returns
         -------
         list
-            New barcodes created
-        """
-
-        # Get newest barcode as an integer
-        sql = "SELECT max(barcode::integer) from barcode"
-        newest = self._con.execute_fetchone(sql)[0]
+            New barcodes created, in ascending order
 
-        # create new barcodes by padding integers with zeros
-        barcodes = ['%09d' % b for b in range(newest+1, newest+1+num_barcodes)]
-
-        barcode_insert = """INSERT INTO barcode (barcode, obsolete)
-                            VALUES (%s, 'N')"""
-        self._con.executemany(barcode_insert, [[b] for b in barcodes])
-        return barcodes
+        Notes
+        -----
+        Barcode numbers come from barcodes.barcode_seq, so concurrent calls
+        never hand out the same barcode, though each call's barcodes are
+        only guaranteed to be consecutive if no other call runs at the same
+        time. All barcodes are created by a single insert.
+        """
+        sql = """INSERT INTO barcode (barcode, obsolete)
+                 SELECT lpad(n::text, greatest(9, length(n::text)), '0'), 'N'
+                 FROM (SELECT nextval('barcodes.barcode_seq') AS n
+                       FROM generate_series(1, %s)) AS numbers
+                 RETURNING barcode"""
+        try:
+            barcodes = self._con.execute_fetchall(sql, [num_barcodes])
+        except ValueError:
+            # barcodes added without the sequence got in the way, so move
+            # the sequence past them and try again
+            self._sync_barcode_seq()
+            barcodes = self._con.execute_fetchall(sql, [num_barcodes])
+        return sorted(b[0] for b in barcodes)
+
+    def _sync_barcode_seq(self):
+        """Moves the barcode sequence past the newest barcode"""
+        sql = """SELECT setval('barcodes.barcode_seq',
+                               greatest(max(barcode::bigint) + 1,
+                                        nextval('barcodes.barcode_seq')),
+                               false)
+                 FROM barcode"""
+        self._con.execute(sql)
 
     def get_barcodes_for_projects(self, projects, limit=None):
         """Gets barcode information for barcodes belonging to projects
@@ -1605,6 +2290,37 @@ class KniminAccess(object):
             sql_args.append(limit)
         return self._con.execute_fetchall(select_sql, sql_args)
 
+    def get_project_summary(self):
+        """Counts the barcodes of each project
+
+        Returns
+        -------
+        list of dict
+            One dict per project, ordered by project name, with the keys
+            'project', 'barcodes' (number assigned), 'received' (status
+            Received), 'sequenced' (sequencing status SUCCESS) and
+            'obsolete'
+
+        Notes
+        -----
+        All projects are counted in one grouped query, so this is much
+        cheaper than calling get_barcodes_for_projects for each project.
+        """
+        sql = """SELECT project,
+                        count(barcode) AS barcodes,
+                        count(CASE WHEN status = 'Received' THEN 1 END)
+                            AS received,
+                        count(CASE WHEN sequencing_status = 'SUCCESS'
+                              THEN 1 END) AS sequenced,
+                        count(CASE WHEN obsolete = 'Y' THEN 1 END)
+                            AS obsolete
+                 FROM project
+                 LEFT JOIN project_barcode USING (project_id)
+                 LEFT JOIN barcode USING (barcode)
+                 GROUP BY project
+                 ORDER BY project"""
+        return [dict(row) for row in self._con.execute_fetchall(sql)]
+
     def add_external_survey(self, survey, description, url):
         """Adds a new external survey to the database
 
@@ -1864,14 +2580,50 @@ class KniminAccess(object):
         -----
         If the tuple contains nothing but the zipcode and None for all other
         fields, no geocode was found. Zipcode/country combination added as
-        'cannot_geocode'
+        'cannot_geocode', unless only its elevation could not be found, in
+        which case nothing is added so it is tried again later
         """
         # Catch sending None or empty string for these
         if not zipcode or not country:
             return Location(zipcode, None, None, None,
                             None, None, None, country)
 
-        info = geocode('%s %s' % (zipcode, country))
+        try:
+            info = geocode_postcode(zipcode, country)
+        except ElevationNotFound:
+            return Location(zipcode, None, None, None,
+                            None, None, None, country)
+        return self._store_zipcode(zipcode, country, info)
+
+    def get_geocode_zipcodes(self, pairs):
+        """Adds geocode information to zipcode table for many zipcodes
+
+        Parameters
+        ----------
+        pairs : iterable of (str, str)
+            The (zipcode, country) pairs to geocode
+
+        Returns
+        -------
+        dict of Location
+            Location namedtuples keyed by (zipcode, country), as returned by
+            get_geocode_zipcode. Pairs that could not be geocoded because of
+            an error, e.g. GoogleAPILimitExceeded, are left out.
+
+        Notes
+        -----
+        The pairs are geocoded together, so elevations are looked up in as
+        few API requests as possible.
+        """
+        pairs = [(z, c) for z, c in set(pairs) if z and c]
+        found = {}
+        for pair, info in zip(pairs, geocode_postcodes(pairs)):
+            if isinstance(info, Location):
+                found[pair] = self._store_zipcode(pair[0], pair[1], info)
+        return found
+
+    def _store_zipcode(self, zipcode, country, info):
+        """Checks a geocoded zipcode and adds it to the zipcode table"""
         cannot_geocode = False
         # Clean the zipcode so it is same case and setup, since international
         # people can enter lowercased zipcodes or missing spaces, and google
@@ -1906,18 +2658,39 @@ class KniminAccess(object):
         is set to 'y' in the ag_login table, and it will not be tried again
         on subsequent calls to this function.  Pass retry=True to retry all
         (or maximum of limit) previously failed geocodings.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Most unique addresses to geocode. Default all
+        retry : bool, optional
+            Whether to retry previously failed geocodings. Default False
+
+        Returns
+        -------
+        dict of int
+            'logins': number of logins updated, 'addresses': number of unique
+            addresses geocoded for them, 'failed': number of logins that
+            could not be geocoded, and 'calls_saved': number of geocoding
+            requests saved by geocoding each unique address once. Also
+            'limit_exceeded', True if geocoding stopped because the API
+            quota was used up
+
+        Notes
+        -----
+        Logins are grouped by address, normalized the same way as for the
+        geocode cache, so households and shared addresses are only
+        geocoded once.
         """
 
         # clear previous geocoding attempts if retry is True
         if retry:
             sql = """UPDATE  ag_login
-                     SET latitude = %s,
-                         longitude = %s,
-                         elevation = %s,
-                         cannot_geocode = %s
-                     WHERE ag_login_id IN (
-                        SELECT ag_login_id FROM ag_login
-                        WHERE cannot_geocode = 'y')"""
+                     SET latitude = NULL,
+                         longitude = NULL,
+                         elevation = NULL,
+                         cannot_geocode = NULL
+                     WHERE cannot_geocode = 'y'"""
             self._con.execute(sql)
 
         # get logins that have not been geocoded yet
@@ -1927,106 +2700,148 @@ class KniminAccess(object):
                  WHERE elevation is NULL AND cannot_geocode is NULL"""
         logins = self._con.execute_fetchall(sql)
 
-        row_counter = 0
-        sql_args = []
+        # group the logins by address, keeping the order they came in
+        groups = OrderedDict()
         for city, state, zipcode, country, ag_login_id in logins:
-            row_counter += 1
-            if limit is not None and row_counter > limit:
-                break
-
-            # Attempt to geocode
             address = '{0} {1} {2} {3}'.format(city, state, zipcode, country)
-            try:
-                info = geocode(address)
-                # empty string to indicate geocode was successful
-                sql_args.append([info.lat, info.long, info.elev,
-                                 '', ag_login_id])
-            except GoogleAPILimitExceeded:
+            key = GeocodeCache.normalize(address)
+            if key not in groups:
+                groups[key] = (address, [])
+            groups[key][1].append(ag_login_id)
+        groups = groups.values()
+        if limit is not None:
+            groups = groups[:limit]
+
+        # Geocode concurrently, in the same order as the addresses
+        ids, lats, longs, elevs, flags = [], [], [], [], []
+        report = {'logins': 0, 'addresses': 0, 'failed': 0,
+                  'limit_exceeded': False}
+        found = geocode_many([a for a, _ in groups])
+        for (_, ag_login_ids), info in zip(groups, found):
+            if isinstance(info, GoogleAPILimitExceeded):
                 # limit exceeded so no use trying to keep geocoding
+                report['limit_exceeded'] = True
                 break
-            except:
+            report['addresses'] += 1
+            report['logins'] += len(ag_login_ids)
+            if isinstance(info, Exception):
                 # Catch ANY other error and set to could not geocode
-                sql_args.append([None, None, None, 'y', ag_login_id])
-
-        sql = """UPDATE  ag_login
-                 SET latitude = %s,
-                     longitude = %s,
-                     elevation = %s,
-                 cannot_geocode = %s
-                 WHERE ag_login_id = %s"""
-        self._con.executemany(sql, sql_args)
+                report['failed'] += len(ag_login_ids)
+                values = (None, None, None, 'y')
+            else:
+                # empty string to indicate geocode was successful
+                values = (info.lat, info.long, info.elev, '')
+            for ag_login_id in ag_login_ids:
+                ids.append(ag_login_id)
+                lats.append(values[0])
+                longs.append(values[1])
+                elevs.append(values[2])
+                flags.append(values[3])
+        report['calls_saved'] = report['logins'] - report['addresses']
+
+        if ids:
+            sql = """UPDATE ag_login
+                     SET latitude = geo.latitude,
+                         longitude = geo.longitude,
+                         elevation = geo.elevation,
+                         cannot_geocode = geo.cannot_geocode
+                     FROM (SELECT unnest(%s::uuid[]) AS ag_login_id,
+                                  unnest(%s::float8[]) AS latitude,
+                                  unnest(%s::float8[]) AS longitude,
+                                  unnest(%s::float8[]) AS elevation,
+                                  unnest(%s::varchar[]) AS cannot_geocode
+                           ) AS geo
+                     WHERE ag_login.ag_login_id = geo.ag_login_id"""
+            self._con.execute(sql, [ids, lats, longs, elevs, flags])
+        return report
 
     def getGeocodeStats(self):
-        stat_queries = [
-            ("Total Rows",
-             "select count(*) from ag_login"),
-            ("Cannot Geocode",
-             "select count(*) from ag_login where cannot_geocode = 'y'"),
-            ("Null Latitude Field",
-             "select count(*) from ag_login where latitude is null"),
-            ("Null Elevation Field",
-             "select count(*) from ag_login where elevation is null")
-        ]
-        results = []
-        for name, sql in stat_queries:
-            total = self._con.execute_fetchone(sql)[0]
-            results.append((name, total))
-        return results
+        """Counts the logins by geocoding state, in a single scan
+
+        Returns
+        -------
+        list of (str, int)
+            The name and value of each statistic
+        """
+        sql = """SELECT count(*),
+                        count(CASE WHEN cannot_geocode = 'y' THEN 1 END),
+                        count(CASE WHEN latitude IS NULL THEN 1 END),
+                        count(CASE WHEN elevation IS NULL THEN 1 END)
+                 FROM ag_login"""
+        names = ["Total Rows", "Cannot Geocode", "Null Latitude Field",
+                 "Null Elevation Field"]
+        return zip(names, self._con.execute_fetchone(sql))
 
     def getAGStats(self):
-        # returned tuple consists of:
-        # site_sampled, sample_date, sample_time, participant_name,
-        # environment_sampled, notes
-        stats_list = [
-            ('Total handout kits',
-             'SELECT count(*) FROM ag.ag_handout_kits'),
-            ('Total handout barcodes',
-             'SELECT count(*) FROM ag.ag_handout_barcodes'),
-            ('Total consented participants',
-             'SELECT count(*) FROM ag.ag_consent'),
-            ('Total registered kits',
-             'SELECT count(*) FROM ag.ag_kit'),
-            ('Total registered barcodes',
-             'SELECT count(*) FROM ag.ag_kit_barcodes'),
-            ('Total barcodes with results',
-             """SELECT count(*) FROM ag.ag_kit_barcodes
-             WHERE results_ready='Y'"""),
-            ('Average age of participants',
-             """SELECT AVG(AGE((yr.response || '-' ||
-                CASE mo.response
-                    WHEN 'January' THEN '1'
-                    WHEN 'February' THEN '2'
-                    WHEN 'March' THEN '3'
-                    WHEN 'April' THEN '4'
-                    WHEN 'May' THEN '5'
-                    WHEN 'June' THEN '6'
-                    WHEN 'July' THEN '7'
-                    WHEN 'August' THEN '8'
-                    WHEN 'September' THEN '9'
-                    WHEN 'October' THEN '10'
-                    WHEN 'November' THEN '11'
-                    WHEN 'December' THEN '12'
-                  END || '-1')::date
-                )) FROM
-              (SELECT response, survey_id
-               FROM ag.survey_answers
-               WHERE survey_question_id = 112) AS yr
-              JOIN
-              (SELECT response, survey_id
-               FROM ag.survey_answers
-               WHERE survey_question_id = 111) AS mo USING (survey_id)
-               WHERE yr.response != 'Unspecified'
-               AND mo.response != 'Unspecified'"""),
-            ('Total male participants',
-             """SELECT count(*) FROM ag.survey_answers
-                WHERE survey_question_id=107 AND response='Male'"""),
-            ('Total female participants',
-             """SELECT count(*) FROM ag.survey_answers
-                WHERE survey_question_id=107 AND response='Female'""")
-            ]
+        """Computes the American Gut statistics in a single query
+
+        Returns
+        -------
+        list of (str, object)
+            The name and value of each statistic
+
+        Notes
+        -----
+        Each table is scanned once: the barcode counts share a scan of
+        ag_kit_barcodes, and the gender counts and average age share a
+        scan of the survey answers, which are first pivoted to one row per
+        survey.
+        """
+        sql = """WITH per_survey AS (
+                     SELECT survey_id,
+                            max(CASE WHEN survey_question_id = 112
+                                THEN response END) AS yr,
+                            max(CASE WHEN survey_question_id = 111
+                                THEN response END) AS mo,
+                            count(CASE WHEN survey_question_id = 107
+                                  AND response = 'Male' THEN 1 END) AS male,
+                            count(CASE WHEN survey_question_id = 107
+                                  AND response = 'Female' THEN 1 END)
+                                AS female
+                     FROM ag.survey_answers
+                     WHERE survey_question_id IN (107, 111, 112)
+                     GROUP BY survey_id),
+                 participants AS (
+                     SELECT AVG(CASE WHEN yr != 'Unspecified'
+                                     AND mo != 'Unspecified'
+                                THEN AGE((yr || '-' ||
+                                    CASE mo
+                                        WHEN 'January' THEN '1'
+                                        WHEN 'February' THEN '2'
+                                        WHEN 'March' THEN '3'
+                                        WHEN 'April' THEN '4'
+                                        WHEN 'May' THEN '5'
+                                        WHEN 'June' THEN '6'
+                                        WHEN 'July' THEN '7'
+                                        WHEN 'August' THEN '8'
+                                        WHEN 'September' THEN '9'
+                                        WHEN 'October' THEN '10'
+                                        WHEN 'November' THEN '11'
+                                        WHEN 'December' THEN '12'
+                                    END || '-1')::date) END) AS average_age,
+                            coalesce(sum(male), 0)::bigint AS male,
+                            coalesce(sum(female), 0)::bigint AS female
+                     FROM per_survey),
+                 kit_barcodes AS (
+                     SELECT count(*) AS registered,
+                            count(CASE WHEN results_ready = 'Y' THEN 1 END)
+                                AS with_results
+                     FROM ag.ag_kit_barcodes)
+                 SELECT (SELECT count(*) FROM ag.ag_handout_kits),
+                        (SELECT count(*) FROM ag.ag_handout_barcodes),
+                        (SELECT count(*) FROM ag.ag_consent),
+                        (SELECT count(*) FROM ag.ag_kit),
+                        kit_barcodes.registered, kit_barcodes.with_results,
+                        participants.average_age,
+                        participants.male, participants.female
+                 FROM kit_barcodes, participants"""
+        names = ['Total handout kits', 'Total handout barcodes',
+                 'Total consented participants', 'Total registered kits',
+                 'Total registered barcodes', 'Total barcodes with results',
+                 'Average age of participants', 'Total male participants',
+                 'Total female participants']
         stats = []
-        for label, sql in stats_list:
-            res = self._con.execute_fetchone(sql)[0]
+        for label, res in zip(names, self._con.execute_fetchone(sql)):
             if type(res) == timedelta:
                 res = str(res.days/365) + " years"
             stats.append((label, res))
@@ -2064,6 +2879,221 @@ class KniminAccess(object):
         self._con.execute(sql, [status, postmark, scan_date, biomass_remaining,
                                 sequencing_status, obsolete, barcode])
 
+    def check_in_barcodes(self, checkins, projects=None, send_mail=True):
+        """Marks many returned samples as received at once
+
+        Parameters
+        ----------
+        checkins : list of Checkin
+            The scanned barcodes with their dates and issues, see
+            knimin.lib.checkin.parse_checkins. A barcode scanned more than
+            once is checked in as its last scan
+        projects : list of str, optional
+            Projects to add the barcodes to, on top of the ones they are in.
+            Default None
+        send_mail : bool, optional
+            Whether to email the owners of american gut samples that their
+            sample was received, or what they still have to do for it to be
+            processed. Default True
+
+        Returns
+        -------
+        tuple of (list of str, list of str)
+            The barcodes checked in, and those whose owners are emailed
+
+        Raises
+        ------
+        ValueError
+            A barcode or project does not exist, or emails are to be queued
+            and the email queue has not been created with labadmin migrate
+
+        Notes
+        -----
+        The status, project and sample issue updates for all the barcodes
+        are made in a single transaction, a statement for each table, so
+        either every barcode is checked in or none are. Emails are only
+        queued, send_queued_emails sends them.
+        """
+        latest = OrderedDict((c.barcode, c) for c in checkins)
+        if not latest:
+            return [], []
+        barcodes = list(latest)
+        sql = """SELECT barcode FROM barcodes.barcode
+                 WHERE barcode = ANY(%s)"""
+        existing = {x[0] for x in
+                    self._con.execute_fetchall(sql, [barcodes])}
+        missing = [b for b in barcodes if b not in existing]
+        if missing:
+            raise ValueError("Barcodes do not exist: %s" % ', '.join(missing))
+        project_ids = []
+        if projects:
+            sql = """SELECT project, project_id FROM barcodes.project
+                     WHERE project = ANY(%s)"""
+            found = dict(self._con.execute_fetchall(sql, [list(projects)]))
+            not_exist = [p for p in projects if p not in found]
+            if not_exist:
+                raise ValueError("Project(s) given don't exist in database: "
+                                 "%s" % ', '.join(not_exist))
+            project_ids = [found[p] for p in projects]
+        if send_mail:
+            self._check_email_queue()
+
+        (_, scan_dates, postmark_dates, moldy, overloaded, other,
+         other_text) = (list(col) for col in zip(*latest.values()))
+        emailed = []
+        with self._con.transaction():
+            sql = """UPDATE barcodes.barcode b
+                     SET status = 'Received', scan_date = c.scan_date,
+                         sample_postmark_date = c.postmark_date
+                     FROM unnest(%s::varchar[], %s::date[], %s::date[])
+                         AS c(barcode, scan_date, postmark_date)
+                     WHERE b.barcode = c.barcode"""
+            self._con.execute(sql, [barcodes, scan_dates, postmark_dates])
+            if project_ids:
+                self._add_to_projects(barcodes, project_ids)
+                self._mark_assigned(barcodes)
+            # a note is kept unless the scan has a new one
+            sql = """UPDATE ag.ag_kit_barcodes akb
+                     SET moldy = c.moldy, overloaded = c.overloaded,
+                         other = c.other,
+                         other_text = coalesce(c.other_text, akb.other_text)
+                     FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[],
+                                 %s::varchar[], %s::varchar[])
+                         AS c(barcode, moldy, overloaded, other, other_text)
+                     WHERE akb.barcode = c.barcode"""
+            self._con.execute(sql, [barcodes, moldy, overloaded, other,
+                                    other_text])
+            if send_mail:
+                emailed = self._queue_checkin_emails(barcodes)
+        return barcodes, emailed
+
+    def _check_email_queue(self):
+        """Raises a ValueError if the email queue has not been created"""
+        sql = "SELECT to_regclass('ag.email_queue')"
+        if self._con.execute_fetchone(sql)[0] is None:
+            raise ValueError("The email queue does not exist, run "
+                             "labadmin migrate to create it")
+
+    def _queue_checkin_emails(self, barcodes):
+        """Queues the received emails of american gut barcodes with an owner
+        to email, and returns those barcodes"""
+        # same as the barcode util page, a sample is ready to process once
+        # it is logged with a survey or as environmental
+        sql = """SELECT akb.barcode, l.email, l.name,
+                     coalesce(to_char(akb.sample_date, 'YYYY-MM-DD'), ''),
+                     coalesce(to_char(akb.sample_time, 'HH24:MI'), ''),
+                     akb.sample_date IS NOT NULL
+                         AND (coalesce(akb.environment_sampled, '') <> ''
+                              OR coalesce(akb.survey_id, '') <> '')
+                 FROM ag.ag_kit_barcodes akb
+                 JOIN ag.ag_kit USING (ag_kit_id)
+                 JOIN ag.ag_login l USING (ag_login_id)
+                 WHERE akb.barcode = ANY(%s)
+                     AND coalesce(l.email, '') <> ''
+                     AND EXISTS (
+                         SELECT 1 FROM barcodes.project_barcode
+                         JOIN barcodes.project USING (project_id)
+                         WHERE barcode = akb.barcode
+                             AND project = 'American Gut Project')
+                 ORDER BY akb.barcode"""
+        emails = []
+        for barcode, email, name, sample_date, sample_time, ready in \
+                self._con.execute_fetchall(sql, [barcodes]):
+            subject, body = build_checkin_email(
+                name or 'American Gut participant', barcode,
+                '1' if ready else '0', sample_date, sample_time)
+            emails.append((email, subject, body, barcode))
+        if not emails:
+            return []
+        emails = [list(col) for col in zip(*emails)]
+        sql = """INSERT INTO ag.email_queue
+                     (recipient, subject, body, barcode)
+                 SELECT *
+                 FROM unnest(%s::varchar[], %s::varchar[], %s::text[],
+                             %s::varchar[])"""
+        self._con.execute(sql, emails)
+        return emails[3]
+
+    def send_queued_emails(self, limit=100, max_attempts=5):
+        """Sends emails waiting in the email queue
+
+        Parameters
+        ----------
+        limit : int, optional
+            Most emails to send. Default 100
+        max_attempts : int, optional
+            Times an email is tried before it is left unsent. Default 5
+
+        Returns
+        -------
+        tuple of (int, int)
+            Number of emails sent, and number that failed and are tried
+            again next time
+
+        Raises
+        ------
+        ValueError
+            The email queue has not been created with labadmin migrate
+
+        Notes
+        -----
+        Emails are claimed before they are sent, skipping those claimed by
+        other callers, so they can run at the same time without sending an
+        email twice. An email claimed by a caller that died is tried again
+        after an hour. No transaction is held open while sending. The
+        email date of the barcode an email is about is set once it is sent.
+        """
+        self._check_email_queue()
+        sql = """UPDATE ag.email_queue
+                 SET attempts = attempts + 1, claimed_on = NOW()
+                 WHERE email_id IN (
+                     SELECT email_id FROM ag.email_queue
+                     WHERE sent_on IS NULL AND attempts < %s
+                         AND (claimed_on IS NULL
+                              OR claimed_on < NOW() - interval '1 hour')
+                     ORDER BY email_id
+                     LIMIT %s
+                     FOR UPDATE SKIP LOCKED)
+                 RETURNING email_id, recipient, subject, body"""
+        claimed = sorted(self._con.execute_fetchall(sql, [max_attempts,
+                                                          limit]))
+        sent = []
+        failed = []
+        for email_id, recipient, subject, body in claimed:
+            try:
+                send_email(body, subject, recipient)
+            except Exception as e:
+                failed.append((email_id, ('%s' % e)[:1000]))
+            else:
+                sent.append(email_id)
+        if sent:
+            with self._con.transaction():
+                sql = """UPDATE ag.email_queue
+                         SET sent_on = NOW(), last_error = NULL
+                         WHERE email_id = ANY(%s)"""
+                self._con.execute(sql, [sent])
+                sql = """UPDATE ag.ag_kit_barcodes akb
+                         SET date_of_last_email = q.sent_on::date
+                         FROM ag.email_queue q
+                         WHERE q.email_id = ANY(%s)
+                             AND akb.barcode = q.barcode"""
+                self._con.execute(sql, [sent])
+        if failed:
+            sql = """UPDATE ag.email_queue q
+                     SET claimed_on = NULL, last_error = f.error
+                     FROM unnest(%s::integer[], %s::varchar[])
+                         AS f(email_id, error)
+                     WHERE q.email_id = f.email_id"""
+            self._con.execute(sql, [list(col) for col in zip(*failed)])
+        return len(sent), len(failed)
+
+    def count_queued_emails(self):
+        """Returns the number of queued emails not sent yet"""
+        self._check_email_queue()
+        sql = """SELECT count(*) FROM ag.email_queue
+                 WHERE sent_on IS NULL"""
+        return self._con.execute_fetchone(sql)[0]
+
     def get_barcode_survey(self, barcode):
         """Return survey ID attached to barcode"""
         sql = """SELECT DISTINCT ags.survey_id FROM ag.ag_kit_barcodes
@@ -2351,12 +3381,20 @@ class KniminAccess(object):
                      AS P"""
 
             self._con.execute(sql, [barcode, tuple(add_projects)])
+            self._mark_assigned([barcode])
         if rem_projects:
             sql = """DELETE FROM barcodes.project_barcode
                      WHERE barcode = %s AND project_id IN (
                        SELECT project_id
                        FROM barcodes.project WHERE project IN %s)"""
             self._con.execute(sql, [barcode, tuple(rem_projects)])
+            # a barcode taken out of all its projects is unassigned again
+            sql = """UPDATE barcodes.barcode
+                     SET assigned_on = NULL
+                     WHERE barcode = %s AND NOT EXISTS (
+                       SELECT 1 FROM barcodes.project_barcode
+                       WHERE barcode = %s)"""
+            self._con.execute(sql, [barcode, barcode])
 
     def getProjectNames(self):
         """Returns a list of project names
@@ -2390,3 +3428,31 @@ class KniminAccess(object):
                  SET results_ready = NULL
                  WHERE barcode IN %s"""
         self._con.execute(sql, [tuple(barcodes)])
+
+    def _unassign_barcodes(self, barcodes):
+        """Test helper to take barcodes out of all projects"""
+        sql = """DELETE FROM barcodes.project_barcode
+                 WHERE barcode IN %s"""
+        self._con.execute(sql, [tuple(barcodes)])
+        sql = """UPDATE barcodes.barcode
+                 SET assigned_on = NULL
+                 WHERE barcode IN %s"""
+        self._con.execute(sql, [tuple(barcodes)])
+
+    def _detach_from_kits(self, barcodes):
+        """Test helper to take barcodes out of their kits"""
+        sql = """DELETE FROM ag.ag_kit_barcodes
+                 WHERE barcode IN %s"""
+        self._con.execute(sql, [tuple(barcodes)])
+
+    def _delete_barcodes(self, barcodes):
+        """Test helper to remove barcodes that are not in a project"""
+        sql = """DELETE FROM barcodes.barcode
+                 WHERE barcode IN %s"""
+        self._con.execute(sql, [tuple(barcodes)])
+
+    def _delete_queued_emails(self, barcodes):
+        """Test helper to remove the queued emails about barcodes"""
+        sql = """DELETE FROM ag.email_queue
+                 WHERE barcode IN %s"""
+        self._con.execute(sql, [tuple(barcodes)])
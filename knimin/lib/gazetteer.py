@@ -0,0 +1,183 @@
+from os import makedirs
+from os.path import dirname, isdir
+from threading import Lock
+import sqlite3
+
+from knimin.lib.geocoder import Location
+
+
+class Gazetteer(object):
+    """Offline postal code lookups from a GeoNames postal code dump
+
+    Parameters
+    ----------
+    fp : str
+        Path to the SQLite file the gazetteer is stored in, created along
+        with its directory if it does not exist. ':memory:' keeps it in
+        memory only
+
+    Notes
+    -----
+    The dumps are available from http://download.geonames.org/export/zip/
+    (postal codes) and http://download.geonames.org/export/dump/
+    (countryInfo.txt). The postal code dumps do not hold elevations, so
+    these are stored with `set_elevation` once looked up elsewhere.
+    """
+    def __init__(self, fp):
+        self._lock = Lock()
+        if fp != ':memory:' and dirname(fp) and not isdir(dirname(fp)):
+            makedirs(dirname(fp))
+        self._con = sqlite3.connect(fp, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute("""CREATE TABLE IF NOT EXISTS country (
+                                     code TEXT PRIMARY KEY,
+                                     name TEXT NOT NULL)""")
+            self._con.execute("""CREATE TABLE IF NOT EXISTS postcode (
+                                     country TEXT NOT NULL,
+                                     postcode TEXT NOT NULL,
+                                     city TEXT,
+                                     state TEXT,
+                                     latitude REAL NOT NULL,
+                                     longitude REAL NOT NULL,
+                                     elevation REAL,
+                                     PRIMARY KEY (country, postcode))""")
+
+    @staticmethod
+    def normalize(postcode):
+        """Normalizes a postal code for lookups
+
+        Parameters
+        ----------
+        postcode : str
+            The postal code to normalize
+
+        Returns
+        -------
+        unicode
+            The postal code uppercased with all whitespace removed, and any
+            extension after a dash (e.g. USA ZIP+4) dropped
+        """
+        if isinstance(postcode, str):
+            postcode = postcode.decode('utf-8', 'replace')
+        return ''.join(postcode.upper().split('-')[0].split())
+
+    @classmethod
+    def _candidates(cls, postcode):
+        """Postal codes to try for a lookup, the full code first"""
+        candidates = [cls.normalize(postcode)]
+        parts = postcode.strip().split()
+        if len(parts) > 1:
+            candidates.append(cls.normalize(parts[0]))
+        return candidates
+
+    def load(self, postal_codes, country_info):
+        """Loads GeoNames postal codes, replacing any already loaded
+
+        Parameters
+        ----------
+        postal_codes : iterable of str
+            Lines of a GeoNames postal code dump, e.g. allCountries.txt
+        country_info : iterable of str
+            Lines of the GeoNames countryInfo.txt file
+
+        Returns
+        -------
+        int
+            Number of postal codes loaded
+
+        Notes
+        -----
+        If a postal code is listed for more than one place, the first place
+        listed is kept.
+        """
+        countries = {}
+        for line in country_info:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            countries[fields[0]] = fields[4].decode('utf-8')
+
+        def _rows():
+            for line in postal_codes:
+                fields = line.rstrip('\r\n').decode('utf-8').split('\t')
+                country = countries.get(fields[0])
+                if country is None or not fields[9] or not fields[10]:
+                    continue
+                # Like the Google API, use state abbreviations (e.g. CA) but
+                # names where the codes are numbers
+                state = fields[4] if fields[4].isalpha() else fields[3]
+                yield (country, self.normalize(fields[1]), fields[2],
+                       state or None, float(fields[9]), float(fields[10]))
+
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM postcode")
+            self._con.execute("DELETE FROM country")
+            self._con.executemany("INSERT INTO country VALUES (?, ?)",
+                                  countries.items())
+            self._con.executemany(
+                """INSERT OR IGNORE INTO postcode
+                   (country, postcode, city, state, latitude, longitude)
+                   VALUES (?, ?, ?, ?, ?, ?)""", _rows())
+            return self._con.execute(
+                "SELECT count(*) FROM postcode").fetchone()[0]
+
+    def lookup(self, postcode, country):
+        """Looks up a postal code
+
+        Parameters
+        ----------
+        postcode : str
+            The postal code to look up
+        country : str
+            Name of the country the postal code is in, e.g. 'United States'
+
+        Returns
+        -------
+        Location or None
+            The location of the postal code, with input and postcode set to
+            `postcode`, or None if it is not in the gazetteer. Elevation is
+            None if it has not been stored yet.
+
+        Notes
+        -----
+        Postal codes not found in full are also looked up by their first
+        part, since some dumps (e.g. GB) only list outward codes.
+        """
+        if isinstance(country, str):
+            country = country.decode('utf-8', 'replace')
+        with self._lock:
+            for candidate in self._candidates(postcode):
+                row = self._con.execute(
+                    """SELECT latitude, longitude, elevation, city, state
+                       FROM postcode
+                       WHERE country = ? AND postcode = ?""",
+                    [country, candidate]).fetchone()
+                if row is not None:
+                    break
+        if row is None:
+            return None
+        lat, lng, elev, city, state = row
+        return Location(postcode, lat, lng, elev, city, state, postcode,
+                        country)
+
+    def set_elevation(self, postcode, country, elevation):
+        """Stores the elevation of a postal code
+
+        Parameters
+        ----------
+        postcode : str
+            The postal code, as returned by `lookup`
+        country : str
+            Name of the country the postal code is in
+        elevation : float
+            Elevation in meters
+        """
+        if isinstance(country, str):
+            country = country.decode('utf-8', 'replace')
+        with self._lock, self._con:
+            for candidate in self._candidates(postcode):
+                if self._con.execute(
+                        """UPDATE postcode SET elevation = ?
+                           WHERE country = ? AND postcode = ?""",
+                        [elevation, country, candidate]).rowcount:
+                    break
@@ -0,0 +1,237 @@
+from datetime import date, datetime
+from json import dump, load
+from os import rename, makedirs
+from os.path import exists, dirname, isdir
+from threading import Lock
+
+# States a run can be in. A run that is running or waiting for quota is
+# picked up again after a restart.
+IDLE = 'idle'
+RUNNING = 'running'
+QUOTA = 'waiting for quota'
+DONE = 'done'
+ERROR = 'error'
+
+
+class GeocodeWorker(object):
+    """Geocodes logins in batches, checkpointing its progress to disk
+
+    Parameters
+    ----------
+    db : KniminAccess
+        Access to the database holding the logins
+    checkpoint_fp : str
+        Path to the JSON file the progress is kept in, created along with its
+        directory if it does not exist
+    daily_quota : int
+        Most unique addresses geocoded per day
+    batch_size : int, optional
+        Most unique addresses geocoded by each step. Default 100
+
+    Notes
+    -----
+    The checkpoint holds the state of the current run, what is left of
+    its limit, and the quota used and logins geocoded today, so a run
+    interrupted by a restart or the quota carries on where it left off.
+    Each address geocoded counts against the quota, even when the answer
+    came from the geocode cache. Only one process should run a worker for
+    a given checkpoint at a time.
+    """
+    def __init__(self, db, checkpoint_fp, daily_quota, batch_size=100):
+        self._db = db
+        self.checkpoint_fp = checkpoint_fp
+        self.daily_quota = daily_quota
+        self.batch_size = batch_size
+        # _lock guards the state, _running is held while batches are run
+        self._lock = Lock()
+        self._running = Lock()
+        self.state = self._load()
+
+    @staticmethod
+    def _today():
+        return date.today().isoformat()
+
+    def _new_day(self):
+        return {'date': self._today(), 'quota_used': 0, 'logins': 0,
+                'addresses': 0, 'failed': 0, 'calls_saved': 0}
+
+    def _load(self):
+        state = {'status': IDLE, 'limit_left': None, 'retry': False,
+                 'started': None, 'updated': None, 'error': None}
+        state.update(self._new_day())
+        if exists(self.checkpoint_fp):
+            with open(self.checkpoint_fp) as f:
+                state.update(load(f))
+        return state
+
+    def _save(self):
+        self.state['updated'] = datetime.now().isoformat()
+        # write then rename, so a crash never leaves half a checkpoint
+        if dirname(self.checkpoint_fp) and not isdir(
+                dirname(self.checkpoint_fp)):
+            makedirs(dirname(self.checkpoint_fp))
+        tmp_fp = self.checkpoint_fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            dump(self.state, f, indent=4, sort_keys=True)
+        rename(tmp_fp, self.checkpoint_fp)
+
+    def _rollover(self):
+        """Starts a new day of quota once the date changes"""
+        if self.state['date'] != self._today():
+            self.state.update(self._new_day())
+
+    @property
+    def running(self):
+        """Whether a run is going on in this process"""
+        return self._running.locked()
+
+    def status(self):
+        """Gets the progress of the worker
+
+        Returns
+        -------
+        dict
+            The checkpointed state, with 'quota_left' added. Read from the
+            checkpoint if no run is going on in this process, so it also
+            shows the progress of other processes
+        """
+        with self._lock:
+            if not self.running:
+                self.state = self._load()
+            self._rollover()
+            status = dict(self.state)
+        status['quota_left'] = max(self.daily_quota - status['quota_used'], 0)
+        return status
+
+    def start(self, limit=None, retry=False):
+        """Starts a new run
+
+        Parameters
+        ----------
+        limit : int, optional
+            Most unique addresses to geocode in the run. Default all
+        retry : bool, optional
+            Whether to retry previously failed geocodings. Default False
+
+        Returns
+        -------
+        bool
+            Whether the run was started, False if one is already running
+            in this process
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._rollover()
+            self.state.update({'status': RUNNING, 'limit_left': limit,
+                               'retry': retry, 'error': None,
+                               'started': datetime.now().isoformat()})
+            self._save()
+        return True
+
+    def _next_batch(self):
+        """Size of the next batch of the run, or 0 if it cannot carry on"""
+        self._rollover()
+        if self.state['status'] == QUOTA:
+            self.state['status'] = RUNNING
+        if self.state['status'] != RUNNING:
+            return 0
+        size = min(self.batch_size,
+                   self.daily_quota - self.state['quota_used'])
+        if self.state['limit_left'] is not None:
+            size = min(size, self.state['limit_left'])
+        if size <= 0:
+            self.state['status'] = (
+                DONE if self.state['limit_left'] == 0 else QUOTA)
+            self._save()
+        return max(size, 0)
+
+    def _record(self, report, size):
+        """Adds the report of a batch to the run"""
+        self.state['retry'] = False
+        for key in ('logins', 'addresses', 'failed', 'calls_saved'):
+            self.state[key] += report[key]
+        self.state['quota_used'] += report['addresses']
+        if self.state['limit_left'] is not None:
+            self.state['limit_left'] -= report['addresses']
+        if report['limit_exceeded']:
+            # the API says the quota is used up, whatever we counted
+            self.state['quota_used'] = max(self.state['quota_used'],
+                                           self.daily_quota)
+            self.state['status'] = QUOTA
+        elif report['addresses'] < size:
+            self.state['status'] = DONE
+        self._save()
+
+    def step(self):
+        """Geocodes a batch of logins for the current run
+
+        Returns
+        -------
+        bool
+            Whether the run has more to do today
+        """
+        with self._lock:
+            size = self._next_batch()
+            if not size:
+                return False
+            retry = self.state['retry']
+
+        try:
+            report = self._db.addGeocodingInfo(size, retry)
+        except Exception as e:
+            with self._lock:
+                self.state['status'] = ERROR
+                self.state['error'] = '%s: %s' % (type(e).__name__, e)
+                self._save()
+            raise
+
+        with self._lock:
+            self._record(report, size)
+            return self.state['status'] == RUNNING
+
+    def run(self):
+        """Geocodes batches until the run is done or out of quota
+
+        Returns
+        -------
+        bool
+            False if a run was already going on in this process
+        """
+        if not self._running.acquire(False):
+            return False
+        try:
+            while self.step():
+                pass
+        finally:
+            self._running.release()
+        return True
+
+    def tick(self):
+        """Picks up an unfinished run, if any, and runs it
+
+        Returns
+        -------
+        bool
+            False if a run was already going on in this process
+        """
+        with self._lock:
+            status = self.state['status']
+        if status not in (RUNNING, QUOTA):
+            return True
+        return self.run()
+
+
+_worker = None
+
+
+def get_worker():
+    """Gets the shared geocoding worker, set up from the configuration"""
+    global _worker
+    if _worker is None:
+        from knimin import db
+        from knimin.lib.configuration import config
+        _worker = GeocodeWorker(db, config.geocode_checkpoint_fp,
+                                config.geocode_daily_quota,
+                                config.geocode_batch_size)
+    return _worker
@@ -1,7 +1,25 @@
 from collections import namedtuple
-from json import loads
+from functools import partial
+from itertools import islice
+from json import loads, dumps
+from multiprocessing.pool import ThreadPool
+from os import makedirs
+from os.path import dirname, isdir
+from random import uniform
+from threading import Event, Lock
+import sqlite3
 import requests
-from time import sleep
+from requests.adapters import HTTPAdapter
+from time import sleep, time
+
+# Base of the geocoding and elevation API URLs
+API_URL = 'https://maps.googleapis.com'
+# Seconds waited before the first retry of a request, doubled for each retry
+BACKOFF = 0.1
+ELEVATION_PATH = '/maps/api/elevation/json?locations='
+# Limits on a single elevation request, which takes many locations at once
+MAX_URL_LENGTH = 8192
+MAX_LOCATIONS = 512
 
 
 class GoogleAPILimitExceeded(Exception):
@@ -15,16 +33,313 @@ class GoogleAPIRequestDenied(Exception):
 class GoogleAPIInvalidRequest(Exception):
     pass
 
+
+class ElevationNotFound(Exception):
+    pass
+
 Location = namedtuple('Location', ['input', 'lat', 'long', 'elev', 'city',
                       'state', 'postcode', 'country'])
 
 
+class GeocodeCache(object):
+    """Persistent cache of geocoding answers, stored in SQLite
+
+    Parameters
+    ----------
+    fp : str
+        Path to the SQLite file, created along with its directory if it does
+        not exist. ':memory:' keeps the cache in memory only
+    ttl : float
+        Seconds a found address is cached for
+    negative_ttl : float
+        Seconds an address that could not be geocoded is cached for
+
+    Notes
+    -----
+    Addresses are keyed after normalizing them with `normalize`, so the same
+    address written with different case, commas or spacing is only looked
+    up once. The cache can be shared between threads.
+    """
+    def __init__(self, fp, ttl, negative_ttl):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = Lock()
+        if fp != ':memory:' and dirname(fp) and not isdir(dirname(fp)):
+            makedirs(dirname(fp))
+        self._con = sqlite3.connect(fp, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute("""CREATE TABLE IF NOT EXISTS geocode (
+                                    address TEXT PRIMARY KEY,
+                                    location TEXT,
+                                    expires REAL NOT NULL)""")
+
+    @staticmethod
+    def normalize(address):
+        """Normalizes an address for use as the cache key
+
+        Parameters
+        ----------
+        address : str
+            The address to normalize
+
+        Returns
+        -------
+        unicode
+            The address lowercased, with commas dropped and runs of whitespace
+            collapsed to a single space
+        """
+        if isinstance(address, str):
+            address = address.decode('utf-8', 'replace')
+        return ' '.join(address.lower().replace(',', ' ').split())
+
+    def get(self, address):
+        """Gets the cached answer for an address
+
+        Parameters
+        ----------
+        address : str
+            The address to look up
+
+        Returns
+        -------
+        Location or None
+            The cached location, with input set to `address`, or None if the
+            address is not cached, its answer expired or has no elevation.
+            Addresses that could not be geocoded have None for all fields but
+            input.
+        """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT location, expires FROM geocode WHERE address = ?",
+                [self.normalize(address)]).fetchone()
+        if row is None or row[1] < time():
+            return None
+        if row[0] is None:
+            return Location(address, None, None, None, None, None, None, None)
+        location = Location(address, *loads(row[0]))
+        if location.elev is None:
+            # cached before missing elevations were treated as errors
+            return None
+        return location
+
+    def set(self, address, location):
+        """Caches the answer for an address
+
+        Parameters
+        ----------
+        address : str
+            The address the answer is for
+        location : Location
+            The answer. If lat is None, it is cached as an address that could
+            not be geocoded.
+        """
+        if location.lat is None:
+            value = None
+            expires = time() + self.negative_ttl
+        else:
+            value = dumps(location[1:])
+            expires = time() + self.ttl
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)",
+                [self.normalize(address), value, expires])
+
+    def purge(self):
+        """Removes all expired answers from the cache
+
+        Returns
+        -------
+        int
+            Number of answers removed
+        """
+        with self._lock, self._con:
+            return self._con.execute(
+                "DELETE FROM geocode WHERE expires < ?", [time()]).rowcount
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_cache():
+    """Gets the geocoding cache shared by all callers, set up from config
+
+    Returns
+    -------
+    GeocodeCache or None
+        The shared cache, or None if caching is turned off in the config
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from knimin.lib.configuration import config
+            if not config.geocode_cache_fp:
+                return None
+            _cache = GeocodeCache(config.geocode_cache_fp,
+                                  config.geocode_cache_ttl,
+                                  config.geocode_negative_ttl)
+        return _cache
+
+
+def set_cache(cache):
+    """Replaces the geocoding cache shared by all callers
+
+    Parameters
+    ----------
+    cache : GeocodeCache
+        The new shared cache
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+class RateLimiter(object):
+    """Token bucket limiting how often requests are sent, shared by threads
+
+    Parameters
+    ----------
+    rate : float
+        Most requests per second
+    burst : int, optional
+        Most requests sent at once after being idle. Default 1
+
+    Notes
+    -----
+    The rate adapts to the API: `backoff` halves it whenever the API reports
+    going over the query limit, and `recover` adds back a tenth of the
+    configured rate after each successful request.
+    """
+    def __init__(self, rate, burst=1):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Blocks until a request can be sent"""
+        while True:
+            with self._lock:
+                now = time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+    def backoff(self):
+        """Halves the rate, down to one request every ten seconds"""
+        with self._lock:
+            self.rate = max(0.1, self.rate / 2)
+
+    def recover(self):
+        """Raises the rate back towards the configured rate"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+_session = None
+_limiter = None
+_http_lock = Lock()
+
+
+def _get_session():
+    """Gets the HTTP session shared by all callers, so connections are reused
+    """
+    global _session
+    with _http_lock:
+        if _session is None:
+            from knimin.lib.configuration import config
+            adapter = HTTPAdapter(pool_connections=2,
+                                  pool_maxsize=config.geocode_workers)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def get_rate_limiter():
+    """Gets the rate limiter shared by all callers, set up from config
+
+    Returns
+    -------
+    RateLimiter
+        The shared rate limiter
+    """
+    global _limiter
+    with _http_lock:
+        if _limiter is None:
+            from knimin.lib.configuration import config
+            _limiter = RateLimiter(config.geocode_requests_per_second,
+                                   config.geocode_workers)
+        return _limiter
+
+
+_gazetteer = None
+_gazetteer_lock = Lock()
+
+
+def get_gazetteer():
+    """Gets the offline gazetteer, if it is the configured geocoder backend
+
+    Returns
+    -------
+    knimin.lib.gazetteer.Gazetteer or None
+        The shared gazetteer, or None if postal codes are geocoded online
+    """
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            from knimin.lib.configuration import config
+            if config.geocoder_backend != 'gazetteer':
+                return None
+            from knimin.lib.gazetteer import Gazetteer
+            _gazetteer = Gazetteer(config.gazetteer_fp)
+        return _gazetteer
+
+
+def set_gazetteer(gazetteer):
+    """Replaces the offline gazetteer shared by all callers
+
+    Parameters
+    ----------
+    gazetteer : knimin.lib.gazetteer.Gazetteer
+        The new shared gazetteer
+    """
+    global _gazetteer
+    with _gazetteer_lock:
+        _gazetteer = gazetteer
+
+
+def set_rate_limiter(limiter):
+    """Replaces the rate limiter shared by all callers
+
+    Parameters
+    ----------
+    limiter : RateLimiter
+        The new shared rate limiter
+    """
+    global _limiter
+    with _http_lock:
+        _limiter = limiter
+
+
 def _call_wrapper(url):  # noqa
     """Encapsulate all checks for API calls"""
-    # allow 4 retries do we sleep longer than a second if all loops happen
+    session = _get_session()
+    limiter = get_rate_limiter()
+    # allow 4 retries, backing off exponentially between them
     stat_err_count = 0
     for retry in range(4):
-        req = requests.get(url)
+        if retry:
+            sleep(uniform(0.5, 1) * BACKOFF * 2 ** retry)
+        limiter.acquire()
+        req = session.get(url)
         if req.status_code != 200:
             stat_err_count += 1
             if stat_err_count == 3:
@@ -35,10 +350,11 @@ def _call_wrapper(url):  # noqa
 
         geo = loads(req.content)
         if geo['status'] == "OK":
+            limiter.recover()
             break
         elif geo['status'] == "OVER_QUERY_LIMIT":
-            # sleep in case we're over the 5 requests/sec limit
-            sleep(0.3)
+            # slow down in case we're over the requests/sec limit
+            limiter.backoff()
         elif geo['status'] == "ZERO_RESULTS":
             return {}
         elif geo['status'] == "REQUEST_DENIED":
@@ -54,11 +370,227 @@ def _call_wrapper(url):  # noqa
     return geo['results']
 
 
-def geocode(address):
-    geo_url = 'https://maps.googleapis.com' + \
-        '/maps/api/geocode/json?address=%s'
-    elev_url = 'https://maps.googleapis.com' + \
-        '/maps/api/elevation/json?locations=%s'
+def geocode(address, use_cache=True):
+    """Geocodes an address, using the shared cache where possible
+
+    Parameters
+    ----------
+    address : str
+        The address to geocode
+    use_cache : bool, optional
+        Whether to look the address up in, and store the answer to, the
+        shared cache. Default True
+
+    Returns
+    -------
+    Location
+        The location found. All fields but input are None if the address
+        could not be geocoded.
+
+    Raises
+    ------
+    ElevationNotFound
+        If the address was found but its elevation could not be looked up
+    """
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        location = cache.get(address)
+        if location is not None:
+            return location
+
+    location = _geocode(address)
+    if cache is not None:
+        cache.set(address, location)
+    return location
+
+
+def geocode_postcode(postcode, country):
+    """Geocodes a postal code, offline if the gazetteer backend is configured
+
+    Parameters
+    ----------
+    postcode : str
+        The postal code to geocode
+    country : str
+        Name of the country the postal code is in
+
+    Returns
+    -------
+    Location
+        The location found. All fields but input are None if the postal code
+        could not be geocoded.
+
+    Notes
+    -----
+    Postal codes missing from the gazetteer are geocoded online. The
+    gazetteer holds no elevations to begin with, so the elevation of a
+    postal code is looked up online the first time and then stored.
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        location = gazetteer.lookup(postcode, country)
+        if location is not None:
+            if location.elev is None:
+                location = location._replace(
+                    elev=_elevation(location.lat, location.long))
+                gazetteer.set_elevation(postcode, country, location.elev)
+            return location
+    return geocode('%s %s' % (postcode, country))
+
+
+def geocode_postcodes(pairs, workers=None):
+    """Geocodes many postal codes, batching the elevation lookups
+
+    Parameters
+    ----------
+    pairs : list of (str, str)
+        The (postal code, country name) pairs to geocode
+    workers : int, optional
+        Most addresses geocoded online at once. Default the configured
+        number of geocoding workers
+
+    Returns
+    -------
+    list of Location or Exception
+        The location of each pair, in the order given, or the error raised
+        while geocoding it
+
+    Notes
+    -----
+    Works like `geocode_postcode` for each pair: gazetteer hits missing an
+    elevation have it looked up and stored, and the rest are geocoded
+    online with `geocode_many`.
+    """
+    results = [None] * len(pairs)
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        for i, (postcode, country) in enumerate(pairs):
+            results[i] = gazetteer.lookup(postcode, country)
+
+    need = [i for i, r in enumerate(results)
+            if r is not None and r.elev is None]
+    try:
+        elevs = elevations([(results[i].lat, results[i].long) for i in need])
+    except Exception as e:
+        elevs = [e] * len(need)
+    for i, elev in zip(need, elevs):
+        if isinstance(elev, Exception):
+            results[i] = elev
+        else:
+            results[i] = results[i]._replace(elev=elev)
+            gazetteer.set_elevation(pairs[i][0], pairs[i][1], elev)
+
+    online = [i for i, r in enumerate(results) if r is None]
+    found = geocode_many(['%s %s' % pairs[i] for i in online], workers)
+    for i, location in zip(online, found):
+        results[i] = location
+    return results
+
+
+def _locate_cached(address, stop):
+    """Gets the cached answer for an address, or geocodes it without elevation
+
+    Returns
+    -------
+    tuple of (Location or Exception, bool)
+        The location, or the error raised while geocoding, and whether it
+        came from the cache
+    """
+    if stop.is_set():
+        return GoogleAPILimitExceeded("Exceeded max calls per day"), False
+    try:
+        cache = get_cache()
+        if cache is not None:
+            location = cache.get(address)
+            if location is not None:
+                return location, True
+        return _locate(address), False
+    except GoogleAPILimitExceeded as e:
+        # no use sending the rest of the addresses
+        stop.set()
+        return e, False
+    except Exception as e:
+        return e, False
+
+
+def geocode_many(addresses, workers=None, chunk_size=100):
+    """Geocodes addresses concurrently
+
+    Parameters
+    ----------
+    addresses : iterable of str
+        The addresses to geocode
+    workers : int, optional
+        Most addresses geocoded at once. Default the configured number of
+        geocoding workers
+    chunk_size : int, optional
+        Number of addresses geocoded before their elevations are looked up
+        together. Default 100
+
+    Yields
+    ------
+    Location or Exception
+        The location of each address, in the order given, or the error
+        raised while geocoding it
+
+    Notes
+    -----
+    All requests share one pooled HTTP session and the shared rate limiter,
+    so the API quota holds however many workers are used. Each chunk is
+    geocoded first, then the elevations of all new points in it are looked
+    up in as few requests as possible. Once GoogleAPILimitExceeded is seen
+    the remaining addresses are not sent; stop iterating to stop early.
+    """
+    if workers is None:
+        from knimin.lib.configuration import config
+        workers = config.geocode_workers
+    pool = ThreadPool(workers)
+    stop = Event()
+    addresses = iter(addresses)
+    try:
+        while True:
+            chunk = list(islice(addresses, chunk_size))
+            if not chunk:
+                break
+            found = pool.map(partial(_locate_cached, stop=stop), chunk, 1)
+            results = [location for location, _ in found]
+            new = [i for i, (location, cached) in enumerate(found)
+                   if not cached and isinstance(location, Location)]
+
+            need = [i for i in new if results[i].lat is not None]
+            try:
+                elevs = elevations(
+                    [(results[i].lat, results[i].long) for i in need], pool)
+            except Exception as e:
+                elevs = [e] * len(need)
+            for i, elev in zip(need, elevs):
+                if isinstance(elev, Exception):
+                    results[i] = elev
+                else:
+                    results[i] = results[i]._replace(elev=elev)
+
+            cache = get_cache()
+            if cache is not None:
+                for i in new:
+                    if isinstance(results[i], Location):
+                        cache.set(chunk[i], results[i])
+            for location in results:
+                yield location
+    finally:
+        pool.terminate()
+
+
+def _geocode(address):
+    """Geocodes an address with the Google API"""
+    location = _locate(address)
+    if location.lat is None:
+        return location
+    return location._replace(elev=_elevation(location.lat, location.long))
+
+
+def _locate(address):
+    """Geocodes an address with the Google API, without its elevation"""
+    geo_url = API_URL + '/maps/api/geocode/json?address=%s'
 
     geo = _call_wrapper(geo_url % address)
     if not geo:
@@ -85,7 +617,82 @@ def geocode(address):
             country = geo_dict['long_name']
         elif geotype == "postal_code" or geotype == "postal_code_prefix":
             postcode = geo_dict['long_name']
-    geo2 = _call_wrapper(elev_url % "%f,%f" % (lat, lng))
-    elev = float(geo2[0]['elevation'])
 
-    return Location(address, lat, lng, elev, city, state, postcode, country)
+    return Location(address, lat, lng, None, city, state, postcode, country)
+
+
+def _elevation(lat, lng):
+    """Gets the elevation of a point from the Google API"""
+    elev = elevations([(lat, lng)])[0]
+    if isinstance(elev, ElevationNotFound):
+        raise elev
+    return elev
+
+
+def _pack_locations(points):
+    """Splits points into batches that fit in one elevation request URL
+
+    Parameters
+    ----------
+    points : list of (float, float)
+        The (latitude, longitude) points
+
+    Returns
+    -------
+    list of str
+        The locations parameter of each request
+    """
+    base = len(API_URL + ELEVATION_PATH)
+    batches = []
+    batch = []
+    length = base
+    for lat, lng in points:
+        location = "%f,%f" % (lat, lng)
+        # the separating | is sent URL encoded as %7C
+        added = len(location) + (3 if batch else 0)
+        if batch and (length + added > MAX_URL_LENGTH or
+                      len(batch) == MAX_LOCATIONS):
+            batches.append('|'.join(batch))
+            batch = []
+            length = base
+            added = len(location)
+        batch.append(location)
+        length += added
+    if batch:
+        batches.append('|'.join(batch))
+    return batches
+
+
+def elevations(points, pool=None):
+    """Gets the elevations of many points in as few requests as possible
+
+    Parameters
+    ----------
+    points : list of (float, float)
+        The (latitude, longitude) points
+    pool : multiprocessing.pool.ThreadPool, optional
+        If given, the requests are sent concurrently on it
+
+    Returns
+    -------
+    list of float or ElevationNotFound
+        The elevation of each point, in meters, in the order given, or the
+        error for the points of a request that did not answer for each of
+        them
+    """
+    batches = _pack_locations(points)
+    urls = [API_URL + ELEVATION_PATH + batch for batch in batches]
+    if pool is not None and len(urls) > 1:
+        answers = pool.map(_call_wrapper, urls)
+    else:
+        answers = [_call_wrapper(url) for url in urls]
+    elevs = []
+    for batch, answer in zip(batches, answers):
+        count = batch.count('|') + 1
+        if len(answer) == count:
+            elevs.extend(float(a['elevation']) for a in answer)
+        else:
+            # answers can't be matched to points when some are missing
+            error = ElevationNotFound('No elevations for: %s' % batch)
+            elevs.extend([error] * count)
+    return elevs
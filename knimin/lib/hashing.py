@@ -0,0 +1,61 @@
+"""Hashes passwords with bcrypt, in parallel for bulk kit creation"""
+from bcrypt import hashpw, gensalt
+
+from knimin.lib.background import imap_processes
+
+
+def hash_password(password, hashedpw=None):
+    """Hashes password
+
+    Parameters
+    ----------
+    password: str
+        Plaintext password
+    hashedpw: str, optional
+        Previously hashed password for bcrypt to pull salt from. If not
+        given, salt generated before hash
+
+    Returns
+    -------
+    str
+        Hashed password
+
+    Notes
+    -----
+    Relies on bcrypt library to hash passwords, which stores the salt as
+    part of the hashed password. Don't need to actually store the salt
+    because of this.
+    """
+    # all the encode/decode as a python 3 workaround for bcrypt
+    if hashedpw is None:
+        hashedpw = gensalt()
+    else:
+        hashedpw = hashedpw.encode('utf-8')
+    password = password.encode('utf-8')
+    output = hashpw(password, hashedpw)
+    if isinstance(output, bytes):
+        output = output.decode("utf-8")
+    return output
+
+
+def hash_passwords(passwords, workers=None):
+    """Hashes passwords, each with a fresh salt, across worker processes
+
+    Parameters
+    ----------
+    passwords : list of str
+        Plaintext passwords
+    workers : int, optional
+        Number of worker processes. Default one per CPU
+
+    Returns
+    -------
+    iterator of str
+        The hashed passwords, in the order of passwords, yielded as soon as
+        they are ready
+
+    Notes
+    -----
+    bcrypt is deliberately slow and holds the GIL, so threads do not help.
+    """
+    return imap_processes(hash_password, passwords, workers)
@@ -0,0 +1,132 @@
+from __future__ import unicode_literals
+from decimal import Decimal
+import re
+
+# Everything written to a sample template has tabs, newlines and runs of
+# whitespace collapsed to a single space so the TSV stays well formed
+_WHITESPACE = re.compile(r"\t|\r|\n|\s+")
+
+# The string forms of these types never hold whitespace, so the scrub can be
+# skipped for them entirely
+_NO_SCRUB_TYPES = frozenset([bool, int, long, float, Decimal])
+
+
+def encode_value(value):
+    """Converts a value to a whitespace scrubbed unicode string
+
+    Parameters
+    ----------
+    value : object
+        Value to convert. Byte strings are assumed to be utf-8 encoded
+
+    Returns
+    -------
+    unicode
+        The value as unicode, with tabs, carriage returns, newlines and runs
+        of whitespace replaced by a single space
+    """
+    if isinstance(value, unicode):
+        converted = value
+    elif isinstance(value, str):
+        converted = unicode(value, 'utf-8')
+    else:
+        converted = unicode(str(value), 'utf-8')
+    return _WHITESPACE.sub(' ', converted)
+
+
+def _encode_free_text(value):
+    """Encoder for free text columns, where values rarely repeat"""
+    if type(value) in _NO_SCRUB_TYPES:
+        return unicode(str(value))
+    return encode_value(value)
+
+
+class _MemoizedEncoder(object):
+    """Encoder for columns drawn from a small set of values
+
+    Numbers and booleans are converted without the whitespace scrub, and
+    every other value is scrubbed only the first time the column sees it.
+    """
+    def __init__(self):
+        self._memo = {}
+
+    def __call__(self, value):
+        if type(value) in _NO_SCRUB_TYPES:
+            return unicode(str(value))
+        # Only strings are cached: 1, 1.0 and True hash the same but do not
+        # encode the same, while equal str and unicode values always do
+        if not isinstance(value, basestring):
+            return encode_value(value)
+        try:
+            return self._memo[value]
+        except KeyError:
+            encoded = self._memo[value] = encode_value(value)
+            return encoded
+
+
+class MetadataWriter(object):
+    """Writes tab delimited qiita sample templates
+
+    Parameters
+    ----------
+    headers : list of str
+        Column headers, in the order they are written
+    free_text : iterable of str, optional
+        Headers of the columns holding free text answers. All other columns
+        are assumed to repeat a small set of values. Default no columns
+
+    Notes
+    -----
+    The encoder for each column is picked once when the writer is built, and
+    the output is identical to passing every cell through `encode_value`.
+    """
+    def __init__(self, headers, free_text=()):
+        free_text = set(free_text)
+        self.headers = list(headers)
+        self._columns = [
+            (h, _encode_free_text if h in free_text else _MemoizedEncoder())
+            for h in self.headers]
+
+    def header(self):
+        """Returns the header line of the sample template"""
+        return ''.join(['sample_name\t', '\t'.join(self.headers)])
+
+    def row(self, sample_name, values, missing='Unspecified'):
+        """Returns the line for a single sample
+
+        Parameters
+        ----------
+        sample_name : str
+            Name of the sample, written unchanged as the first column
+        values : dict
+            Values for the sample, keyed by header
+        missing : str, optional
+            Value used for headers not in `values`, e.g. retired questions.
+            Default 'Unspecified'
+
+        Returns
+        -------
+        unicode
+            The tab delimited line, without a trailing newline
+        """
+        get = values.get
+        return '\t'.join([sample_name] +
+                         [encode(get(h, missing))
+                          for h, encode in self._columns])
+
+    def raw_row(self, sample_name, values):
+        """Returns a line for values that are already clean, e.g. blanks
+
+        Parameters
+        ----------
+        sample_name : str
+            Name of the sample, written as the first column
+        values : dict of str
+            Values for the sample, keyed by header, written unchanged
+
+        Returns
+        -------
+        unicode
+            The tab delimited line, without a trailing newline
+        """
+        return '\t'.join([sample_name] + [values[h] for h in self.headers])
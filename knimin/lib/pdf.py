@@ -0,0 +1,230 @@
+"""Writes PDF files one page at a time, without external tools
+
+Only what the printouts need is supported: pages drawn by content streams,
+with images and the standard fonts as resources.
+"""
+from zlib import compress
+
+# Points in an inch, the unit of PDF page sizes
+POINTS_PER_INCH = 72
+LETTER = (8.5 * POINTS_PER_INCH, 11 * POINTS_PER_INCH)
+
+# Image modes written as they are, with their PDF colour space and bits
+_IMAGE_MODES = {'1': ('/DeviceGray', 1), 'L': ('/DeviceGray', 8),
+                'RGB': ('/DeviceRGB', 8)}
+
+
+class PDFWriter(object):
+    """Streams a PDF to a file object, writing each page as it is added
+
+    Parameters
+    ----------
+    fp : file-like
+        Where the PDF is written. Only write is used, so it does not need
+        to be seekable
+
+    Notes
+    -----
+    Only the object offsets and page references are kept in memory, so
+    documents of any number of pages can be written. The catalog and page
+    tree are written by close, which must be called to finish the PDF; it
+    is called when used as a context manager that exits without error.
+    """
+    # the catalog and page tree objects, written last
+    _CATALOG = 1
+    _PAGES = 2
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._pos = 0
+        self._offsets = {}
+        self._next_id = 3
+        self._pages = []
+        # the binary comment line marks the file as binary to transfers
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    @property
+    def page_count(self):
+        """Number of pages added so far"""
+        return len(self._pages)
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._pos += len(data)
+
+    def _write_object(self, obj_id, body, stream=None):
+        self._offsets[obj_id] = self._pos
+        if stream is None:
+            self._write(b'%d 0 obj\n%s\nendobj\n' % (obj_id, body))
+        else:
+            self._write(b'%d 0 obj\n%s\nstream\n' % (obj_id, body))
+            self._write(stream)
+            self._write(b'\nendstream\nendobj\n')
+
+    def add_object(self, body, stream=None):
+        """Writes an object to the PDF
+
+        Parameters
+        ----------
+        body : str
+            The object, a dictionary if there is a stream
+        stream : str, optional
+            Data of a stream object. Its /Length is added to body, which
+            must then be a dictionary without one
+
+        Returns
+        -------
+        int
+            The object number, to reference it as '%d 0 R'
+        """
+        obj_id = self._next_id
+        self._next_id += 1
+        if stream is not None:
+            body = b'%s /Length %d >>' % (body.rstrip()[:-2].rstrip(),
+                                          len(stream))
+        self._write_object(obj_id, body, stream)
+        return obj_id
+
+    def add_image(self, image):
+        """Writes an image XObject to the PDF
+
+        Parameters
+        ----------
+        image : PIL.Image.Image or tuple
+            The image, or the image already encoded by encode_image
+
+        Returns
+        -------
+        int
+            The object number of the image
+        """
+        if not isinstance(image, tuple):
+            image = encode_image(image)
+        return self.add_object(*image)
+
+    def add_font(self, name):
+        """Writes a reference to one of the standard 14 fonts to the PDF
+
+        Parameters
+        ----------
+        name : str
+            The font, e.g. Helvetica. Viewers and printers have these, so
+            nothing is embedded
+
+        Returns
+        -------
+        int
+            The object number of the font
+        """
+        return self.add_object(b'<< /Type /Font /Subtype /Type1 /BaseFont '
+                               b'/%s /Encoding /WinAnsiEncoding >>' % name)
+
+    def add_page(self, content, size=LETTER, images=None, fonts=None):
+        """Writes a page to the PDF
+
+        Parameters
+        ----------
+        content : str
+            The content stream drawing the page
+        size : tuple of (float, float), optional
+            Width and height of the page in points. Default US letter
+        images : dict, optional
+            Image object numbers by the names content uses for them
+        fonts : dict, optional
+            Font object numbers by the names content uses for them
+        """
+        resources = []
+        for kind, objects in ((b'/XObject', images), (b'/Font', fonts)):
+            if objects:
+                resources.append(b'%s << %s >>' % (kind, b' '.join(
+                    b'/%s %d 0 R' % (name, obj_id)
+                    for name, obj_id in sorted(objects.items()))))
+        content_id = self.add_object(b'<< /Filter /FlateDecode >>',
+                                     compress(content))
+        self._pages.append(self.add_object(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] '
+            b'/Resources << %s >> /Contents %d 0 R >>'
+            % (self._PAGES, _number(size[0]), _number(size[1]),
+               b' '.join(resources), content_id)))
+
+    def add_image_page(self, image, size=LETTER):
+        """Writes a page showing an image stretched over all of it
+
+        Parameters
+        ----------
+        image : PIL.Image.Image or tuple
+            The page image, or the image already encoded by encode_image
+        size : tuple of (float, float), optional
+            Width and height of the page in points. Default US letter
+        """
+        image_id = self.add_image(image)
+        content = b'q %s 0 0 %s 0 0 cm /Im0 Do Q' % (_number(size[0]),
+                                                     _number(size[1]))
+        self.add_page(content, size, images={b'Im0': image_id})
+
+    def close(self):
+        """Writes the page tree, cross reference table and trailer"""
+        kids = b' '.join(b'%d 0 R' % p for p in self._pages)
+        self._write_object(self._PAGES, b'<< /Type /Pages /Kids [%s] '
+                           b'/Count %d >>' % (kids, len(self._pages)))
+        self._write_object(self._CATALOG,
+                           b'<< /Type /Catalog /Pages %d 0 R >>' % self._PAGES)
+        xref = self._pos
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % self._next_id)
+        for obj_id in range(1, self._next_id):
+            self._write(b'%010d 00000 n \n' % self._offsets[obj_id])
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n'
+                    b'%%%%EOF\n' % (self._next_id, self._CATALOG, xref))
+
+
+def encode_image(image):
+    """Compresses an image for a PDF
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        The image. Modes other than 1, L and RGB are converted to RGB
+
+    Returns
+    -------
+    tuple of (str, str)
+        The image XObject dictionary and stream, which PDFWriter.add_image
+        takes instead of the image so images can be encoded elsewhere, in
+        worker processes for example
+    """
+    if image.mode not in _IMAGE_MODES:
+        image = image.convert('RGB')
+    colour_space, bits = _IMAGE_MODES[image.mode]
+    width, height = image.size
+    return (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d '
+            b'/ColorSpace %s /BitsPerComponent %d /Filter /FlateDecode >>'
+            % (width, height, colour_space, bits), compress(image.tobytes()))
+
+
+def literal_string(text):
+    """Formats text as a PDF string, to show it in a content stream
+
+    Parameters
+    ----------
+    text : str
+        The text
+
+    Returns
+    -------
+    str
+        The text in parentheses, with the characters special to them escaped
+    """
+    return b'(%s)' % text.replace(b'\\', b'\\\\').replace(
+        b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _number(value):
+    """Formats a number as PDF does, without a trailing .0"""
+    return (b'%.2f' % value).rstrip(b'0').rstrip(b'.')
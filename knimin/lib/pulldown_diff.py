@@ -0,0 +1,140 @@
+from hashlib import md5
+
+DIFF_HEADER = 'change\tsample_name\tcolumn\tprevious\tcurrent'
+# Stands in for columns missing from the previous sample template, so a new
+# column is never mistaken for one holding empty values
+_MISSING = '\x00'
+
+
+def _split(line):
+    return line.rstrip('\r\n').split('\t')
+
+
+def _digest(values):
+    return md5('\t'.join(values)).digest()
+
+
+def index_rows(fh, headers):
+    """Indexes the rows of a sample template by sample name
+
+    Parameters
+    ----------
+    fh : file-like object
+        Seekable sample template, as written by the pulldown
+    headers : list of str
+        Column headers the row digests are computed over, in order. Columns
+        not in the file take part in the digest as missing values
+
+    Returns
+    -------
+    prev_headers : list of str
+        The column headers of the indexed file, without sample_name
+    index : dict
+        The rows in the form {sample_name: (digest, offset), ...}, where
+        offset is the position of the row in fh
+    """
+    fh.seek(0)
+    prev_headers = _split(fh.readline())[1:]
+    same_headers = prev_headers == headers
+    pos = {h: i for i, h in enumerate(prev_headers)}
+    cols = [pos.get(h) for h in headers]
+
+    index = {}
+    while True:
+        offset = fh.tell()
+        line = fh.readline()
+        if not line:
+            break
+        values = _split(line)
+        if same_headers:
+            index[values[0]] = (_digest(values[1:]), offset)
+        else:
+            row = values[1:]
+            index[values[0]] = (
+                _digest([_MISSING if c is None else row[c] for c in cols]),
+                offset)
+    return prev_headers, index
+
+
+def diff_sample_templates(previous, current):
+    """Compares two sample templates cell by cell
+
+    Parameters
+    ----------
+    previous : file-like object
+        Seekable sample template from the earlier pulldown
+    current : file-like object
+        Sample template from the new pulldown, read once from start to end
+
+    Yields
+    ------
+    tuple of str
+        (change, sample_name, column, previous, current), where change is
+        one of 'added', 'removed' or 'changed'. Added and removed samples
+        have an empty column, added and removed columns an empty
+        sample_name, and changed cells carry both values.
+
+    Notes
+    -----
+    Only a digest and file offset is held for each previous row, and a row
+    is only re-read from `previous` when its digest differs, so the
+    comparison is linear in the number of rows.
+    """
+    headers = _split(current.readline())[1:]
+    prev_headers, index = index_rows(previous, headers)
+    prev_pos = {h: i for i, h in enumerate(prev_headers)}
+
+    for h in headers:
+        if h not in prev_pos:
+            yield ('added', '', h, '', '')
+    for h in sorted(set(prev_headers) - set(headers)):
+        yield ('removed', '', h, '', '')
+
+    for line in current:
+        values = _split(line)
+        sample, row = values[0], values[1:]
+        found = index.pop(sample, None)
+        if found is None:
+            yield ('added', sample, '', '', '')
+            continue
+        digest, offset = found
+        if digest == _digest(row):
+            continue
+
+        previous.seek(offset)
+        prev_row = _split(previous.readline())[1:]
+        for h, value in zip(headers, row):
+            i = prev_pos.get(h)
+            prev_value = '' if i is None else prev_row[i]
+            if i is None or prev_value != value:
+                yield ('changed', sample, h, prev_value, value)
+
+    # whatever is left in the index was not in the current pulldown
+    for sample in sorted(index):
+        yield ('removed', sample, '', '', '')
+
+
+def write_diff(previous, current, out):
+    """Writes the differences between two sample templates as a TSV
+
+    Parameters
+    ----------
+    previous : file-like object
+        Seekable sample template from the earlier pulldown
+    current : file-like object
+        Sample template from the new pulldown
+    out : file-like object
+        Where the differences are written, one per line
+
+    Returns
+    -------
+    dict of int
+        Number of lines written for each kind of change
+    """
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    out.write(DIFF_HEADER)
+    for change in diff_sample_templates(previous, current):
+        counts[change[0]] += 1
+        out.write('\n')
+        out.write('\t'.join(change))
+    return counts
@@ -0,0 +1,66 @@
+from datetime import datetime
+from threading import Lock
+from time import time
+
+
+class Snapshot(object):
+    """Keeps the result of an expensive function until it goes stale
+
+    Parameters
+    ----------
+    func : function
+        Computes the value, called with no arguments
+    max_age : float
+        Seconds a value is served before it is computed again. 0 computes
+        it every time
+
+    Notes
+    -----
+    Only one thread computes the value at a time; threads asking for it
+    meanwhile wait for that result instead of computing it again.
+    """
+    def __init__(self, func, max_age):
+        self._func = func
+        self.max_age = max_age
+        self._lock = Lock()
+        self._value = None
+        self._taken = None
+
+    def refresh(self):
+        """Computes the value now
+
+        Returns
+        -------
+        tuple of (object, datetime)
+            The value and when it was computed
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self._value = self._func()
+        self._taken = time()
+        return self._value, datetime.fromtimestamp(self._taken)
+
+    def get(self, refresh=False):
+        """Gets the value, computing it if stale or missing
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            Whether to compute the value even if it is not stale. Default
+            False
+
+        Returns
+        -------
+        tuple of (object, datetime)
+            The value and when it was computed
+        """
+        requested = time()
+        with self._lock:
+            # someone may have refreshed it while we waited for the lock
+            if (self._taken is None or
+                    (refresh and self._taken < requested) or
+                    time() - self._taken >= self.max_age):
+                return self._refresh()
+            return self._value, datetime.fromtimestamp(self._taken)
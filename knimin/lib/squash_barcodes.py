@@ -1,70 +1,86 @@
 #!/usr/bin/env python
 
-"""take barcodes and dump to a single multipage pdf
-
-requires GPL Ghostscript 9.05
-"""
+"""take barcodes and dump to a single multipage pdf"""
 
 from PIL import Image
-from os import path, mkdir
+from io import BytesIO
 from os.path import join, dirname, realpath
-from math import ceil
-from random import choice
-from shutil import rmtree
-from subprocess import Popen, PIPE
-from shlex import split as cmd_split
 
-from knimin.lib.code128 import code128_image
+from knimin.lib.background import imap_processes
+from knimin.lib.code128 import code128_image, code128_bars, get_font
+from knimin.lib.pdf import (PDFWriter, LETTER, POINTS_PER_INCH, encode_image,
+                            literal_string)
+
+# pages are drawn at 150dpi, assuming N * 8.5in x 11in
+PAGE_DPI = 150
+PAGE_WIDTH = 1275
+PAGE_HEIGHT = 1650
+BARCODES_PER_PAGE = 36
+
+# padding set empirically for
+# Electronic Imaging Materials
+# Part #80402
+START_LEFT = 18
+START_UPPER = 59
+HORIZ_GAP = 23
+VERT_GAP = 17
+BOX_WIDTH = 300
+BOX_HEIGHT = 150
+
+# each label is a 202x100px barcode with its text underneath, centered in
+# its box
+LABEL_WIDTH = 202
+LABEL_HEIGHT = 100
+LABEL_THICKNESS = 2
+TEXT_HEIGHT = 25
+TEXT_SIZE = 20
+FONT = join(dirname(realpath(__file__)), 'FreeSans.ttf')
 
 
 def get_image(barcodes):
-    font = join(dirname(realpath(__file__)), 'FreeSans.ttf')
     for b in barcodes:
-        yield code128_image(b, height=100, width=202, font=font, thickness=2,
+        yield code128_image(b, height=LABEL_HEIGHT, width=LABEL_WIDTH,
+                            font=FONT, thickness=LABEL_THICKNESS,
                             show_text=True, quiet_zone=False)
 
 
-def build_barcodes_pdf(barcodes):
-    # 36 barcodes per page
-    pages = int(ceil(len(barcodes) / 36.0))
+def _label_origins(count, width):
+    """Top left corners of the boxes of the labels on a page, in pixels"""
+    cur_left = START_LEFT
+    cur_upper = START_UPPER
+    for _ in range(count):
+        # shift to new row
+        if cur_left + width > PAGE_WIDTH:
+            cur_left = START_LEFT
+            cur_upper = cur_upper + HORIZ_GAP + BOX_HEIGHT
+        yield cur_left, cur_upper
+
+        # shift right
+        cur_left += BOX_WIDTH + VERT_GAP
 
-    # assuming N * 8.5in x 11in
-    PAGE_WIDTH = 1275
-    PAGE_HEIGHT = 1650
 
-    # create blank pdfs
-    blanks = [Image.new('RGB', (PAGE_WIDTH, PAGE_HEIGHT), (255, 255, 255))
-              for i in range(pages)]
+def render_page(barcodes):
+    """Lays barcodes out on a page of a label sheet
 
-    # padding set empirically for
-    # Electronic Imaging Materials
-    # Part #80402
-    START_LEFT = 18
-    START_UPPER = 59
-    HORIZ_GAP = 23
-    VERT_GAP = 17
-    BOX_WIDTH = 300
-    BOX_HEIGHT = 150
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes on the page, at most BARCODES_PER_PAGE
 
+    Returns
+    -------
+    PIL.Image.Image
+        Monochrome image of the page
+    """
     # center barcode, assuming barcode images are 300x150px
     # will adjust per image if 202x100px
     SHIFT_RIGHT = 0
     SHIFT_DOWN = 0
 
-    # set starting points
-    cur_left = START_LEFT
-    cur_upper = START_UPPER
-    page = -1
-    idx = 0
-    for i in get_image(barcodes):
-        # if we have 36 barcodes we have filled a page
-        if idx % 36 == 0:
-            page += 1
-            cur_upper = START_UPPER
-            cur_left = START_LEFT
-
+    page = Image.new('1', (PAGE_WIDTH, PAGE_HEIGHT), 1)
+    for i, (cur_left, cur_upper) in zip(
+            get_image(barcodes), _label_origins(len(barcodes), LABEL_WIDTH)):
         # verify the barcode is the expected size, shift accordingly
-        width, height = i.size
         if i.size == (202, 100):
             SHIFT_RIGHT = 49
             SHIFT_DOWN = 25
@@ -73,41 +89,157 @@ def build_barcodes_pdf(barcodes):
             SHIFT_DOWN = 0
         else:
             tmp = "image %s is an unsupported size"
-            raise AttributeError(tmp % i.shape)
-
-        # shift to new row
-        if cur_left + width > PAGE_WIDTH:
-            cur_left = START_LEFT
-            cur_upper = cur_upper + HORIZ_GAP + BOX_HEIGHT
+            raise AttributeError(tmp % (i.size, ))
 
         # paste into the image
-        blanks[page].paste(i, (cur_left + SHIFT_RIGHT, cur_upper + SHIFT_DOWN))
-
-        # shift right
-        cur_left += BOX_WIDTH + VERT_GAP
-
-        idx += 1
-
-    # write out each page
-    tmpdir = "tmp_%s" % ''.join([choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
-                                 for i in range(5)])
-    while path.exists(tmpdir):
-        tmpdir = "tmp_%s" % ''.join([choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
-                                     for i in range(5)])
-    mkdir(tmpdir)
-
-    temp_pages = "squash_barcode_page_%d.pdf"
-    for page, blank in enumerate(blanks):
-        blank.save(path.join(tmpdir, temp_pages % page), quality=100)
-
-    match_pages = ' '.join([path.join(tmpdir, "squash_barcode_page_%d.pdf" % i)
-                            for i in range(len(blanks))])
-
-    # magically squash all the pages
-    cmd = cmd_split('gs -r150 -q -sPAPERSIZE=a4 -dNOPAUSE -dBATCH' +
-                    ' -sDEVICE=pdfwrite -sOutputFile=- %s' % match_pages)
-    p = Popen(cmd, stdout=PIPE)
-    output, _ = p.communicate()
-    rmtree(tmpdir)
-    # return PDF text
-    return output
+        page.paste(i, (cur_left + SHIFT_RIGHT, cur_upper + SHIFT_DOWN))
+
+    return page
+
+
+def draw_page(barcodes):
+    """Draws barcodes on a page of a label sheet as PDF vector graphics
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes on the page, at most BARCODES_PER_PAGE
+
+    Returns
+    -------
+    str
+        The content stream of the page. The text is shown in the font
+        named /F0, which should be Helvetica
+
+    Raises
+    ------
+    ValueError
+        A barcode is wider than a label
+
+    Notes
+    -----
+    The page is drawn in the pixels of render_page, so the bars land where
+    render_page puts them. The text is measured with FreeSans, which has
+    the same metrics as Helvetica.
+    """
+    scale = POINTS_PER_INCH / float(PAGE_DPI)
+    font = get_font(FONT, TEXT_SIZE)
+    ascent = font.getmetrics()[0]
+    bar_height = LABEL_HEIGHT - TEXT_HEIGHT + 1
+    shift_right = (BOX_WIDTH - LABEL_WIDTH) // 2
+    shift_down = (BOX_HEIGHT - LABEL_HEIGHT) // 2
+
+    # flip the page so y runs down in pixels, as in render_page
+    content = [b'q %g 0 0 %g 0 %g cm' % (scale, -scale, PAGE_HEIGHT * scale)]
+    for b, (cur_left, cur_upper) in zip(
+            barcodes, _label_origins(len(barcodes), LABEL_WIDTH)):
+        offsets, width = code128_bars(b, LABEL_THICKNESS)
+        if width > LABEL_WIDTH:
+            tmp = "Calculated width %d smaller than provided width %d"
+            raise ValueError(tmp % (width, LABEL_WIDTH))
+        x = (LABEL_WIDTH - width) // 2
+        # each label is drawn from its own corner, so labels share most of
+        # their drawing operations and compress well
+        content.append(b'q 1 0 0 1 %d %d cm' % (cur_left + shift_right,
+                                                cur_upper + shift_down))
+        content.extend(b'%d 0 %d %d re' % (x + start, w, bar_height)
+                       for start, w in offsets)
+        # centered as code128_image does, flipped back to read upright
+        text_left = (2 * x + width) // 2 - font.getsize(b)[0] // 2
+        content.append(b'f BT /F0 %d Tf 1 0 0 -1 %d %d Tm %s Tj ET Q' % (
+            TEXT_SIZE, text_left, LABEL_HEIGHT - TEXT_HEIGHT + ascent,
+            literal_string(b)))
+    content.append(b'Q')
+    return b'\n'.join(content)
+
+
+def _split_pages(barcodes):
+    """Splits the barcodes into the barcodes of each page"""
+    return [barcodes[i:i + BARCODES_PER_PAGE]
+            for i in range(0, len(barcodes), BARCODES_PER_PAGE)]
+
+
+def get_pages(barcodes):
+    """Lays the barcodes out on pages of label sheets
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes to print
+
+    Returns
+    -------
+    iterator of PIL.Image.Image
+        Monochrome page images, made as they are asked for so only one is
+        held in memory at a time
+    """
+    for page_barcodes in _split_pages(barcodes):
+        yield render_page(page_barcodes)
+
+
+def _encoded_page(barcodes):
+    """Renders a page and encodes it for the PDF, in a worker process"""
+    return encode_image(render_page(barcodes))
+
+
+def write_barcodes_pdf(barcodes, fp, workers=None, vector=False):
+    """Writes the barcode label sheets as a PDF
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes to print
+    fp : file-like
+        Where the PDF is written, a page at a time
+    workers : int, optional
+        Number of processes rendering pages. Default one per CPU
+    vector : bool, optional
+        Whether to draw the labels as vector graphics instead of images.
+        Default False
+
+    Returns
+    -------
+    int
+        Number of pages written
+
+    Notes
+    -----
+    Image pages are rendered and compressed in worker processes and written
+    in order as they come back, so only the compressed pages are sent
+    between processes. Vector pages are a fraction of the size and quick
+    enough to draw here, so workers is ignored for them.
+    """
+    with PDFWriter(fp) as pdf:
+        if vector:
+            font = pdf.add_font(b'Helvetica')
+            for page_barcodes in _split_pages(barcodes):
+                pdf.add_page(draw_page(page_barcodes), LETTER,
+                             fonts={b'F0': font})
+        else:
+            for page in imap_processes(_encoded_page,
+                                       _split_pages(barcodes), workers):
+                pdf.add_image_page(page, LETTER)
+    return pdf.page_count
+
+
+def build_barcodes_pdf(barcodes, workers=None, vector=False):
+    """Makes the barcode label sheets as a PDF
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes to print
+    workers : int, optional
+        Number of processes rendering pages. Default one per CPU
+    vector : bool, optional
+        Whether to draw the labels as vector graphics instead of images.
+        Default False
+
+    Returns
+    -------
+    str
+        The PDF, with one US letter page per 36 barcodes
+    """
+    pdf = BytesIO()
+    write_barcodes_pdf(barcodes, pdf, workers, vector)
+    return pdf.getvalue()
@@ -0,0 +1,62 @@
+from unittest import TestCase, main
+from os import getpid
+from threading import current_thread
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from knimin.lib.background import (run_in_thread, imap_processes,
+                                   start_process_pool, stop_process_pool)
+
+
+def _square_pid(x):
+    return x * x, getpid()
+
+
+class TestRunInThread(AsyncTestCase):
+    @gen_test
+    def test_run_in_thread(self):
+        obs = yield run_in_thread(lambda x, y=0: (x + y, current_thread()),
+                                  1, y=2)
+        self.assertEqual(obs[0], 3)
+        self.assertNotEqual(obs[1], current_thread())
+
+    @gen_test
+    def test_run_in_thread_error(self):
+        def _fail():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            yield run_in_thread(_fail)
+
+
+class TestImapProcesses(TestCase):
+    def test_imap_processes_serial(self):
+        obs = list(imap_processes(_square_pid, range(5), workers=1))
+        self.assertEqual([x for x, _ in obs], [0, 1, 4, 9, 16])
+        self.assertEqual(set(pid for _, pid in obs), {getpid()})
+
+    def test_imap_processes(self):
+        obs = list(imap_processes(_square_pid, range(20), workers=2))
+        self.assertEqual([x for x, _ in obs], [x * x for x in range(20)])
+        self.assertNotIn(getpid(), set(pid for _, pid in obs))
+
+    def test_imap_processes_shared_pool(self):
+        pool = start_process_pool(2)
+        try:
+            self.assertIs(start_process_pool(), pool)
+            pids = set(p.pid for p in pool._pool)
+            for _ in range(2):
+                obs = list(imap_processes(_square_pid, range(20), workers=4))
+                self.assertEqual([x for x, _ in obs],
+                                 [x * x for x in range(20)])
+                # the same workers do the work each time
+                self.assertLessEqual(set(pid for _, pid in obs), pids)
+        finally:
+            stop_process_pool()
+
+    def test_imap_processes_empty(self):
+        self.assertEqual(list(imap_processes(_square_pid, [], workers=2)), [])
+
+
+if __name__ == '__main__':
+    main()
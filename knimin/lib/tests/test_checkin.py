@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase, main
+from datetime import date
+
+from knimin.lib.checkin import Checkin, parse_checkins, build_checkin_email
+
+
+class TestParseCheckins(TestCase):
+    def test_parse_checkins(self):
+        lines = ['# barcode\tscan date\tpostmark date\tissues\tnote',
+                 '000000001', '',
+                 '000000002\t2016-01-31\n',
+                 '000000003\t01/30/2016\t2016-01-20\tMoldy, other\tleaked',
+                 '000000004\t\t\toverloaded\r\n']
+        obs = parse_checkins(lines, scan_date=date(2016, 2, 1))
+        self.assertEqual(obs, [
+            Checkin('000000001', date(2016, 2, 1), None, 'N', 'N', 'N',
+                    None),
+            Checkin('000000002', date(2016, 1, 31), None, 'N', 'N', 'N',
+                    None),
+            Checkin('000000003', date(2016, 1, 30), date(2016, 1, 20), 'Y',
+                    'N', 'Y', 'leaked'),
+            Checkin('000000004', date(2016, 2, 1), None, 'N', 'Y', 'N',
+                    None)])
+        self.assertEqual(parse_checkins([]), [])
+
+    def test_parse_checkins_default_scan_date(self):
+        self.assertEqual(parse_checkins(['000000001'])[0].scan_date,
+                         date.today())
+
+    def test_parse_checkins_bad(self):
+        for line in ('000000002\t2016-31-01', '000000002\tyesterday',
+                     '000000002\t\t\tsmelly',
+                     '000000002\t\t\tmoldy\tnote\textra'):
+            with self.assertRaises(ValueError):
+                parse_checkins(['000000001', line])
+
+
+class TestBuildCheckinEmail(TestCase):
+    def test_build_checkin_email(self):
+        subject, body = build_checkin_email(u'persøn', '000001018', '0')
+        self.assertEqual(
+            subject, 'ACTION REQUIRED - Assign your samples in American Gut')
+        self.assertIn(u'Dear persøn,', body)
+        self.assertIn('sample barcode: 000001018,', body)
+
+        subject, body = build_checkin_email(u'persøn', '000001018', '1',
+                                            '2016-12-14', '18:52')
+        self.assertEqual(
+            subject, 'American Gut Sample with Barcode 000001018 is Received.')
+        self.assertIn('barcode 000001018 dated\n2016-12-14 18:52 and', body)
+
+    def test_build_checkin_email_unknown_type(self):
+        with self.assertRaises(RuntimeError):
+            build_checkin_email(u'persøn', '000001018', '-1')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+from unittest import TestCase, main
+from os.path import join, dirname, realpath
+
+from PIL import Image, ImageDraw
+
+from knimin.lib.code128 import (code128_image, code128_format, code128_bars,
+                                get_font, WEIGHTS)
+
+FONT = join(dirname(realpath(__file__)), '..', 'FreeSans.ttf')
+
+
+def draw_bars(text, height, width, thickness, quiet_zone, show_text):
+    """Draws the bars a rectangle at a time, as code128_image used to"""
+    barcode_height = height - 25 if show_text else height
+    widths = [int(w) * thickness for code in code128_format(text)
+              for w in WEIGHTS[code]]
+    barcode_width = sum(widths) + (20 * thickness if quiet_zone else 0)
+    x = (width - barcode_width) / 2
+    img = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(img)
+    for i, w in enumerate(widths):
+        if i % 2 == 0:
+            draw.rectangle(((x, 0), (x + w - 1, barcode_height)), fill=0)
+        x += w
+    return img
+
+
+class TestCode128(TestCase):
+    def test_code128_image_bars(self):
+        for text in ('000012345', 'abc', 'X1234y', '7'):
+            for height, width, thickness, quiet_zone in (
+                    (100, 202, 2, False), (150, 300, 2, True),
+                    (50, 400, 3, True), (30, 200, 1, False)):
+                obs = code128_image(text, height, width, thickness,
+                                    quiet_zone)
+                exp = draw_bars(text, height, width, thickness, quiet_zone,
+                                False)
+                self.assertEqual(obs.mode, '1')
+                self.assertEqual(obs.size, (width, height))
+                self.assertEqual(obs.tobytes(), exp.tobytes())
+
+    def test_code128_image_text(self):
+        obs = code128_image('000012345', height=100, width=202, font=FONT,
+                            thickness=2, show_text=True, quiet_zone=False)
+        bars = draw_bars('000012345', 100, 202, 2, False, True)
+        # the bars are the same, with the text drawn underneath them
+        self.assertEqual(obs.crop((0, 0, 202, 76)).tobytes(),
+                         bars.crop((0, 0, 202, 76)).tobytes())
+        self.assertNotEqual(obs.tobytes(), bars.tobytes())
+
+    def test_code128_image_default_width(self):
+        obs = code128_image('000012345', thickness=1, quiet_zone=False)
+        self.assertEqual(obs.size[0], sum(int(w) for code in
+                                          code128_format('000012345')
+                                          for w in WEIGHTS[code]))
+
+    def test_code128_bars(self):
+        for text in ('000012345', 'abc', '7'):
+            bars, width = code128_bars(text, thickness=2)
+            img = code128_image(text, height=1, thickness=2, quiet_zone=False)
+            self.assertEqual(img.size[0], width)
+            exp = [x for x in range(width) if img.getpixel((x, 0)) == 0]
+            self.assertEqual([x for start, w in bars
+                              for x in range(start, start + w)], exp)
+            # bars start and end the barcode
+            self.assertEqual(bars[0][0], 0)
+            self.assertEqual(sum(bars[-1]), width)
+
+    def test_code128_image_too_wide(self):
+        with self.assertRaises(ValueError):
+            code128_image('000012345', width=50)
+
+    def test_get_font(self):
+        self.assertIs(get_font(FONT), get_font(FONT))
+        self.assertIsNot(get_font(FONT), get_font(FONT, 10))
+        self.assertIs(get_font(), get_font())
+
+
+if __name__ == '__main__':
+    main()
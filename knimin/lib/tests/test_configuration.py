@@ -2,6 +2,7 @@
 
 from unittest import TestCase, main
 import tempfile
+from os.path import expanduser
 
 from knimin.lib.configuration import KniminConfig
 
@@ -26,6 +27,17 @@ class ConfigurationTests(TestCase):
         config = KniminConfig(self.config_fp)
         self.assertTrue(config.debug)
         self.assertEqual(config.base_data_dir, '/some/dir/path')
+        self.assertEqual(config.state_dir, expanduser('~/.labadmin'))
+
+    def test_get_main_state_dir(self):
+        self.config.seek(0)
+        self.config.write(test_config.replace(
+            'BASE_LOG_DIR = /tmp', 'BASE_LOG_DIR = /tmp\nSTATE_DIR = /var/ag'))
+        self.config.seek(0)
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.state_dir, '/var/ag')
+        self.assertEqual(config.geocode_cache_fp, '/var/ag/geocode_cache.db')
+        self.assertEqual(config.gazetteer_fp, '/var/ag/gazetteer.db')
 
     def test_get_postgres(self):
         config = KniminConfig(self.config_fp)
@@ -38,6 +50,67 @@ class ConfigurationTests(TestCase):
     def test_get_tornado(self):
         config = KniminConfig(self.config_fp)
         self.assertEqual(config.http_port, 8888)
+        self.assertEqual(config.stats_max_age, 3600)
+
+    def test_get_tornado_stats_max_age(self):
+        self.config.seek(0)
+        self.config.write(test_config.replace(
+            'port = 8888', 'port = 8888\nSTATS_MAX_AGE_MINUTES = 0.5'))
+        self.config.seek(0)
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.stats_max_age, 30)
+
+    def test_get_email(self):
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.smtp_host, 'localhost')
+        self.assertEqual(config.smtp_port, 465)
+        self.assertEqual(config.email_queue_interval, 60)
+        self.assertEqual(config.email_queue_batch_size, 100)
+
+    def test_get_email_queue(self):
+        self.config.seek(0)
+        self.config.write(test_config.replace(
+            'PASSWORD =\n', 'PASSWORD =\nQUEUE_INTERVAL_MINUTES = 0\n'
+            'QUEUE_BATCH_SIZE = 10\n'))
+        self.config.seek(0)
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.email_queue_interval, 0)
+        self.assertEqual(config.email_queue_batch_size, 10)
+
+    def test_get_geocoder_defaults(self):
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.geocode_cache_fp,
+                         expanduser('~/.labadmin/geocode_cache.db'))
+        self.assertEqual(config.geocode_cache_ttl, 180 * 86400)
+        self.assertEqual(config.geocode_negative_ttl, 30 * 86400)
+        self.assertEqual(config.geocoder_backend, 'google')
+        self.assertEqual(config.gazetteer_fp,
+                         expanduser('~/.labadmin/gazetteer.db'))
+        self.assertEqual(config.geocode_daily_quota, 2500)
+        self.assertEqual(config.geocode_batch_size, 100)
+        self.assertEqual(config.geocode_worker_interval, 600)
+        self.assertEqual(config.geocode_checkpoint_fp,
+                         expanduser('~/.labadmin/geocode_worker.json'))
+
+    def test_get_geocoder(self):
+        self.config.seek(0, 2)
+        self.config.write(test_geocoder_config)
+        self.config.seek(0)
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.geocode_cache_fp, '/tmp/geocode_cache.db')
+        self.assertEqual(config.geocode_cache_ttl, 86400)
+        self.assertEqual(config.geocode_negative_ttl, 43200)
+        self.assertEqual(config.geocoder_backend, 'gazetteer')
+        self.assertEqual(config.gazetteer_fp, '/tmp/gazetteer.db')
+        self.assertEqual(config.geocode_daily_quota, 100)
+        self.assertEqual(config.geocode_worker_interval, 0)
+
+    def test_get_geocoder_bad_backend(self):
+        self.config.seek(0, 2)
+        self.config.write("\n[geocoder]\nBACKEND = somewhere\n")
+        self.config.seek(0)
+        with self.assertRaises(ValueError):
+            KniminConfig(self.config_fp)
 
 test_config = """[main]
 debug = True
@@ -63,6 +136,17 @@ USERNAME =
 PASSWORD =
 """
 
+test_geocoder_config = """
+[geocoder]
+CACHE_FP = /tmp/geocode_cache.db
+CACHE_TTL_DAYS = 1
+NEGATIVE_TTL_DAYS = 0.5
+BACKEND = Gazetteer
+GAZETTEER_FP = /tmp/gazetteer.db
+DAILY_QUOTA = 100
+WORKER_INTERVAL_MINUTES = 0
+"""
+
 
 if __name__ == '__main__':
     main()
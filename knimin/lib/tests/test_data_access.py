@@ -1,8 +1,18 @@
 from unittest import TestCase, main
+from collections import defaultdict
+from threading import Thread
 from os.path import join, dirname, realpath
+from io import BytesIO
 import datetime
 
+import psycopg2
+from mock import patch
+
 from knimin import db
+from knimin.lib.data_access import KniminAccess, SQLConnectionPool
+from knimin.lib.checkin import Checkin
+from knimin.lib.timing import StageTimer
+from knimin.lib.geocoder import Location, ElevationNotFound
 
 
 class TestDataAccess(TestCase):
@@ -50,6 +60,459 @@ class TestDataAccess(TestCase):
         self.assertTrue('VIOSCREEN' in survey)
         self.assertTrue('BLANK.01' in survey)
 
+    def test_pulldown_timing(self):
+        timer = StageTimer()
+        barcodes = ['000029429', '000018046', '000023299', '000023300']
+        obs, _ = db.pulldown(barcodes, timer=timer)
+        report = timer.report()
+        for stage in ('get_surveys', 'lookup_tables', 'format',
+                      'format_environmental', 'serialize',
+                      'explain_failures'):
+            self.assertIn(stage, report['stages'])
+        self.assertGreater(report['counts']['rows_fetched'], 0)
+        self.assertEqual(report['counts']['barcodes_formatted'], 4)
+        self.assertEqual(report['counts']['bytes_written'],
+                         sum(len(m) for m in obs.values()))
+
+    def test_fetch_concurrently(self):
+        obs = db.pool.fetch_concurrently({
+            'countries': ("SELECT country FROM iso_country_lookup "
+                          "WHERE country = %s", ['United States']),
+            'barcodes': ("SELECT barcode FROM ag_kit_barcodes "
+                         "WHERE barcode IN %s ORDER BY barcode",
+                         [('000029429', '000018046')])})
+        self.assertEqual(obs, {'countries': [['United States']],
+                               'barcodes': [['000018046'], ['000029429']]})
+
+    def test_pool_reuses_connections(self):
+        with patch('psycopg2.connect', wraps=psycopg2.connect) as connect:
+            pool = SQLConnectionPool(db.config, size=2)
+            for _ in range(3):
+                obs = pool.fetch_concurrently({
+                    'a': ("SELECT 1", None), 'b': ("SELECT 2", None)})
+                self.assertEqual(obs, {'a': [[1]], 'b': [[2]]})
+        self.assertEqual(connect.call_count, 2)
+
+    def test_fetch_concurrently_error(self):
+        with self.assertRaises(ValueError):
+            db.pool.fetch_concurrently({'bad': ("SELECT nope FROM nowhere",
+                                                None)})
+
+    def test_get_geocode_zipcodes_blank(self):
+        obs = db.get_geocode_zipcodes([('', 'United States'),
+                                       ('92037', None)])
+        self.assertEqual(obs, {})
+
+    def test_get_geocode_zipcode_no_elevation(self):
+        with patch('knimin.lib.data_access.geocode_postcode',
+                   side_effect=ElevationNotFound()):
+            obs = db.get_geocode_zipcode('BN99999', 'United States')
+        self.assertEqual(obs, Location('BN99999', None, None, None, None,
+                                       None, None, 'United States'))
+        # not stored, so it is geocoded again next time
+        self.assertEqual(db._con.execute_fetchone(
+            "SELECT count(*) FROM ag.zipcodes WHERE zipcode = 'BN99999'")[0],
+            0)
+
+    def test_geocode_missing_known(self):
+        timer = StageTimer()
+        zip_lookup = defaultdict(dict)
+        zip_lookup['92037']['United States'] = (32.8, -117.2, 100.1, 'CA')
+        db._geocode_missing([('92037', 'United States'),
+                             ('', 'United States')], zip_lookup, timer)
+        self.assertEqual(timer.counts['geocoder_calls'], 0)
+        self.assertEqual(dict(zip_lookup), {
+            '92037': {'United States': (32.8, -117.2, 100.1, 'CA')}})
+
+    def test_addGeocodingInfo_zero_limit(self):
+        obs = db.addGeocodingInfo(limit=0)
+        self.assertEqual(obs, {'logins': 0, 'addresses': 0, 'failed': 0,
+                               'calls_saved': 0, 'limit_exceeded': False})
+
+    def test_get_project_summary(self):
+        obs = db.get_project_summary()
+        self.assertEqual([p['project'] for p in obs],
+                         sorted(db.getProjectNames()))
+        for proj in obs:
+            self.assertEqual(
+                proj['barcodes'],
+                len(db.get_barcodes_for_projects([proj['project']])))
+            for key in ('received', 'sequenced', 'obsolete'):
+                self.assertLessEqual(proj[key], proj['barcodes'])
+
+    def test_create_barcodes(self):
+        obs = db.create_barcodes(5)
+        try:
+            self.assertEqual(len(obs), 5)
+            self.assertTrue(all(len(b) == 9 for b in obs))
+            self.assertEqual([int(b) for b in obs],
+                             range(int(obs[0]), int(obs[0]) + 5))
+        finally:
+            db._delete_barcodes(obs)
+
+    def test_create_barcodes_concurrent(self):
+        created = []
+
+        def _create():
+            created.append(db.create_barcodes(20))
+
+        threads = [Thread(target=_create) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        barcodes = [b for bcs in created for b in bcs]
+        try:
+            self.assertEqual(len(created), 4)
+            self.assertEqual(len(set(barcodes)), 80)
+        finally:
+            db._delete_barcodes(barcodes)
+
+    def test_create_barcodes_after_manual_insert(self):
+        newest = db.create_barcodes(1)
+        # a barcode added without the sequence takes the next number
+        manual = '%09d' % (int(newest[0]) + 1)
+        db._con.execute("INSERT INTO barcodes.barcode (barcode, obsolete) "
+                        "VALUES (%s, 'N')", [manual])
+        obs = db.create_barcodes(2)
+        try:
+            self.assertTrue(all(b > manual for b in obs))
+        finally:
+            db._delete_barcodes(newest + [manual] + obs)
+
+    def test_count_unassigned_barcodes(self):
+        before = db.count_unassigned_barcodes()
+        self.assertEqual(before, len(db.get_unassigned_barcodes()))
+        new = db.create_barcodes(3)
+        try:
+            self.assertEqual(db.count_unassigned_barcodes(), before + 3)
+            self.assertEqual(db.get_unassigned_barcodes()[-3:], new)
+
+            db.setBarcodeProjects(new[0], add_projects=['UNKNOWN'])
+            self.assertEqual(db.count_unassigned_barcodes(), before + 2)
+            self.assertNotIn(new[0], db.get_unassigned_barcodes())
+
+            db.setBarcodeProjects(new[0], rem_projects=['UNKNOWN'])
+            self.assertEqual(db.count_unassigned_barcodes(), before + 3)
+        finally:
+            db._delete_barcodes(new)
+
+    def test_migrate(self):
+        db.migrate()
+        self.assertEqual(db.migrate(), [])
+        access = KniminAccess(db.config)
+        access._migrations = db._migrations + [
+            ('test_migration', "SELECT 1")]
+        try:
+            self.assertEqual(access.migrate(), ['test_migration'])
+            self.assertEqual(access.migrate(), [])
+        finally:
+            db._con.execute("""DELETE FROM ag.labadmin_migration
+                               WHERE name = 'test_migration'""")
+
+    def test_migrate_unassign_stale(self):
+        db.migrate()
+        new = db.create_barcodes(2)
+        try:
+            # as left by removing all of a barcode's projects before the
+            # assign date was cleared
+            db.setBarcodeProjects(new[1], add_projects=['UNKNOWN'])
+            db._con.execute("""UPDATE barcodes.barcode
+                               SET assigned_on = NOW()
+                               WHERE barcode IN %s""", [tuple(new)])
+            self.assertNotIn(new[0], db.get_unassigned_barcodes())
+            db._con.execute("""DELETE FROM ag.labadmin_migration
+                               WHERE name = 'unassign_stale_barcodes'""")
+            self.assertEqual(db.migrate(), ['unassign_stale_barcodes'])
+            unassigned = db.get_unassigned_barcodes()
+            self.assertIn(new[0], unassigned)
+            self.assertNotIn(new[1], unassigned)
+        finally:
+            db._unassign_barcodes(new)
+            db._delete_barcodes(new)
+
+    def test_get_unassigned_barcodes_too_many(self):
+        n = db.count_unassigned_barcodes()
+        self.assertEqual(len(db.get_unassigned_barcodes(n)), n)
+        with self.assertRaises(ValueError):
+            db.get_unassigned_barcodes(n + 1)
+
+    def test_transaction(self):
+        new = db.create_barcodes(1)
+        try:
+            with self.assertRaises(ValueError):
+                with db._con.transaction():
+                    db.setBarcodeProjects(new[0], add_projects=['UNKNOWN'])
+                    raise ValueError('rolled back')
+            self.assertIn(new[0], db.get_unassigned_barcodes())
+
+            with db._con.transaction():
+                db.setBarcodeProjects(new[0], add_projects=['UNKNOWN'])
+            self.assertNotIn(new[0], db.get_unassigned_barcodes())
+        finally:
+            db._unassign_barcodes(new)
+            db._delete_barcodes(new)
+
+    def test_copy_expert(self):
+        out = BytesIO()
+        db._con.copy_expert(
+            "COPY (SELECT country FROM ag.iso_country_lookup "
+            "WHERE country = 'United States') TO STDOUT", out)
+        self.assertEqual(out.getvalue(), 'United States\n')
+        with self.assertRaises(ValueError):
+            db._con.copy_expert("COPY nowhere FROM STDIN", BytesIO(''))
+
+    def test_assign_barcodes_not_enough(self):
+        remaining = db.count_unassigned_barcodes()
+        with self.assertRaises(ValueError):
+            db.assign_barcodes(remaining + 1, ['UNKNOWN'])
+        self.assertEqual(db.count_unassigned_barcodes(), remaining)
+
+    def test_assign_barcodes_concurrent(self):
+        new = db.create_barcodes(40)
+        assigned = []
+
+        def _assign():
+            # each creator gets its own connection, as separate server
+            # processes would
+            assigned.append(
+                KniminAccess(db.config).assign_barcodes(10, ['UNKNOWN']))
+
+        threads = [Thread(target=_assign) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        barcodes = [b for bcs in assigned for b in bcs]
+        try:
+            self.assertEqual(len(assigned), 4)
+            self.assertEqual(len(set(barcodes)), 40)
+            for b in barcodes:
+                self.assertEqual(db.getBarcodeProjType(b)[0], 'UNKNOWN')
+        finally:
+            db._unassign_barcodes(barcodes)
+            db._delete_barcodes(new)
+
+    def _kit_projects(self, ag_kit_id):
+        return {db.getBarcodeProjType(b['barcode'])[0] for b in
+                db.get_barcode_info_by_kit_id(ag_kit_id)}
+
+    def test_add_barcodes_to_kit(self):
+        ag_kit_id = db.getAGKitDetails('tst_IueFX')['ag_kit_id']
+        projects = self._kit_projects(ag_kit_id)
+        new = db.create_barcodes(2)
+        obs = []
+        try:
+            obs = db.add_barcodes_to_kit(ag_kit_id, 2)
+            self.assertEqual(len(obs), 2)
+            kit_barcodes = [b['barcode'] for b in
+                            db.get_barcode_info_by_kit_id(ag_kit_id)]
+            for b in obs:
+                self.assertIn(b, kit_barcodes)
+                self.assertIn(db.getBarcodeProjType(b)[0], projects)
+        finally:
+            if obs:
+                db._detach_from_kits(obs)
+                db._unassign_barcodes(obs)
+            db._delete_barcodes(new)
+
+    def test_add_barcodes_to_kits(self):
+        other = db._con.execute_fetchone(
+            "SELECT supplied_kit_id FROM ag.ag_kit WHERE ag_kit_id = %s",
+            ['0060a301-e5c0-6a4e-e050-8a800c5d49b7'])[0]
+        kit_counts = [('tst_IueFX', 2), (other, 3), ('tst_IueFX', 1)]
+        new = db.create_barcodes(6)
+        barcodes = []
+        try:
+            obs = db.add_barcodes_to_kits(kit_counts)
+            barcodes = [b for _, bcs in obs for b in bcs]
+            self.assertEqual([(k, len(bcs)) for k, bcs in obs], kit_counts)
+            self.assertEqual(len(set(barcodes)), 6)
+            for kit_id, bcs in obs:
+                ag_kit_id = db.getAGKitDetails(kit_id)['ag_kit_id']
+                kit_barcodes = [b['barcode'] for b in
+                                db.get_barcode_info_by_kit_id(ag_kit_id)]
+                projects = self._kit_projects(ag_kit_id)
+                for b in bcs:
+                    self.assertIn(b, kit_barcodes)
+                    self.assertIn(db.getBarcodeProjType(b)[0], projects)
+        finally:
+            if barcodes:
+                db._detach_from_kits(barcodes)
+                db._unassign_barcodes(barcodes)
+            db._delete_barcodes(new)
+
+    def test_add_barcodes_to_kits_unknown_kit(self):
+        remaining = db.count_unassigned_barcodes()
+        with self.assertRaises(ValueError):
+            db.add_barcodes_to_kits([('tst_IueFX', 1), ('notakit', 1)])
+        with self.assertRaises(ValueError):
+            db.add_barcodes_to_kits([('tst_IueFX', 0)])
+        self.assertEqual(db.add_barcodes_to_kits([]), [])
+        self.assertEqual(db.count_unassigned_barcodes(), remaining)
+
+    def test_add_barcodes_to_kits_not_enough(self):
+        remaining = db.count_unassigned_barcodes()
+        with self.assertRaises(ValueError):
+            db.add_barcodes_to_kits([('tst_IueFX', 1),
+                                     ('tst_IueFX', remaining)])
+        # nothing is claimed when the kits do not all get their barcodes
+        self.assertEqual(db.count_unassigned_barcodes(), remaining)
+
+    def _queued(self, barcodes):
+        sql = """SELECT barcode, recipient, subject, attempts,
+                     sent_on IS NOT NULL OR last_error IS NOT NULL
+                 FROM ag.email_queue
+                 WHERE barcode = ANY(%s)
+                 ORDER BY barcode"""
+        return [tuple(r) for r in db._con.execute_fetchall(sql, [barcodes])]
+
+    def test_check_in_barcodes(self):
+        new = db.create_barcodes(2)
+        barcodes = []
+        try:
+            barcodes = db.add_barcodes_to_kit(
+                '0060a301-e5c0-6a4e-e050-8a800c5d49b7', 2)
+            # the first sample is logged, the second is not
+            db._con.execute(
+                """UPDATE ag.ag_kit_barcodes
+                   SET sample_date = '2016-01-02', sample_time = '10:30',
+                       environment_sampled = 'Soil'
+                   WHERE barcode = %s""", [barcodes[0]])
+            checkins = [
+                Checkin(barcodes[0], datetime.date(2016, 1, 20), None,
+                        'N', 'N', 'N', None),
+                Checkin(barcodes[1], datetime.date(2016, 1, 20),
+                        datetime.date(2016, 1, 10), 'N', 'N', 'N', None),
+                Checkin(barcodes[1], datetime.date(2016, 1, 21),
+                        datetime.date(2016, 1, 11), 'Y', 'N', 'Y', 'wet')]
+            obs = db.check_in_barcodes(checkins, ['UNKNOWN'])
+            self.assertEqual(obs, (barcodes, barcodes))
+
+            details = db.get_barcode_details(barcodes[1])
+            self.assertEqual(details['status'], 'Received')
+            self.assertEqual(details['scan_date'], datetime.date(2016, 1, 21))
+            self.assertEqual(details['sample_postmark_date'],
+                             datetime.date(2016, 1, 11))
+            self.assertIn('UNKNOWN', db.getBarcodeProjType(barcodes[1])[0])
+            akb = db.getAGBarcodeDetails(barcodes[1])
+            self.assertEqual((akb['moldy'], akb['overloaded'], akb['other'],
+                              akb['other_text']), ('Y', 'N', 'Y', 'wet'))
+            # the email date is set once the email is sent
+            self.assertIsNone(akb['date_of_last_email'])
+
+            queued = self._queued(barcodes)
+            self.assertEqual([q[:3] for q in queued], [
+                (barcodes[0], akb['email'],
+                 'American Gut Sample with Barcode %s is Received.'
+                 % barcodes[0]),
+                (barcodes[1], akb['email'],
+                 'ACTION REQUIRED - Assign your samples in American Gut')])
+
+            # checking in again without mail keeps the note, and queues
+            # nothing more
+            obs = db.check_in_barcodes([Checkin(
+                barcodes[1], datetime.date(2016, 1, 22), None, 'N', 'N',
+                'N', None)], send_mail=False)
+            self.assertEqual(obs, ([barcodes[1]], []))
+            akb = db.getAGBarcodeDetails(barcodes[1])
+            self.assertEqual((akb['other'], akb['other_text']), ('N', 'wet'))
+            self.assertEqual(len(self._queued(barcodes)), 2)
+        finally:
+            if barcodes:
+                db._delete_queued_emails(barcodes)
+                db._detach_from_kits(barcodes)
+                db._unassign_barcodes(barcodes)
+            db._delete_barcodes(new)
+
+    def test_check_in_barcodes_unknown(self):
+        scan_date = db.get_barcode_details('000018046')['scan_date']
+        checkin = Checkin('000018046', datetime.date(2016, 1, 20), None,
+                          'N', 'N', 'N', None)
+        with self.assertRaises(ValueError):
+            db.check_in_barcodes([checkin, checkin._replace(
+                barcode='notabarcode')])
+        with self.assertRaises(ValueError):
+            db.check_in_barcodes([checkin], ['notaproject'])
+        self.assertEqual(db.check_in_barcodes([]), ([], []))
+        # nothing is checked in when any barcode is unknown
+        self.assertEqual(db.get_barcode_details('000018046')['scan_date'],
+                         scan_date)
+
+    def test_send_queued_emails(self):
+        new = db.create_barcodes(1)
+        barcodes = []
+        try:
+            barcodes = db.add_barcodes_to_kit(
+                '0060a301-e5c0-6a4e-e050-8a800c5d49b7')
+            db.check_in_barcodes([Checkin(barcodes[0], None, None, 'N', 'N',
+                                          'N', None)])
+            queued = db.count_queued_emails()
+            self.assertGreaterEqual(queued, 1)
+            sent, failed = db.send_queued_emails(limit=queued)
+            self.assertGreaterEqual(sent + failed, 1)
+            # the email is tried once, and either sent or kept with its error
+            self.assertEqual([q[3:] for q in self._queued(barcodes)],
+                             [(1, True)])
+            self.assertEqual(db.count_queued_emails(), queued - sent)
+            sent_on = db._con.execute_fetchone(
+                "SELECT sent_on FROM ag.email_queue WHERE barcode = %s",
+                [barcodes[0]])[0]
+            self.assertEqual(
+                db.getAGBarcodeDetails(barcodes[0])['date_of_last_email'],
+                None if sent_on is None else sent_on.date())
+        finally:
+            if barcodes:
+                db._delete_queued_emails(barcodes)
+                db._detach_from_kits(barcodes)
+                db._unassign_barcodes(barcodes)
+            db._delete_barcodes(new)
+
+    def test_email_queue_missing(self):
+        scan_date = db.get_barcode_details('000018046')['scan_date']
+        checkin = Checkin('000018046', datetime.date(2016, 1, 20), None,
+                          'N', 'N', 'N', None)
+        with self.assertRaisesRegexp(ValueError, 'rolled back'):
+            # as before running labadmin migrate, undone by rolling back
+            with db._con.transaction():
+                db._con.execute("""ALTER TABLE ag.email_queue
+                                   RENAME TO email_queue_moved""")
+                with self.assertRaisesRegexp(ValueError, 'labadmin migrate'):
+                    db.send_queued_emails()
+                with self.assertRaisesRegexp(ValueError, 'labadmin migrate'):
+                    db.check_in_barcodes([checkin])
+                self.assertEqual(
+                    db.get_barcode_details('000018046')['scan_date'],
+                    scan_date)
+                raise ValueError('rolled back')
+        self.assertGreaterEqual(db.count_queued_emails(), 0)
+
+    def test_allocate_kit_ids(self):
+        obs = db.allocate_kit_ids(5, tag='tstk', kit_id_length=1)
+        self.assertEqual(len(set(obs)), 5)
+        for kit_id in obs:
+            self.assertTrue(kit_id.startswith('tstk_'))
+            self.assertEqual(len(kit_id), 6)
+
+        # more than there are kit IDs for the tag
+        with self.assertRaises(ValueError):
+            db.allocate_kit_ids(24, tag='tstk', kit_id_length=1)
+
+    def test_allocate_kit_ids_skips_used(self):
+        used = db.get_used_kit_ids()
+        obs = db.allocate_kit_ids(100)
+        self.assertEqual(len(set(obs)), 100)
+        self.assertFalse(used.intersection(obs))
+
+    def test_get_kit_id_keyspace(self):
+        obs = db.get_kit_id_keyspace('tst')
+        self.assertEqual(obs['prefix'], 'tst_')
+        self.assertEqual(obs['total'], 23 ** 5)
+        self.assertGreaterEqual(obs['used'], 1)
+        self.assertEqual(obs['free'], obs['total'] - obs['used'])
+        self.assertAlmostEqual(obs['fraction_used'],
+                               obs['used'] / float(obs['total']))
+
     def test_check_consent(self):
         consent, fail = db.check_consent(['000027561', '000001124', '0000000'])
         self.assertEqual(consent, ['000027561'])
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase, main
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join, exists
+
+import requests_mock
+
+from knimin.lib import geocoder
+from knimin.lib.gazetteer import Gazetteer
+from knimin.lib.geocoder import (Location, geocode_postcode, set_gazetteer,
+                                 set_cache, GeocodeCache, geocode_postcodes)
+
+
+class TestGazetteer(TestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer(':memory:')
+        self.loaded = self.gazetteer.load(postal_codes.splitlines(True),
+                                          country_info.splitlines(True))
+
+    def test_normalize(self):
+        self.assertEqual(Gazetteer.normalize(' sw1a 1aa '), 'SW1A1AA')
+        self.assertEqual(Gazetteer.normalize('92037-1234'), '92037')
+
+    def test_create_directory(self):
+        tmp = mkdtemp()
+        try:
+            fp = join(tmp, 'state', 'gazetteer.db')
+            Gazetteer(fp)
+            self.assertTrue(exists(fp))
+        finally:
+            rmtree(tmp)
+
+    def test_load(self):
+        # the duplicate 92037, the row with no coordinates and the unknown
+        # country are skipped
+        self.assertEqual(self.loaded, 3)
+        # loading again replaces what was there
+        self.assertEqual(self.gazetteer.load(
+            postal_codes.splitlines(True)[:1],
+            country_info.splitlines(True)), 1)
+
+    def test_lookup(self):
+        obs = self.gazetteer.lookup('92037-1234', 'United States')
+        self.assertEqual(obs, Location('92037-1234', 32.8455, -117.2521,
+                                       None, 'La Jolla', 'CA', '92037-1234',
+                                       'United States'))
+
+    def test_lookup_outward_code(self):
+        obs = self.gazetteer.lookup('SW1A 1AA', 'United Kingdom')
+        self.assertEqual(obs.lat, 51.5)
+        self.assertEqual(obs.state, 'ENG')
+        self.assertEqual(obs.postcode, 'SW1A 1AA')
+
+    def test_lookup_unicode(self):
+        obs = self.gazetteer.lookup('632 30', 'Sweden')
+        self.assertEqual(obs.city, u'Eskilstuna')
+        self.assertEqual(obs.state, 'Södermanlands län'.decode('utf-8'))
+
+    def test_lookup_miss(self):
+        self.assertIsNone(self.gazetteer.lookup('92037', 'Canada'))
+        self.assertIsNone(self.gazetteer.lookup('00000', 'United States'))
+
+    def test_set_elevation(self):
+        self.gazetteer.set_elevation('SW1A 1AA', 'United Kingdom', 12.5)
+        self.assertEqual(
+            self.gazetteer.lookup('SW1A', 'United Kingdom').elev, 12.5)
+
+
+class TestGeocodePostcode(TestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer(':memory:')
+        self.gazetteer.load(postal_codes.splitlines(True),
+                            country_info.splitlines(True))
+        self.previous = geocoder._gazetteer, geocoder._cache
+        set_gazetteer(self.gazetteer)
+        set_cache(GeocodeCache(':memory:', 60, 60))
+
+    def tearDown(self):
+        set_gazetteer(self.previous[0])
+        set_cache(self.previous[1])
+
+    def test_geocode_postcode(self):
+        with requests_mock.mock() as m:
+            m.get(requests_mock.ANY, text=elevation)
+            obs = geocode_postcode('92037', 'United States')
+            self.assertEqual(obs.elev, 115.5)
+            self.assertEqual(m.call_count, 1)
+            # the elevation is stored, so no more requests are needed
+            obs = geocode_postcode('92037', 'United States')
+            self.assertEqual(obs.elev, 115.5)
+            self.assertEqual(m.call_count, 1)
+
+    def test_geocode_postcode_miss(self):
+        with requests_mock.mock() as m:
+            m.get(requests_mock.ANY, text=zero_results)
+            obs = geocode_postcode('H0H 0H0', 'Canada')
+            self.assertEqual(m.call_count, 1)
+            self.assertIn('H0H%200H0%20Canada', m.request_history[0].url)
+        self.assertEqual(obs, Location('H0H 0H0 Canada', None, None, None,
+                                       None, None, None, None))
+
+    def test_geocode_postcodes(self):
+        pairs = [('92037', 'United States'), ('SW1A 1AA', 'United Kingdom'),
+                 ('H0H 0H0', 'Canada')]
+        with requests_mock.mock() as m:
+            m.get(requests_mock.ANY, [{'text': two_elevations},
+                                      {'text': zero_results}])
+            obs = geocode_postcodes(pairs)
+            # both gazetteer hits share one elevation request
+            self.assertEqual(m.call_count, 2)
+            self.assertIn('32.845500,-117.252100%7C51.500000,-0.100000',
+                          m.request_history[0].url)
+        self.assertEqual([o.elev for o in obs], [115.5, 20.0, None])
+        self.assertEqual(obs[1].city, 'London')
+        self.assertEqual(obs[2].input, 'H0H 0H0 Canada')
+        self.assertEqual(
+            self.gazetteer.lookup('SW1A 1AA', 'United Kingdom').elev, 20.0)
+
+
+country_info = '''#ISO\tISO3\tISO-Numeric\tfips\tCountry\tCapital
+US\tUSA\t840\tUS\tUnited States\tWashington
+GB\tGBR\t826\tUK\tUnited Kingdom\tLondon
+SE\tSWE\t752\tSW\tSweden\tStockholm
+'''
+
+postal_codes = '''US\t92037\tLa Jolla\tCalifornia\tCA\tSan Diego\t073\t\t\t\
+32.8455\t-117.2521\t4
+US\t92037\tDuplicate\tCalifornia\tCA\tSan Diego\t073\t\t\t1.0\t1.0\t4
+US\t99999\tNowhere\tAlaska\tAK\t\t\t\t\t\t\t
+GB\tSW1A\tLondon\tEngland\tENG\t\t\t\t\t51.5\t-0.1\t4
+SE\t632 30\tEskilstuna\tSödermanlands län\t04\t\t\t\t\t59.36\t16.49\t4
+XX\t12345\tUnknown country\t\t\t\t\t\t\t1.0\t1.0\t4
+'''
+
+elevation = '''{
+   "results" : [{"elevation" : 115.5, "location" : {}, "resolution" : 1}],
+   "status" : "OK"
+}'''
+
+two_elevations = '''{
+   "results" : [{"elevation" : 115.5, "location" : {}, "resolution" : 1},
+                {"elevation" : 20.0, "location" : {}, "resolution" : 1}],
+   "status" : "OK"
+}'''
+
+zero_results = '''{
+   "results" : [],
+   "status" : "ZERO_RESULTS"
+}'''
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+from unittest import TestCase, main
+from json import load
+from os import close, remove
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkstemp, mkdtemp
+
+from knimin.lib.geocode_worker import (GeocodeWorker, RUNNING, QUOTA, DONE,
+                                       ERROR, IDLE)
+
+
+class FakeDB(object):
+    """Stands in for KniminAccess with a number of addresses to geocode"""
+    def __init__(self, addresses, limit_exceeded_after=None, fail=False):
+        self.addresses = addresses
+        self.limit_exceeded_after = limit_exceeded_after
+        self.fail = fail
+        self.calls = []
+
+    def addGeocodingInfo(self, limit=None, retry=False):
+        self.calls.append((limit, retry))
+        if self.fail:
+            raise ValueError('database went away')
+        n = min(limit, self.addresses)
+        exceeded = False
+        if self.limit_exceeded_after is not None:
+            if n > self.limit_exceeded_after:
+                n = self.limit_exceeded_after
+                exceeded = True
+            self.limit_exceeded_after -= n
+        self.addresses -= n
+        return {'logins': 2 * n, 'addresses': n, 'failed': 0,
+                'calls_saved': n, 'limit_exceeded': exceeded}
+
+
+class TestGeocodeWorker(TestCase):
+    def setUp(self):
+        fd, self.checkpoint_fp = mkstemp(suffix='.json')
+        close(fd)
+        remove(self.checkpoint_fp)
+
+    def tearDown(self):
+        if exists(self.checkpoint_fp):
+            remove(self.checkpoint_fp)
+
+    def test_run(self):
+        db = FakeDB(25)
+        worker = GeocodeWorker(db, self.checkpoint_fp, 100, batch_size=10)
+        self.assertEqual(worker.status()['status'], IDLE)
+        self.assertTrue(worker.start(retry=True))
+        self.assertTrue(worker.run())
+        self.assertEqual(db.calls, [(10, True), (10, False), (10, False)])
+        obs = worker.status()
+        self.assertEqual(obs['status'], DONE)
+        self.assertEqual(obs['logins'], 50)
+        self.assertEqual(obs['addresses'], 25)
+        self.assertEqual(obs['calls_saved'], 25)
+        self.assertEqual(obs['quota_left'], 75)
+
+    def test_checkpoint_directory(self):
+        tmp = mkdtemp()
+        try:
+            checkpoint_fp = join(tmp, 'state', 'geocode_worker.json')
+            worker = GeocodeWorker(FakeDB(5), checkpoint_fp, 100)
+            worker.start()
+            worker.run()
+            self.assertTrue(exists(checkpoint_fp))
+        finally:
+            rmtree(tmp)
+
+    def test_limit(self):
+        db = FakeDB(25)
+        worker = GeocodeWorker(db, self.checkpoint_fp, 100, batch_size=10)
+        worker.start(limit=15)
+        worker.run()
+        self.assertEqual(db.calls, [(10, False), (5, False)])
+        self.assertEqual(worker.status()['status'], DONE)
+        self.assertEqual(worker.status()['limit_left'], 0)
+
+    def test_quota_and_resume(self):
+        db = FakeDB(25)
+        worker = GeocodeWorker(db, self.checkpoint_fp, 12, batch_size=10)
+        worker.start()
+        worker.run()
+        self.assertEqual(db.calls, [(10, False), (2, False)])
+        self.assertEqual(worker.status()['status'], QUOTA)
+
+        # a restarted worker picks the run up once the quota resets
+        worker = GeocodeWorker(db, self.checkpoint_fp, 12, batch_size=10)
+        worker.tick()
+        self.assertEqual(len(db.calls), 2)
+        with open(self.checkpoint_fp) as f:
+            checkpoint = load(f)
+        checkpoint['date'] = '2000-01-01'
+        worker.state.update(checkpoint)
+        worker.tick()
+        self.assertEqual(db.calls[2:], [(10, False), (2, False)])
+        obs = worker.status()
+        self.assertEqual(obs['status'], QUOTA)
+        self.assertEqual(obs['addresses'], 12)
+
+    def test_limit_exceeded(self):
+        db = FakeDB(25, limit_exceeded_after=4)
+        worker = GeocodeWorker(db, self.checkpoint_fp, 100, batch_size=10)
+        worker.start()
+        worker.run()
+        obs = worker.status()
+        self.assertEqual(obs['status'], QUOTA)
+        self.assertEqual(obs['addresses'], 4)
+        self.assertEqual(obs['quota_left'], 0)
+
+    def test_error(self):
+        worker = GeocodeWorker(FakeDB(25, fail=True), self.checkpoint_fp, 100)
+        worker.start()
+        with self.assertRaises(ValueError):
+            worker.run()
+        obs = worker.status()
+        self.assertEqual(obs['status'], ERROR)
+        self.assertEqual(obs['error'], 'ValueError: database went away')
+        self.assertFalse(worker.running)
+        # errored runs are not picked up again
+        self.assertTrue(worker.tick())
+        self.assertEqual(worker.status()['status'], ERROR)
+
+    def test_start_while_running(self):
+        worker = GeocodeWorker(FakeDB(25), self.checkpoint_fp, 100)
+        worker._running.acquire()
+        try:
+            self.assertFalse(worker.start())
+            self.assertFalse(worker.run())
+        finally:
+            worker._running.release()
+        self.assertTrue(worker.start())
+        self.assertEqual(worker.status()['status'], RUNNING)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,30 @@
 from unittest import TestCase, main
-from json import loads
+from json import loads, dumps
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+from time import sleep, time
+from urlparse import urlparse, parse_qs
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join, exists
 import requests_mock
+from knimin.lib import geocoder
 from knimin.lib.geocoder import (
     GoogleAPIInvalidRequest, GoogleAPILimitExceeded, GoogleAPIRequestDenied,
-    Location, _call_wrapper, geocode)
+    ElevationNotFound, Location, _call_wrapper, geocode, GeocodeCache,
+    set_cache, RateLimiter, set_rate_limiter, geocode_many, elevations,
+    _pack_locations)
 
 
 class TestCallWrapper(TestCase):
     def setUp(self):
         self.url = 'mock://maps.googleapis.com/%s'
+        self.limiter = geocoder._limiter
+        set_rate_limiter(RateLimiter(1000, 8))
+
+    def tearDown(self):
+        set_rate_limiter(self.limiter)
 
     def test_call_wrapper_ok(self):
         full_url = self.url % 'ok'
@@ -68,6 +84,14 @@ class TestCallWrapper(TestCase):
 
 
 class TestGeocode(TestCase):
+    def setUp(self):
+        # answers cached by earlier runs would hide what the API returns
+        self.cache = geocoder._cache
+        set_cache(GeocodeCache(':memory:', 60, 60))
+
+    def tearDown(self):
+        set_cache(self.cache)
+
     def test_geocode_nonmock(self):
         obs = geocode('9500 Gilman Dr, La Jolla, CA')
         exp = Location('9500 Gilman Dr, La Jolla, CA', 32.8794239,
@@ -98,6 +122,312 @@ class TestGeocode(TestCase):
                        None)
         self.assertEqual(obs, exp)
 
+
+class TestGeocodeCache(TestCase):
+    def setUp(self):
+        self.cache = GeocodeCache(':memory:', 60, 60)
+        self.location = Location('9500 Gilman Dr, La Jolla, CA', 32.8794081,
+                                 -117.2368167, 114.8, 'San Diego', 'CA',
+                                 '92093', 'United States')
+
+    def test_normalize(self):
+        self.assertEqual(GeocodeCache.normalize(' 9500 Gilman Dr,La Jolla, '
+                                                'CA\t92093 '),
+                         '9500 gilman dr la jolla ca 92093')
+        self.assertEqual(GeocodeCache.normalize('12 S\xc3\xb6dermanland'),
+                         u'12 s\xf6dermanland')
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('9500 Gilman Dr, La Jolla, CA'))
+        self.cache.set('9500 Gilman Dr, La Jolla, CA', self.location)
+        obs = self.cache.get('9500 gilman dr  la jolla ca')
+        self.assertEqual(obs, self.location._replace(
+            input='9500 gilman dr  la jolla ca'))
+
+    def test_get_set_negative(self):
+        self.cache.set('SomeRandomPlace', Location(
+            'SomeRandomPlace', None, None, None, None, None, None, None))
+        obs = self.cache.get('somerandomplace')
+        self.assertEqual(obs, Location('somerandomplace', None, None, None,
+                                       None, None, None, None))
+
+    def test_create_directory(self):
+        tmp = mkdtemp()
+        try:
+            fp = join(tmp, 'state', 'geocode_cache.db')
+            GeocodeCache(fp, 60, 60).set('a', self.location)
+            self.assertTrue(exists(fp))
+            self.assertEqual(GeocodeCache(fp, 60, 60).get('a'),
+                             self.location._replace(input='a'))
+        finally:
+            rmtree(tmp)
+
+    def test_get_no_elevation(self):
+        self.cache.set('a', self.location._replace(elev=None))
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_expired(self):
+        cache = GeocodeCache(':memory:', -1, 60)
+        cache.set('a', self.location)
+        cache.set('b', Location('b', None, None, None, None, None, None,
+                                None))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertEqual(cache.purge(), 1)
+
+    def test_geocode_uses_cache(self):
+        previous = geocoder._cache
+        set_cache(self.cache)
+        try:
+            with requests_mock.mock() as m:
+                m.get(requests_mock.ANY, text=zero_results)
+                obs = geocode('SomeRandomPlace')
+                self.assertEqual(m.call_count, 1)
+                self.assertEqual(geocode('somerandomplace'), obs._replace(
+                    input='somerandomplace'))
+                self.assertEqual(m.call_count, 1)
+
+                geocode('SomeRandomPlace', use_cache=False)
+                self.assertEqual(m.call_count, 2)
+        finally:
+            set_cache(previous)
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    """Answers like the geocoding and elevation APIs
+
+    Addresses starting with 'nowhere' and elevations asked for latitudes
+    above 90 have no results, and addresses starting with 'busy' are over
+    the query limit for the first `server.busy_for` requests. Every answer
+    is delayed by `server.delay` seconds.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        with server.lock:
+            server.paths.append(self.path)
+            server.active += 1
+            server.most_active = max(server.most_active, server.active)
+        try:
+            sleep(server.delay)
+            if url.path == '/maps/api/elevation/json':
+                locations = query['locations'][0].split('|')
+                if any(float(loc.split(',')[0]) > 90 for loc in locations):
+                    body = {'status': 'ZERO_RESULTS', 'results': []}
+                else:
+                    body = {'status': 'OK', 'results': [
+                        {'elevation': 10.0 * i}
+                        for i, _ in enumerate(locations, 1)]}
+            else:
+                address = query['address'][0]
+                if address.startswith('nowhere'):
+                    body = {'status': 'ZERO_RESULTS', 'results': []}
+                elif address.startswith('busy') and server.busy_for > 0:
+                    with server.lock:
+                        server.busy_for -= 1
+                    body = {'status': 'OVER_QUERY_LIMIT', 'results': []}
+                else:
+                    body = {'status': 'OK', 'results': [{
+                        'geometry': {'location': {'lat': len(address),
+                                                  'lng': -117.0}},
+                        'address_components': [
+                            {'long_name': address, 'short_name': address,
+                             'types': ['locality']},
+                            {'long_name': 'California', 'short_name': 'CA',
+                             'types': ['administrative_area_level_1']},
+                            {'long_name': 'United States',
+                             'short_name': 'US', 'types': ['country']}]}]}
+            body = dumps(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGoogleServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeGoogleHandler)
+        self.lock = Lock()
+        self.paths = []
+        self.active = 0
+        self.most_active = 0
+        self.busy_for = 0
+        self.delay = 0
+
+
+class TestGeocodeMany(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeGoogleServer()
+        Thread(target=cls.server.serve_forever).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.paths = []
+        self.server.most_active = 0
+        self.server.busy_for = 0
+        self.server.delay = 0
+        self.api_url = geocoder.API_URL
+        self.cache = geocoder._cache
+        self.limiter = geocoder._limiter
+        geocoder.API_URL = 'http://127.0.0.1:%d' % self.server.server_port
+        set_cache(GeocodeCache(':memory:', 60, 60))
+        set_rate_limiter(RateLimiter(1000, 8))
+
+    def tearDown(self):
+        geocoder.API_URL = self.api_url
+        set_cache(self.cache)
+        set_rate_limiter(self.limiter)
+
+    def test_geocode_many(self):
+        addresses = ['town %d' % i for i in range(20)] + ['nowhere']
+        # slow enough that the workers' requests overlap
+        self.server.delay = 0.01
+        obs = list(geocode_many(addresses, workers=4))
+        self.assertEqual([o.input for o in obs], addresses)
+        self.assertEqual(obs[0], Location('town 0', 6.0, -117.0, 10.0,
+                                          'town 0', 'CA', None,
+                                          'United States'))
+        self.assertEqual(obs[-1], Location('nowhere', None, None, None, None,
+                                           None, None, None))
+        # one geocode request per address, and the elevations of all found
+        # in a single request
+        self.assertEqual(len(self.server.paths), 22)
+        self.assertEqual(obs[19].elev, 200.0)
+        self.assertGreater(self.server.most_active, 1)
+        self.assertLessEqual(self.server.most_active, 4)
+
+    def test_geocode_many_cached(self):
+        list(geocode_many(['town 1', 'town 2']))
+        self.server.paths = []
+        obs = list(geocode_many(['Town 1', 'town 2', 'town 3']))
+        self.assertEqual([o.lat for o in obs], [6.0, 6.0, 6.0])
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_geocode_many_backoff(self):
+        limiter = RateLimiter(1000, 8)
+        set_rate_limiter(limiter)
+        self.server.busy_for = 2
+        obs = list(geocode_many(['busy town'], workers=1))
+        self.assertEqual(obs[0].city, 'busy town')
+        self.assertEqual(len(self.server.paths), 4)
+        # halved twice, then recovered twice
+        self.assertEqual(limiter.rate, 450)
+
+    def test_geocode_many_limit_exceeded(self):
+        self.server.busy_for = 100
+        obs = list(geocode_many(['busy town', 'town 1'], workers=1))
+        self.assertIsInstance(obs[0], GoogleAPILimitExceeded)
+        # the quota is used up, so the rest are not sent
+        self.assertIsInstance(obs[1], GoogleAPILimitExceeded)
+        self.assertEqual(len(self.server.paths), 4)
+
+    def test_geocode_many_missing_elevation(self):
+        # found at a latitude with no elevations
+        far = 'far' + 'x' * 90
+        obs = list(geocode_many(['town 1', far], chunk_size=1))
+        self.assertEqual(obs[0].elev, 10.0)
+        self.assertIsInstance(obs[1], ElevationNotFound)
+        cache = geocoder.get_cache()
+        self.assertIsNotNone(cache.get('town 1'))
+        self.assertIsNone(cache.get(far))
+
+        with self.assertRaises(ElevationNotFound):
+            geocode(far)
+        self.assertIsNone(cache.get(far))
+
+    def test_geocode_many_chunks(self):
+        addresses = ['town %d' % i for i in range(5)]
+        obs = list(geocode_many(addresses, chunk_size=2))
+        self.assertEqual([o.elev for o in obs],
+                         [10.0, 20.0, 10.0, 20.0, 10.0])
+        self.assertEqual(len(self.server.paths), 8)
+
+    def test_elevations(self):
+        points = [(32.5 + i, -117.25) for i in range(5)]
+        max_locations = geocoder.MAX_LOCATIONS
+        geocoder.MAX_LOCATIONS = 2
+        try:
+            obs = elevations(points)
+        finally:
+            geocoder.MAX_LOCATIONS = max_locations
+        self.assertEqual(obs, [10.0, 20.0, 10.0, 20.0, 10.0])
+        self.assertEqual(len(self.server.paths), 3)
+        self.assertIn('locations=32.500000,-117.250000%7C'
+                      '33.500000,-117.250000', self.server.paths[0])
+
+    def test_elevations_missing_batch(self):
+        points = [(1.0, 2.0), (3.0, 4.0), (95.0, 6.0), (7.0, 8.0), (9.0, 0.0)]
+        max_locations = geocoder.MAX_LOCATIONS
+        geocoder.MAX_LOCATIONS = 2
+        try:
+            obs = elevations(points)
+        finally:
+            geocoder.MAX_LOCATIONS = max_locations
+        # the points of the batch without results get an error, and the
+        # later ones still get their own elevation
+        self.assertEqual(obs[:2] + obs[4:], [10.0, 20.0, 10.0])
+        self.assertIsInstance(obs[2], ElevationNotFound)
+        self.assertIs(obs[3], obs[2])
+
+    def test_elevations_empty(self):
+        self.assertEqual(elevations([]), [])
+        self.assertEqual(self.server.paths, [])
+
+
+class TestPackLocations(TestCase):
+    def test_pack_locations(self):
+        obs = _pack_locations([(1, 2), (3.5, -4.25)])
+        self.assertEqual(obs, ['1.000000,2.000000|3.500000,-4.250000'])
+
+    def test_pack_locations_url_length(self):
+        max_length = geocoder.MAX_URL_LENGTH
+        base = len(geocoder.API_URL + geocoder.ELEVATION_PATH)
+        # room for two locations and the encoded separator
+        geocoder.MAX_URL_LENGTH = base + 2 * len('1.000000,2.000000') + 3
+        try:
+            obs = _pack_locations([(1, 2)] * 5)
+        finally:
+            geocoder.MAX_URL_LENGTH = max_length
+        self.assertEqual(obs, ['1.000000,2.000000|1.000000,2.000000'] * 2 +
+                         ['1.000000,2.000000'])
+
+
+class TestRateLimiter(TestCase):
+    def test_acquire(self):
+        limiter = RateLimiter(50)
+        start = time()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time() - start, 0.19)
+
+    def test_backoff_recover(self):
+        limiter = RateLimiter(10)
+        limiter.backoff()
+        self.assertEqual(limiter.rate, 5)
+        for _ in range(20):
+            limiter.backoff()
+        self.assertEqual(limiter.rate, 0.1)
+        limiter.recover()
+        self.assertEqual(limiter.rate, 1.1)
+        for _ in range(20):
+            limiter.recover()
+        self.assertEqual(limiter.rate, 10)
+
 # Results copied from Google API responses on 2015-10-25
 ok = '''{
    "results" : [
@@ -0,0 +1,31 @@
+from unittest import TestCase, main
+
+from bcrypt import hashpw
+
+from knimin.lib.hashing import hash_password, hash_passwords
+
+
+class TestHashing(TestCase):
+    def test_hash_password(self):
+        hashed = hash_password('password')
+        self.assertNotEqual(hashed, 'password')
+        self.assertEqual(hash_password('password', hashed), hashed)
+        self.assertNotEqual(hash_password('other', hashed), hashed)
+
+    def test_hash_passwords(self):
+        passwords = ['1234567', '7654321', '1111111', '2222222', '3333333']
+        for workers in (1, 3):
+            obs = list(hash_passwords(passwords, workers))
+            self.assertEqual(len(obs), 5)
+            # fresh salt for each password
+            self.assertEqual(len(set(h[:29] for h in obs)), 5)
+            for password, hashed in zip(passwords, obs):
+                self.assertEqual(hashpw(password.encode('utf-8'),
+                                        hashed.encode('utf-8')), hashed)
+
+    def test_hash_passwords_empty(self):
+        self.assertEqual(list(hash_passwords([])), [])
+
+
+if __name__ == '__main__':
+    main()
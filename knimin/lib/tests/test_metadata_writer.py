@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from unittest import TestCase, main
+from decimal import Decimal
+import re
+
+from knimin.lib.metadata_writer import MetadataWriter, encode_value
+
+
+def _legacy_convert(value):
+    """The per-cell conversion the pulldown used before MetadataWriter"""
+    if isinstance(value, unicode):
+        converted = value
+    elif isinstance(value, str):
+        converted = unicode(value, 'utf-8')
+    else:
+        converted = unicode(str(value), 'utf-8')
+    return re.sub(r"\t|\r|\n|\s+", " ", converted)
+
+
+class TestMetadataWriter(TestCase):
+    values = [1, 1.0, True, False, 0, 12345678901234567890, 3.14159265358979,
+              Decimal('1.50'), None, 'Unspecified', u'Unspecified', 'Yes',
+              'two  spaces', 'tab\there', 'tabs\t\t\tin a row',
+              'line\r\nbreak', ' \t mixed \n ', 'caf\xc3\xa9', u'café\t',
+              u'\x0bvertical\x0cfeed', '', [1, 2]]
+
+    def test_encode_value(self):
+        for value in self.values:
+            self.assertEqual(encode_value(value), _legacy_convert(value))
+
+    def test_row_matches_legacy(self):
+        headers = ['FREE', 'MEMO']
+        writer = MetadataWriter(headers, free_text=['FREE'])
+        # run every value through twice so the cached encodings are used
+        for value in self.values + self.values:
+            row = writer.row('000001000', {'FREE': value, 'MEMO': value})
+            exp = '\t'.join(['000001000', _legacy_convert(value),
+                             _legacy_convert(value)])
+            self.assertEqual(row, exp)
+            self.assertEqual(type(row), unicode)
+
+    def test_row_does_not_mix_equal_numbers(self):
+        writer = MetadataWriter(['A'])
+        obs = [writer.row('s', {'A': v}) for v in (1, 1.0, True, '1')]
+        self.assertEqual(obs, ['s\t1', 's\t1.0', 's\tTrue', 's\t1'])
+
+    def test_row_missing(self):
+        writer = MetadataWriter(['A', 'B'])
+        self.assertEqual(writer.row('s', {'A': 'x'}), 's\tx\tUnspecified')
+        self.assertEqual(writer.row('s', {}, missing='NA'), 's\tNA\tNA')
+
+    def test_header(self):
+        writer = MetadataWriter(['A', 'B'])
+        self.assertEqual(writer.header(), 'sample_name\tA\tB')
+
+    def test_raw_row(self):
+        writer = MetadataWriter(['A', 'B'])
+        self.assertEqual(writer.raw_row('BLANK.1', {'B': 'b\tc', 'A': 'a'}),
+                         'BLANK.1\ta\tb\tc')
+
+
+if __name__ == '__main__':
+    main()
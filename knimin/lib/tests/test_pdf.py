@@ -0,0 +1,88 @@
+from unittest import TestCase, main
+from io import BytesIO
+import re
+
+from PIL import Image
+
+from knimin.lib.pdf import PDFWriter, LETTER, literal_string, _number
+
+
+def check_xref(test, data):
+    """Checks every object in the cross reference table is where it says"""
+    test.assertTrue(data.startswith(b'%PDF-1.4\n'))
+    test.assertTrue(data.endswith(b'%%EOF\n'))
+    xref = int(re.search(br'startxref\n(\d+)\n', data).group(1))
+    test.assertEqual(data[xref:xref + 5], b'xref\n')
+    count = int(re.match(br'xref\n0 (\d+)\n', data[xref:]).group(1))
+    offsets = re.findall(br'(\d{10}) 00000 n \n', data[xref:])
+    test.assertEqual(len(offsets), count - 1)
+    for obj_id, offset in enumerate(offsets, 1):
+        offset = int(offset)
+        test.assertEqual(data[offset:offset + len(b'%d 0 obj' % obj_id)],
+                         b'%d 0 obj' % obj_id)
+
+
+class TestPDFWriter(TestCase):
+    def test_image_pages(self):
+        out = BytesIO()
+        with PDFWriter(out) as pdf:
+            pdf.add_image_page(Image.new('1', (10, 20), 1))
+            pdf.add_image_page(Image.new('L', (10, 20), 128), (100, 200))
+            pdf.add_image_page(Image.new('RGBA', (10, 20)))
+            self.assertEqual(pdf.page_count, 3)
+        data = out.getvalue()
+        check_xref(self, data)
+        self.assertEqual(len(re.findall(br'/Type /Page ', data)), 3)
+        self.assertIn(b'/Count 3', data)
+        self.assertIn(b'/MediaBox [0 0 612 792]', data)
+        self.assertIn(b'/MediaBox [0 0 100 200]', data)
+        self.assertIn(b'/BitsPerComponent 1', data)
+        self.assertIn(b'/ColorSpace /DeviceRGB', data)
+
+    def test_add_object_stream_length(self):
+        out = BytesIO()
+        pdf = PDFWriter(out)
+        obj_id = pdf.add_object(b'<< /Subtype /Test >>', b'12345')
+        pdf.close()
+        self.assertIn(b'%d 0 obj\n<< /Subtype /Test /Length 5 >>\nstream\n'
+                      b'12345\nendstream' % obj_id, out.getvalue())
+
+    def test_empty(self):
+        out = BytesIO()
+        PDFWriter(out).close()
+        check_xref(self, out.getvalue())
+        self.assertIn(b'/Count 0', out.getvalue())
+
+    def test_not_closed_on_error(self):
+        out = BytesIO()
+        with self.assertRaises(ValueError):
+            with PDFWriter(out):
+                raise ValueError()
+        self.assertNotIn(b'%%EOF', out.getvalue())
+
+    def test_add_font(self):
+        out = BytesIO()
+        with PDFWriter(out) as pdf:
+            font = pdf.add_font(b'Helvetica')
+            pdf.add_page(b'BT /F0 12 Tf 10 10 Td (x) Tj ET',
+                         fonts={b'F0': font})
+        data = out.getvalue()
+        check_xref(self, data)
+        self.assertIn(b'%d 0 obj\n<< /Type /Font /Subtype /Type1 /BaseFont '
+                      b'/Helvetica' % font, data)
+        self.assertIn(b'/Resources << /Font << /F0 %d 0 R >> >>' % font,
+                      data)
+
+    def test_literal_string(self):
+        self.assertEqual(literal_string(b'000012345'), b'(000012345)')
+        self.assertEqual(literal_string(b'a(b)\\c'), b'(a\\(b\\)\\\\c)')
+
+    def test_number(self):
+        self.assertEqual(_number(612.0), b'612')
+        self.assertEqual(_number(LETTER[0]), b'612')
+        self.assertEqual(_number(1.5), b'1.5')
+        self.assertEqual(_number(0.125), b'0.12')
+
+
+if __name__ == '__main__':
+    main()
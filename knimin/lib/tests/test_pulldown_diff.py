@@ -0,0 +1,78 @@
+from unittest import TestCase, main
+from io import BytesIO
+
+from knimin.lib.pulldown_diff import (diff_sample_templates, index_rows,
+                                      write_diff)
+
+
+class TestPulldownDiff(TestCase):
+    previous = ('sample_name\tAGE\tSEX\n'
+                '000000001\t30\tmale\n'
+                '000000002\t41\tfemale\n'
+                '000000003\t25\tUnspecified')
+
+    def test_index_rows(self):
+        fh = BytesIO(self.previous)
+        headers, index = index_rows(fh, ['AGE', 'SEX'])
+        self.assertEqual(headers, ['AGE', 'SEX'])
+        self.assertEqual(sorted(index),
+                         ['000000001', '000000002', '000000003'])
+        fh.seek(index['000000002'][1])
+        self.assertEqual(fh.readline(), '000000002\t41\tfemale\n')
+
+    def test_diff_same(self):
+        obs = list(diff_sample_templates(BytesIO(self.previous),
+                                         BytesIO(self.previous)))
+        self.assertEqual(obs, [])
+
+    def test_diff_samples_and_cells(self):
+        current = ('sample_name\tAGE\tSEX\n'
+                   '000000001\t30\tmale\n'
+                   '000000003\t26\tfemale\n'
+                   '000000004\t50\tmale')
+        obs = list(diff_sample_templates(BytesIO(self.previous),
+                                         BytesIO(current)))
+        exp = [('changed', '000000003', 'AGE', '25', '26'),
+               ('changed', '000000003', 'SEX', 'Unspecified', 'female'),
+               ('added', '000000004', '', '', ''),
+               ('removed', '000000002', '', '', '')]
+        self.assertEqual(obs, exp)
+
+    def test_diff_columns(self):
+        current = ('sample_name\tSEX\tBMI\n'
+                   '000000001\tmale\t22.1\n'
+                   '000000002\tfemale\t\n'
+                   '000000003\tUnspecified\t19.0')
+        obs = list(diff_sample_templates(BytesIO(self.previous),
+                                         BytesIO(current)))
+        exp = [('added', '', 'BMI', '', ''),
+               ('removed', '', 'AGE', '', ''),
+               ('changed', '000000001', 'BMI', '', '22.1'),
+               ('changed', '000000002', 'BMI', '', ''),
+               ('changed', '000000003', 'BMI', '', '19.0')]
+        self.assertEqual(obs, exp)
+
+    def test_diff_empty_previous(self):
+        obs = list(diff_sample_templates(BytesIO(), BytesIO(self.previous)))
+        exp = [('added', '', 'AGE', '', ''),
+               ('added', '', 'SEX', '', ''),
+               ('added', '000000001', '', '', ''),
+               ('added', '000000002', '', '', ''),
+               ('added', '000000003', '', '', '')]
+        self.assertEqual(obs, exp)
+
+    def test_write_diff(self):
+        current = ('sample_name\tAGE\tSEX\n'
+                   '000000001\t31\tmale\n'
+                   '000000002\t41\tfemale')
+        out = BytesIO()
+        obs = write_diff(BytesIO(self.previous), BytesIO(current), out)
+        self.assertEqual(obs, {'added': 0, 'removed': 1, 'changed': 1})
+        self.assertEqual(out.getvalue(),
+                         'change\tsample_name\tcolumn\tprevious\tcurrent\n'
+                         'changed\t000000001\tAGE\t30\t31\n'
+                         'removed\t000000003\t\t\t')
+
+
+if __name__ == '__main__':
+    main()
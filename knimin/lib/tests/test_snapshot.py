@@ -0,0 +1,57 @@
+from unittest import TestCase, main
+from datetime import datetime
+from threading import Thread
+from time import sleep
+
+from knimin.lib.snapshot import Snapshot
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def _count(self):
+        self.calls += 1
+        return self.calls
+
+    def test_get(self):
+        snapshot = Snapshot(self._count, 60)
+        value, taken = snapshot.get()
+        self.assertEqual(value, 1)
+        self.assertIsInstance(taken, datetime)
+        self.assertEqual(snapshot.get(), (1, taken))
+        self.assertEqual(self.calls, 1)
+
+    def test_get_refresh(self):
+        snapshot = Snapshot(self._count, 60)
+        snapshot.get()
+        self.assertEqual(snapshot.get(refresh=True)[0], 2)
+        self.assertEqual(snapshot.refresh()[0], 3)
+        self.assertEqual(snapshot.get()[0], 3)
+
+    def test_get_stale(self):
+        snapshot = Snapshot(self._count, 0.01)
+        snapshot.get()
+        sleep(0.02)
+        self.assertEqual(snapshot.get()[0], 2)
+
+    def test_get_concurrent(self):
+        def _slow():
+            sleep(0.05)
+            return self._count()
+
+        snapshot = Snapshot(_slow, 60)
+        results = []
+        threads = [Thread(target=lambda: results.append(snapshot.get()[0]))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # computed once, by whichever thread got there first
+        self.assertEqual(results, [1, 1, 1, 1])
+        self.assertEqual(self.calls, 1)
+
+
+if __name__ == '__main__':
+    main()
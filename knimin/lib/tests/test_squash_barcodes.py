@@ -0,0 +1,95 @@
+from unittest import TestCase, main
+from io import BytesIO
+from os import getcwd, listdir
+import re
+
+from PIL import Image, ImageDraw
+from PIL.ImageChops import difference, invert
+
+from knimin.lib.squash_barcodes import (build_barcodes_pdf, get_pages,
+                                        render_page, draw_page,
+                                        write_barcodes_pdf, PAGE_WIDTH,
+                                        PAGE_HEIGHT)
+from knimin.lib.tests.test_pdf import check_xref
+
+
+class TestSquashBarcodes(TestCase):
+    barcodes = ['%09d' % i for i in range(1, 74)]
+
+    def test_get_pages(self):
+        pages = list(get_pages(self.barcodes))
+        self.assertEqual(len(pages), 3)
+        for page in pages:
+            self.assertEqual(page.mode, '1')
+            self.assertEqual(page.size, (PAGE_WIDTH, PAGE_HEIGHT))
+        # the last page only has the 73rd barcode, in the top left
+        first, last = [invert(p.convert('L')).getbbox() for p in
+                       (pages[0], pages[2])]
+        self.assertEqual(last[:2], first[:2])
+        self.assertLess(last[2], first[2])
+        self.assertLess(last[3], first[3])
+
+    def test_get_pages_none(self):
+        self.assertEqual(list(get_pages([])), [])
+
+    def test_render_page(self):
+        obs = render_page(self.barcodes[:36])
+        self.assertEqual(obs.tobytes(),
+                         next(get_pages(self.barcodes[:36])).tobytes())
+
+    def test_draw_page(self):
+        barcodes = self.barcodes[:36]
+        content = draw_page(barcodes)
+        self.assertEqual(re.findall(br'\((\d+)\) Tj', content), barcodes)
+        # draw the bars of the content stream the way render_page would
+        page = Image.new('1', (PAGE_WIDTH, PAGE_HEIGHT), 1)
+        draw = ImageDraw.Draw(page)
+        for label in re.findall(br'q 1 0 0 1 (\d+) (\d+) cm\n(.*?)\nf ',
+                                content, re.S):
+            left, upper = int(label[0]), int(label[1])
+            for x, y, w, h in re.findall(br'(\d+) (\d+) (\d+) (\d+) re',
+                                         label[2]):
+                x, y = left + int(x), upper + int(y)
+                draw.rectangle(((x, y), (x + int(w) - 1, y + int(h) - 1)),
+                               fill=0)
+        # the bars match render_page to the pixel, with the text below them
+        exp = render_page(barcodes)
+        for row in range(9):
+            upper = 59 + 25 + row * 173
+            box = (0, upper, PAGE_WIDTH, upper + 76)
+            self.assertIsNone(difference(page.crop(box).convert('L'),
+                                         exp.crop(box).convert('L')).getbbox())
+
+    def test_draw_page_too_wide(self):
+        with self.assertRaises(ValueError):
+            draw_page(['x' * 20])
+
+    def test_build_barcodes_pdf_vector(self):
+        obs = build_barcodes_pdf(self.barcodes, vector=True)
+        check_xref(self, obs)
+        self.assertEqual(len(re.findall(br'/Type /Page ', obs)), 3)
+        self.assertIn(b'/BaseFont /Helvetica', obs)
+        self.assertNotIn(b'/Subtype /Image', obs)
+        self.assertLess(len(obs), len(build_barcodes_pdf(self.barcodes)))
+
+    def test_build_barcodes_pdf_workers(self):
+        obs = build_barcodes_pdf(self.barcodes, workers=2)
+        self.assertEqual(obs, build_barcodes_pdf(self.barcodes, workers=1))
+        self.assertEqual(obs.count(b'/Type /Page '), 3)
+
+    def test_build_barcodes_pdf(self):
+        before = listdir(getcwd())
+        obs = build_barcodes_pdf(self.barcodes)
+        # nothing left behind in the working directory
+        self.assertEqual(listdir(getcwd()), before)
+        check_xref(self, obs)
+        self.assertEqual(len(re.findall(br'/Type /Page ', obs)), 3)
+
+    def test_write_barcodes_pdf(self):
+        out = BytesIO()
+        self.assertEqual(write_barcodes_pdf(self.barcodes[:36], out), 1)
+        check_xref(self, out.getvalue())
+
+
+if __name__ == '__main__':
+    main()
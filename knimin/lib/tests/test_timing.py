@@ -0,0 +1,45 @@
+from unittest import TestCase, main
+from json import loads
+
+from knimin.lib.timing import StageTimer
+
+
+class TestStageTimer(TestCase):
+    def test_stage(self):
+        timer = StageTimer()
+        with timer.stage('first'):
+            pass
+        with timer.stage('second'):
+            pass
+        with timer.stage('first'):
+            pass
+        self.assertEqual(list(timer.stages), ['first', 'second'])
+        self.assertTrue(all(t >= 0 for t in timer.stages.values()))
+
+    def test_stage_records_on_error(self):
+        timer = StageTimer()
+        with self.assertRaises(ValueError):
+            with timer.stage('broken'):
+                raise ValueError('failed')
+        self.assertIn('broken', timer.stages)
+
+    def test_count(self):
+        timer = StageTimer()
+        timer.count('rows_fetched', 10)
+        timer.count('rows_fetched', 5)
+        timer.count('geocoder_calls')
+        self.assertEqual(timer.counts, {'rows_fetched': 15,
+                                        'geocoder_calls': 1})
+
+    def test_to_json(self):
+        timer = StageTimer()
+        with timer.stage('get_surveys'):
+            timer.count('rows_fetched', 3)
+        obs = loads(timer.to_json())
+        self.assertEqual(set(obs), {'total_seconds', 'stages', 'counts'})
+        self.assertEqual(list(obs['stages']), ['get_surveys'])
+        self.assertEqual(obs['counts'], {'rows_fetched': 3})
+
+
+if __name__ == '__main__':
+    main()
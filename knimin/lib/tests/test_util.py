@@ -2,7 +2,9 @@ from unittest import TestCase, main
 from StringIO import StringIO
 
 from knimin.lib.util import (combine_barcodes, categorize_age, categorize_etoh,
-                             categorize_bmi, correct_bmi)
+                             categorize_bmi, correct_bmi, kit_id_format,
+                             kit_id_keyspace, make_kit_ids,
+                             make_valid_kit_ids, parse_kit_counts)
 
 
 __author__ = "Adam Robbins-Pianka"
@@ -44,6 +46,46 @@ class UtilTests(TestCase):
         obs = combine_barcodes()
         self.assertEqual(obs, exp)
 
+    def test_kit_id_format(self):
+        self.assertEqual(kit_id_format(), ('', 5))
+        self.assertEqual(kit_id_format(tag='ab'), ('ab_', 5))
+        self.assertEqual(kit_id_format(tag='abcd'), ('abcd_', 4))
+        with self.assertRaises(ValueError):
+            kit_id_format(tag='abcde')
+
+    def test_kit_id_keyspace(self):
+        self.assertEqual(kit_id_keyspace(), 23 ** 5)
+        self.assertEqual(kit_id_keyspace(tag='abcd'), 23 ** 4)
+        self.assertEqual(kit_id_keyspace(2), 23 ** 2)
+
+    def test_make_kit_ids(self):
+        obs = make_kit_ids(10, tag='ab')
+        self.assertEqual(len(obs), 10)
+        for kit_id in obs:
+            self.assertEqual(len(kit_id), 8)
+            self.assertTrue(kit_id.startswith('ab_'))
+
+    def test_make_valid_kit_ids(self):
+        used = set(make_kit_ids(20, 1))
+        obs = make_valid_kit_ids(3, used, 1)
+        self.assertEqual(len(set(obs)), 3)
+        with self.assertRaises(ValueError):
+            make_valid_kit_ids(24, set(), 1)
+
+    def test_parse_kit_counts(self):
+        lines = ['# kit\tcount', 'tst_abcde\t2', '', 'tst_fghjk, 3',
+                 '  tst_mnpqr  ', 'tst_abcde 1\r\n']
+        self.assertEqual(parse_kit_counts(lines),
+                         [('tst_abcde', 2), ('tst_fghjk', 3), ('tst_mnpqr', 1),
+                          ('tst_abcde', 1)])
+        self.assertEqual(parse_kit_counts([]), [])
+
+    def test_parse_kit_counts_bad(self):
+        for line in ('tst_abcde\tx', 'tst_abcde\t0', 'tst_abcde\t-1',
+                     'tst_abcde\t1\t2'):
+            with self.assertRaises(ValueError):
+                parse_kit_counts(['tst_fghjk', line])
+
     def test_categorize_age(self):
         self.assertEqual('Unspecified', categorize_age(-2))
         self.assertEqual('baby', categorize_age(0))
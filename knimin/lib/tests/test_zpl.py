@@ -0,0 +1,44 @@
+from unittest import TestCase, main
+import re
+
+from knimin.lib.code128 import code128_bars
+from knimin.lib.zpl import (label_zpl, iter_barcodes_zpl, build_barcodes_zpl,
+                            LABEL_WIDTH)
+
+
+class TestZPL(TestCase):
+    barcodes = ['%09d' % i for i in range(1, 26)]
+
+    def test_label_zpl(self):
+        obs = label_zpl('000012345')
+        self.assertTrue(obs.startswith('^XA'))
+        self.assertTrue(obs.endswith('^XZ\n'))
+        self.assertIn('^BCN,100,Y,N,N,A^FH_^FD000012345^FS', obs)
+        # centered on the label
+        left = int(re.search(r'\^FO(\d+),', obs).group(1))
+        width = code128_bars('000012345', 2)[1]
+        self.assertEqual(left, (LABEL_WIDTH - width) // 2)
+
+    def test_label_zpl_options(self):
+        obs = label_zpl('000012345', label_width=100, top=5, height=40,
+                        module_width=3)
+        self.assertIn('^PW100^LH0,0^FO0,5^BY3^BCN,40,', obs)
+
+    def test_label_zpl_escapes(self):
+        obs = label_zpl('a^b_c~d')
+        self.assertIn('^FDa_5Eb_5Fc_7Ed^FS', obs)
+
+    def test_iter_barcodes_zpl(self):
+        obs = list(iter_barcodes_zpl(self.barcodes, labels_per_chunk=10))
+        self.assertEqual([c.count('^XA') for c in obs], [10, 10, 5])
+        self.assertEqual(''.join(obs), build_barcodes_zpl(self.barcodes))
+
+    def test_build_barcodes_zpl(self):
+        obs = build_barcodes_zpl(self.barcodes, height=60)
+        self.assertEqual(re.findall(r'\^FD(\d+)\^FS', obs), self.barcodes)
+        self.assertEqual(obs.count('^BCN,60,'), 25)
+        self.assertEqual(build_barcodes_zpl([]), '')
+
+
+if __name__ == '__main__':
+    main()
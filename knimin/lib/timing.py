@@ -0,0 +1,73 @@
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from json import dumps
+from time import time
+
+
+class StageTimer(object):
+    """Collects wall clock timings and counters for the stages of a job
+
+    Attributes
+    ----------
+    stages : OrderedDict
+        Seconds spent in each stage, in the order the stages were first
+        entered. Entering a stage more than once adds to its total.
+    counts : defaultdict of int
+        Named counters, e.g. rows fetched or bytes written
+
+    Notes
+    -----
+    Stages can be nested, so the time of an inner stage (e.g. geocoding) is
+    also included in the time of the stage that encloses it.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counts = defaultdict(int)
+        self._created = time()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to the stage total
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time() - start
+
+    def count(self, name, value=1):
+        """Adds value to the named counter
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter
+        value : int, optional
+            Amount to add to the counter. Default 1
+        """
+        self.counts[name] += value
+
+    def report(self):
+        """Builds the timing report
+
+        Returns
+        -------
+        dict
+            Report in the form
+            {'total_seconds': float, 'stages': {stage: seconds, ...},
+             'counts': {counter: value, ...}}
+        """
+        return {
+            'total_seconds': round(time() - self._created, 6),
+            'stages': OrderedDict((name, round(seconds, 6))
+                                  for name, seconds in self.stages.items()),
+            'counts': dict(self.counts)}
+
+    def to_json(self):
+        """Returns the timing report as a JSON formatted string"""
+        return dumps(self.report(), indent=4)
@@ -122,6 +122,83 @@ The American Gut Project
     return '\n'.join(text)
 
 
+def kit_id_format(kit_id_length=5, tag=None):
+    """Works out the form of kit IDs made with a tag
+
+    Parameters
+    ----------
+    kit_id_length : int, optional
+        number of characters in base kit_id created, default 5
+    tag : str, optional
+        tag to prepend to kit_id, defaut none. Maximum 4 characters
+
+    Returns
+    -------
+    tuple of (str, int)
+        The prefix of the kit IDs, the tag and an underscore if given, and
+        the number of random characters that follow it
+
+    Raises
+    ------
+    ValueError
+        Tag is more than 4 characters long
+
+    Notes
+    -----
+    Kit IDs are at most 9 characters long, so the number of random
+    characters is reduced to fit the tag in.
+    """
+    if tag is not None:
+        if len(tag) > 4:
+            raise ValueError("Tag must be 4 or less characters")
+        if (kit_id_length + len(tag) + 1) > 9:
+            # we have a 9 char limit so reduce the kit_id_length
+            kit_id_length = 8 - len(tag)
+        return tag + '_', kit_id_length
+    return '', kit_id_length
+
+
+def kit_id_keyspace(kit_id_length=5, tag=None):
+    """Number of different kit IDs that can be made with a tag
+
+    Parameters
+    ----------
+    kit_id_length : int, optional
+        number of characters in base kit_id created, default 5
+    tag : str, optional
+        tag to prepend to kit_id, defaut none. Maximum 4 characters
+
+    Returns
+    -------
+    int
+        Number of possible kit IDs
+    """
+    _, kit_id_length = kit_id_format(kit_id_length, tag)
+    return len(KIT_ALPHA) ** kit_id_length
+
+
+def make_kit_ids(num_ids, kit_id_length=5, tag=None):
+    """Generates random candidate kit IDs
+
+    Parameters
+    ----------
+    num_ids : int
+        Number of kit IDs to create
+    kit_id_length : int, optional
+        number of characters in base kit_id created, default 5
+    tag : str, optional
+        tag to prepend to kit_id, defaut none. Maximum 4 characters
+
+    Returns
+    -------
+    list
+        Kit IDs, which may already be in use or repeat each other
+    """
+    prefix, kit_id_length = kit_id_format(kit_id_length, tag)
+    return [prefix + ''.join([choice(KIT_ALPHA) for i in range(kit_id_length)])
+            for _ in range(num_ids)]
+
+
 def make_valid_kit_ids(num_ids, obs_kit_ids, kit_id_length=5, tag=None):
     """Generates new unique kit IDs
 
@@ -152,38 +229,64 @@ def make_valid_kit_ids(num_ids, obs_kit_ids, kit_id_length=5, tag=None):
     If id length is > 9, it will be set to 9. This length includes the
     passed kit_id_length + tag length + 1 for an underscore seperator.
     Because of this, kit_id_length should be kept short.
-    """
-
-    if tag is not None:
-        if len(tag) > 4:
-            raise ValueError("Tag must be 4 or less characters")
-        if (kit_id_length + len(tag) + 1) > 9:
-            # we have a 9 char limit so reduce the kit_id_length
-            kit_id_length = 8 - len(tag)
-        tag += '_'
-    else:
-        tag = ''
 
-    if kit_id_length > len(KIT_ALPHA)**kit_id_length:
+    KniminAccess.allocate_kit_ids checks the IDs against the database
+    without loading every used kit ID.
+    """
+    if num_ids > kit_id_keyspace(kit_id_length, tag):
         raise ValueError("More kits requested than possible kit ID combos!")
 
-    def make_kit_id(kit_id_length, tag):
-        kit_id = ''.join([choice(KIT_ALPHA) for i in range(kit_id_length)])
-        kit_id = tag + kit_id
-        return kit_id
-
     # Create the new kit IDs
     new_ids = []
     for i in range(num_ids):
-        kit_id = make_kit_id(kit_id_length, tag)
+        kit_id = make_kit_ids(1, kit_id_length, tag)[0]
         while kit_id in obs_kit_ids:
-            kit_id = make_kit_id(kit_id_length, tag)
+            kit_id = make_kit_ids(1, kit_id_length, tag)[0]
         new_ids.append(kit_id)
         obs_kit_ids.add(kit_id)
 
     return new_ids
 
 
+def parse_kit_counts(lines):
+    """Reads kit IDs and numbers of barcodes to add to each kit
+
+    Parameters
+    ----------
+    lines : iterable of str
+        One kit per line, the kit ID then optionally the number of barcodes,
+        separated by a tab, comma or spaces. Blank lines and lines starting
+        with # are skipped
+
+    Returns
+    -------
+    list of tuple of (str, int)
+        The kit IDs and numbers of barcodes, in the order given. The number
+        is 1 if not given
+
+    Raises
+    ------
+    ValueError
+        A line has more than two fields, or a number that is not a whole
+        number above 0
+    """
+    kit_counts = []
+    for num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.replace(',', ' ').split()
+        if len(fields) > 2:
+            raise ValueError("Line %d: expected a kit ID and number of "
+                             "barcodes, got '%s'" % (num, line))
+        count = fields[1] if len(fields) == 2 else '1'
+        if not count.isdigit() or int(count) < 1:
+            raise ValueError("Line %d: number of barcodes must be a whole "
+                             "number above 0, got '%s'" % (num, count))
+        kit_counts.append((str(fields[0]), int(count)))
+    return kit_counts
+
+
 def make_passwd(passwd_length=8):
     """Generate a new password
     """
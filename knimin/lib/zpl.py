@@ -0,0 +1,88 @@
+"""Writes barcode labels as ZPL, for Zebra thermal label printers
+
+The printer draws the Code 128 barcodes itself with its ^BC command, so
+labels are just text, with nothing rasterized here.
+"""
+from knimin.lib.code128 import code128_bars
+
+# defaults for 2in x 1in labels on a 203dpi printer, in dots
+LABEL_WIDTH = 406
+LABEL_TOP = 30
+BAR_HEIGHT = 100
+MODULE_WIDTH = 2
+LABELS_PER_CHUNK = 1000
+
+# characters with a meaning in ZPL field data, written as ^FH hex escapes
+_ESCAPES = {'_': '_5F', '^': '_5E', '~': '_7E'}
+
+
+def label_zpl(barcode, label_width=LABEL_WIDTH, top=LABEL_TOP,
+              height=BAR_HEIGHT, module_width=MODULE_WIDTH):
+    """Makes the ZPL printing a barcode on a label
+
+    Parameters
+    ----------
+    barcode : str
+        The barcode
+    label_width : int, optional
+        Width of the label in dots, the barcode is centered on it. Default
+        LABEL_WIDTH
+    top : int, optional
+        Dots above the barcode. Default LABEL_TOP
+    height : int, optional
+        Height of the bars in dots. Default BAR_HEIGHT
+    module_width : int, optional
+        Width of the narrowest bar in dots. Default MODULE_WIDTH
+
+    Returns
+    -------
+    str
+        The label format, from ^XA to ^XZ, with the barcode printed in Code
+        128 with its text underneath
+    """
+    width = code128_bars(barcode, module_width)[1]
+    left = max((label_width - width) // 2, 0)
+    data = ''.join(_ESCAPES.get(c, c) for c in barcode)
+    return ('^XA^PW%d^LH0,0^FO%d,%d^BY%d^BCN,%d,Y,N,N,A^FH_^FD%s^FS^XZ\n'
+            % (label_width, left, top, module_width, height, data))
+
+
+def iter_barcodes_zpl(barcodes, labels_per_chunk=LABELS_PER_CHUNK,
+                      **kwargs):
+    """Makes the ZPL printing barcodes, a chunk at a time
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes, printed one per label
+    labels_per_chunk : int, optional
+        Number of labels in each chunk. Default LABELS_PER_CHUNK
+    kwargs
+        Passed on to label_zpl
+
+    Returns
+    -------
+    iterator of str
+        Chunks of ZPL, to send to the printer or a download as they are made
+    """
+    for i in range(0, len(barcodes), labels_per_chunk):
+        yield ''.join(label_zpl(b, **kwargs)
+                      for b in barcodes[i:i + labels_per_chunk])
+
+
+def build_barcodes_zpl(barcodes, **kwargs):
+    """Makes the ZPL printing barcodes
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes, printed one per label
+    kwargs
+        Passed on to label_zpl
+
+    Returns
+    -------
+    str
+        The ZPL, one label format per barcode
+    """
+    return ''.join(iter_barcodes_zpl(barcodes, **kwargs))
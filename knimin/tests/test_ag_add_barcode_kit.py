@@ -0,0 +1,73 @@
+from unittest import main
+import re
+
+from knimin import db
+from knimin.tests.tornado_test_base import TestHandlerBase
+
+
+class TestAGAddBarcodeKitHandler(TestHandlerBase):
+    def setUp(self):
+        super(TestAGAddBarcodeKitHandler, self).setUp()
+        self.access = [a for a, name in db.get_access_levels()
+                       if name == 'AG kits']
+        self.new = db.create_barcodes(3)
+        self.added = []
+
+    def tearDown(self):
+        if self.added:
+            db._detach_from_kits(self.added)
+            db._unassign_barcodes(self.added)
+        db._delete_barcodes(self.new)
+        super(TestAGAddBarcodeKitHandler, self).tearDown()
+
+    def _added(self, body):
+        """The barcodes of each kit in the table of added barcodes"""
+        added = [(k, bcs.split(', ')) for k, bcs in
+                 re.findall(r'<tr><td>(\S+)</td><td>([\d, ]+)</td></tr>',
+                            body)]
+        self.added.extend(b for _, bcs in added for b in bcs)
+        return added
+
+    def test_get(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.get('/ag_add_barcode_kit/')
+        self.assertEqual(response.code, 200)
+        self.assertIn('<input type="text" name="kit_id" id="kit_id">',
+                      response.body)
+        self.assertIn('name="kits_file"', response.body)
+
+    def test_post(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_add_barcode_kit/',
+                             {'kit_id': 'tst_IueFX', 'num_barcodes': '2'})
+        self.assertEqual(response.code, 200)
+        obs = self._added(response.body)
+        self.assertEqual([(k, len(bcs)) for k, bcs in obs],
+                         [('tst_IueFX', 2)])
+
+    def test_post_bulk(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_add_barcode_kit/',
+                             {'kits': 'tst_IueFX\t2\ntst_IueFX'})
+        self.assertEqual(response.code, 200)
+        self.assertIn('Barcodes Added to 2 kit(s)', response.body)
+        obs = self._added(response.body)
+        self.assertEqual([(k, len(bcs)) for k, bcs in obs],
+                         [('tst_IueFX', 2), ('tst_IueFX', 1)])
+
+    def test_post_bulk_unknown_kit(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_add_barcode_kit/',
+                             {'kits': 'tst_IueFX\t2\nnotakit\t1'})
+        self.assertEqual(response.code, 200)
+        self.assertIn('ERROR! Kit IDs do not exist: notakit', response.body)
+        self.assertEqual(self._added(response.body), [])
+        self.assertEqual(db.get_unassigned_barcodes()[-3:], self.new)
+
+
+if __name__ == '__main__':
+    main()
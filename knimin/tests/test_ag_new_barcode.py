@@ -0,0 +1,64 @@
+from unittest import main
+
+from knimin import db
+from knimin.tests.tornado_test_base import TestHandlerBase
+
+
+class TestBarcodeDownloadBase(TestHandlerBase):
+    def setUp(self):
+        super(TestBarcodeDownloadBase, self).setUp()
+        self.access = [a for a, name in db.get_access_levels()
+                       if name == 'Barcodes']
+        self.barcodes = ['%09d' % i for i in range(1, 1502)]
+
+
+class TestAGBarcodePrintoutHandler(TestBarcodeDownloadBase):
+    def test_post_not_authed(self):
+        self.mock_login()
+        response = self.post('/ag_new_barcode/download/',
+                             {'barcodes': '000000001'})
+        self.assertEqual(response.code, 403)
+
+    def test_post(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_new_barcode/download/',
+                             {'barcodes': ','.join(self.barcodes[:40])})
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.body.startswith('%PDF-1.4'))
+        self.assertEqual(response.body.count('/Type /Page '), 2)
+        self.assertIn('/Subtype /Image', response.body)
+
+    def test_post_vector(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_new_barcode/download/',
+                             {'barcodes': ','.join(self.barcodes[:40]),
+                              'vector': '1'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body.count('/Type /Page '), 2)
+        self.assertNotIn('/Subtype /Image', response.body)
+
+
+class TestAGBarcodeZPLHandler(TestBarcodeDownloadBase):
+    def test_post_not_authed(self):
+        self.mock_login()
+        response = self.post('/ag_new_barcode/zpl/',
+                             {'barcodes': '000000001'})
+        self.assertEqual(response.code, 403)
+
+    def test_post(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_new_barcode/zpl/',
+                             {'barcodes': ','.join(self.barcodes)})
+        self.assertEqual(response.code, 200)
+        self.assertIn('filename=barcodes.zpl',
+                      response.headers['Content-Disposition'])
+        # streamed in more than one chunk
+        self.assertEqual(response.body.count('^XA'), 1501)
+        self.assertIn('^FD000001501^FS^XZ\n', response.body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from unittest import main
+from json import loads
+
+from knimin import db
+from knimin.tests.tornado_test_base import TestHandlerBase
+
+
+class TestAGNewKitHandler(TestHandlerBase):
+    def setUp(self):
+        super(TestAGNewKitHandler, self).setUp()
+        self.access = [a for a, name in db.get_access_levels()
+                       if name == 'AG kits']
+        self.new = db.create_barcodes(3)
+        self.kits = []
+
+    def tearDown(self):
+        if self.kits:
+            kit_ids = tuple(k['kit_id'] for k in self.kits)
+            barcodes = [b for k in self.kits for b in k['barcodes']]
+            db._con.execute("DELETE FROM ag.ag_handout_barcodes "
+                            "WHERE kit_id IN %s", [kit_ids])
+            db._con.execute("DELETE FROM ag.ag_handout_kits "
+                            "WHERE kit_id IN %s", [kit_ids])
+            db._unassign_barcodes(barcodes)
+        db._delete_barcodes(self.new)
+        super(TestAGNewKitHandler, self).tearDown()
+
+    def test_post_no_access(self):
+        self.mock_login()
+        db.alter_access_levels('test', [])
+        response = self.post('/ag_new_kit/', 'tag=tstn&swabs=1&kits=1')
+        self.assertEqual(response.code, 403)
+
+    def test_post(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/ag_new_kit/',
+                             'tag=tstn&swabs=1&kits=2&swabs=1&kits=1')
+        self.assertEqual(response.code, 200)
+        # the kits are only written once the coroutine creating them is done
+        obs = loads(response.body)
+        self.kits = [dict(zip(obs['fields'].split(','), k))
+                     for k in obs['kitinfo']]
+        self.assertEqual(obs['fields'],
+                         'kit_id,password,verification_code,barcodes')
+        self.assertEqual(len(self.kits), 3)
+        for kit in self.kits:
+            self.assertTrue(kit['kit_id'].startswith('tstn_'))
+            self.assertEqual(len(kit['barcodes']), 1)
+
+
+if __name__ == '__main__':
+    main()
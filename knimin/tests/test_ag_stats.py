@@ -32,6 +32,15 @@ class TestAGStatsHandler(TestHandlerBase):
             'Total male participants</td><td>2577', response.body)
         self.assertIn(
             'Total female participants</td><td>3107', response.body)
+        self.assertIn('minutes ago', response.body)
+
+    def test_stats_page_refresh(self):
+        self.mock_login()
+        response = self.get('/ag_stats/?refresh=1')
+        self.assertEqual(response.code, 200)
+        self.assertIn('(0 minutes ago)', response.body)
+        self.assertIn(
+            'Total handout kits</td><td>3609', response.body)
 
 if __name__ == '__main__':
     main()
@@ -268,5 +268,85 @@ Thank you for your participation!
                 u'persøn', '000001018', 'UNKNOWN', '2016-12-14', '6:52 pm')
 
 
+class TestBarcodeCheckinHandler(TestHandlerBase):
+    def setUp(self):
+        super(TestBarcodeCheckinHandler, self).setUp()
+        self.access = [a for a, name in db.get_access_levels()
+                       if name == 'Scan Barcodes']
+        self.new = db.create_barcodes(2)
+        self.barcodes = db.add_barcodes_to_kit(
+            '0060a301-e5c0-6a4e-e050-8a800c5d49b7', 2)
+
+    def tearDown(self):
+        db._delete_queued_emails(self.barcodes)
+        db._detach_from_kits(self.barcodes)
+        db._unassign_barcodes(self.barcodes)
+        db._delete_barcodes(self.new)
+        super(TestBarcodeCheckinHandler, self).tearDown()
+
+    def test_get(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.get('/barcode_util/checkin/')
+        self.assertEqual(response.code, 200)
+        self.assertIn('name="scans_file"', response.body)
+        self.assertIn('<option value="UNKNOWN">UNKNOWN</option>',
+                      response.body)
+
+    def test_get_no_access(self):
+        self.mock_login()
+        db.alter_access_levels('test', [])
+        response = self.get('/barcode_util/checkin/')
+        self.assertEqual(response.code, 403)
+
+    def test_post(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        scans = '%s\t2016-01-20\n%s\t2016-01-21\t\tmoldy\n' % tuple(
+            self.barcodes)
+        response = self.post('/barcode_util/checkin/',
+                             {'scans': scans, 'project': 'UNKNOWN',
+                              'send_mail': 'on'})
+        self.assertEqual(response.code, 200)
+        self.assertIn('2 barcode(s) checked in, 2 email(s) queued',
+                      response.body)
+        self.assertIn(', '.join(self.barcodes), response.body)
+        details = db.get_barcode_details(self.barcodes[1])
+        self.assertEqual(details['status'], 'Received')
+        self.assertEqual(str(details['scan_date']), '2016-01-21')
+        self.assertIn('UNKNOWN', db.getBarcodeProjType(self.barcodes[1])[0])
+        self.assertEqual(db.getAGBarcodeDetails(self.barcodes[1])['moldy'],
+                         'Y')
+
+    def test_post_no_mail(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/barcode_util/checkin/',
+                             {'scans': '\n'.join(self.barcodes)})
+        self.assertEqual(response.code, 200)
+        self.assertIn('2 barcode(s) checked in, 0 email(s) queued',
+                      response.body)
+
+    def test_post_unknown_barcode(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        before = db.get_barcode_details(self.barcodes[0])
+        response = self.post('/barcode_util/checkin/',
+                             {'scans': '%s\t2016-01-20\nnotabarcode'
+                              % self.barcodes[0], 'send_mail': 'on'})
+        self.assertEqual(response.code, 200)
+        self.assertIn('ERROR! Barcodes do not exist: notabarcode',
+                      response.body)
+        self.assertEqual(db.get_barcode_details(self.barcodes[0]), before)
+
+    def test_post_bad_line(self):
+        self.mock_login()
+        db.alter_access_levels('test', self.access)
+        response = self.post('/barcode_util/checkin/',
+                             {'scans': '%s\tyesterday' % self.barcodes[0]})
+        self.assertEqual(response.code, 200)
+        self.assertIn('ERROR! Line 1: dates must look like', response.body)
+
+
 if __name__ == '__main__':
     main()
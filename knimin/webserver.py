@@ -1,27 +1,34 @@
 from os.path import dirname, join
 from base64 import b64encode
 from uuid import uuid4
+from functools import partial
 
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.web import Application, StaticFileHandler
 from tornado.options import define, options, parse_command_line
 
+from knimin import db
 from knimin.lib.configuration import config
+from knimin.lib.background import run_in_thread, start_process_pool
+from knimin.lib.geocode_worker import get_worker
 from knimin.handlers.base import MainHandler, NoPageHandler
 from knimin.handlers.auth_handlers import AuthLoginHandler, AuthLogoutHandler
 from knimin.handlers.ag_search import AGSearchHandler
 from knimin.handlers.logged_in_index import LoggedInIndexHandler
-from knimin.handlers.barcode_util import BarcodeUtilHandler
-from knimin.handlers.ag_stats import AGStatsHandler
+from knimin.handlers.barcode_util import (BarcodeUtilHandler,
+                                          BarcodeCheckinHandler)
+from knimin.handlers.ag_stats import AGStatsHandler, stats_snapshot
 from knimin.handlers.ag_edit_participant import AGEditParticipantHandler
 from knimin.handlers.ag_new_kit import AGNewKitHandler, AGNewKitDLHandler
 from knimin.handlers.ag_edit_kit import AGEditKitHandler
 from knimin.handlers.ag_new_barcode import (AGNewBarcodeHandler,
                                             AGBarcodePrintoutHandler,
+                                            AGBarcodeZPLHandler,
                                             AGBarcodeAssignedHandler)
 from knimin.handlers.ag_edit_barcode import AGEditBarcodeHandler
-from knimin.handlers.ag_update_geocode import AGUpdateGeocodeHandler
+from knimin.handlers.ag_update_geocode import (AGUpdateGeocodeHandler,
+                                               geocode_stats_snapshot)
 from knimin.handlers.ag_pulldown import (
     AGPulldownHandler, AGPulldownDLHandler, UpdateEBIStatusHandler)
 from knimin.handlers.ag_add_barcode_kit import AGAddBarcodeKitHandler
@@ -30,7 +37,8 @@ from knimin.handlers.ag_get_participant_names import (AGNamesHandler,
 from knimin.handlers.ag_third_party import (AGThirdPartyHandler,
                                             AGNewThirdPartyHandler)
 from knimin.handlers.ag_consent_check import AGConsentCheckHandler
-from knimin.handlers.projects_summary import ProjectsSummaryHandler
+from knimin.handlers.projects_summary import (ProjectsSummaryHandler,
+                                              summary_snapshot)
 from knimin.handlers.access_control import AGEditAccessHandler
 from knimin.handlers.ag_results_ready import AGResultsReadyHandler
 
@@ -54,6 +62,7 @@ class WebApplication(Application):
             (r"/logged_in_index/", LoggedInIndexHandler),
             (r"/ag_search/", AGSearchHandler),
             (r"/barcode_util/", BarcodeUtilHandler),
+            (r"/barcode_util/checkin/", BarcodeCheckinHandler),
             (r"/ag_add_barcode_kit/", AGAddBarcodeKitHandler),
             (r"/ag_stats/", AGStatsHandler),
             (r"/ag_edit_participant/", AGEditParticipantHandler),
@@ -70,6 +79,7 @@ class WebApplication(Application):
             (r"/ag_participant_names/", AGNamesHandler),
             (r"/ag_participant_names/download/", AGNamesDLHandler),
             (r"/ag_new_barcode/download/", AGBarcodePrintoutHandler),
+            (r"/ag_new_barcode/zpl/", AGBarcodeZPLHandler),
             (r"/ag_new_barcode/assigned/", AGBarcodeAssignedHandler),
             (r"/ag_third_party/data/", AGThirdPartyHandler),
             (r"/ag_third_party/add/", AGNewThirdPartyHandler),
@@ -88,6 +98,8 @@ class WebApplication(Application):
 
 
 def main():
+    # forked before any threads are running, and reused by every request
+    start_process_pool()
     # format looks like labadmin_8888.log
     prefix = join(config.base_log_dir, "labadmin_%d.log" % options.port)
     options.log_file_prefix = prefix
@@ -95,6 +107,24 @@ def main():
     http_server = HTTPServer(WebApplication())
     http_server.listen(options.port)
     print("Tornado started on port %d" % options.port)
+    if config.geocode_worker_interval > 0:
+        # pick up geocoding runs left unfinished by a restart or the quota
+        worker = get_worker()
+        resume = partial(run_in_thread, worker.tick)
+        IOLoop.instance().add_callback(resume)
+        PeriodicCallback(resume, config.geocode_worker_interval * 1000).start()
+    if config.email_queue_interval > 0:
+        # send the emails queued by batch check-in
+        send = partial(run_in_thread, db.send_queued_emails,
+                       config.email_queue_batch_size)
+        PeriodicCallback(send, config.email_queue_interval * 1000).start()
+    if config.stats_max_age > 0:
+        # keep the statistics pages fresh without making anyone wait
+        for snapshot in (stats_snapshot, geocode_stats_snapshot,
+                         summary_snapshot):
+            refresh = partial(run_in_thread, snapshot.refresh)
+            IOLoop.instance().add_callback(refresh)
+            PeriodicCallback(refresh, config.stats_max_age * 1000 / 2).start()
     IOLoop.instance().start()
 
 